@@ -0,0 +1,17 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = '13b0df8c4d58'
+down_revision = 'bc9aedc20fb8'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('order_book_state', sa.Column('trade_seq', sa.BigInteger(), server_default='0', nullable=False))
+    op.add_column('transactions', sa.Column('seq', sa.BigInteger(), nullable=True))
+    op.create_index('ix_transactions_ticker_seq', 'transactions', ['ticker', 'seq'], unique=True)
+
+def downgrade():
+    op.drop_index('ix_transactions_ticker_seq', table_name='transactions')
+    op.drop_column('transactions', 'seq')
+    op.drop_column('order_book_state', 'trade_seq')
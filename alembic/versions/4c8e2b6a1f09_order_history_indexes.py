@@ -0,0 +1,19 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = '4c8e2b6a1f09'
+down_revision = '7f3a91c2d5e4'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Keyset pages of a user's orders, newest first: all orders, and the open ones only
+    op.execute("CREATE INDEX ix_orders_user_id_created_at ON orders (user_id, created_at DESC, id DESC)")
+    op.execute(
+        "CREATE INDEX ix_orders_user_id_open_created_at ON orders (user_id, created_at DESC, id DESC) "
+        "WHERE status IN ('NEW', 'PARTIALLY_EXECUTED')"
+    )
+
+def downgrade():
+    op.drop_index('ix_orders_user_id_open_created_at', table_name='orders')
+    op.drop_index('ix_orders_user_id_created_at', table_name='orders')
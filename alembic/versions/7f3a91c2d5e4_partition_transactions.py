@@ -0,0 +1,97 @@
+from datetime import date
+from alembic import op
+import sqlalchemy as sa
+
+revision = '7f3a91c2d5e4'
+down_revision = '13b0df8c4d58'
+branch_labels = None
+depends_on = None
+
+PARTITIONS_AHEAD = 3
+
+def _next_month(day):
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+def upgrade():
+    bind = op.get_bind()
+    op.execute("""
+        CREATE TABLE transactions_partitioned (
+            id UUID NOT NULL,
+            buy_order_id UUID,
+            sell_order_id UUID,
+            ticker VARCHAR(10) NOT NULL,
+            amount INTEGER NOT NULL,
+            price INTEGER NOT NULL,
+            seq BIGINT NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            updated_at TIMESTAMP WITH TIME ZONE
+        ) PARTITION BY RANGE (created_at)
+    """)
+
+    # One partition per month from the oldest trade up to a few months ahead
+    oldest = bind.execute(sa.text("SELECT min(created_at) FROM transactions")).scalar()
+    month = (oldest.date() if oldest else date.today()).replace(day=1)
+    last = date.today().replace(day=1)
+    for _ in range(PARTITIONS_AHEAD):
+        last = _next_month(last)
+    while month <= last:
+        op.execute(
+            f"CREATE TABLE transactions_p{month:%Y%m} PARTITION OF transactions_partitioned "
+            f"FOR VALUES FROM ('{month}') TO ('{_next_month(month)}')"
+        )
+        month = _next_month(month)
+    op.execute("CREATE TABLE transactions_default PARTITION OF transactions_partitioned DEFAULT")
+
+    # Trades from before per-ticker sequencing are numbered first and the rest shifted
+    # after them, so seq is set on every row and the (created_at, seq) cursor is total
+    op.execute("""
+        INSERT INTO transactions_partitioned
+            (id, buy_order_id, sell_order_id, ticker, amount, price, seq, created_at, updated_at)
+        SELECT id, buy_order_id, sell_order_id, ticker, amount, price,
+               CASE WHEN seq IS NULL
+                    THEN row_number() OVER (PARTITION BY ticker, seq IS NULL ORDER BY created_at, id)
+                    ELSE seq + count(*) FILTER (WHERE seq IS NULL) OVER (PARTITION BY ticker)
+               END,
+               coalesce(created_at, now()), updated_at
+        FROM transactions
+    """)
+    op.execute("""
+        INSERT INTO order_book_state (ticker, trade_seq)
+        SELECT ticker, count(*) FROM transactions WHERE seq IS NULL GROUP BY ticker
+        ON CONFLICT (ticker) DO UPDATE SET trade_seq = order_book_state.trade_seq + excluded.trade_seq
+    """)
+
+    op.drop_table('transactions')
+    op.execute("ALTER TABLE transactions_partitioned RENAME TO transactions")
+    op.create_primary_key('transactions_pkey', 'transactions', ['id', 'created_at'])
+    op.create_foreign_key(None, 'transactions', 'orders', ['buy_order_id'], ['id'], ondelete='CASCADE')
+    op.create_foreign_key(None, 'transactions', 'orders', ['sell_order_id'], ['id'], ondelete='CASCADE')
+    op.execute("CREATE INDEX ix_transactions_ticker_created_at ON transactions (ticker, created_at DESC, seq DESC)")
+    op.create_index('ix_transactions_ticker_seq', 'transactions', ['ticker', 'seq'])
+
+def downgrade():
+    op.create_table('transactions_heap',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('buy_order_id', sa.UUID(), nullable=True),
+    sa.Column('sell_order_id', sa.UUID(), nullable=True),
+    sa.Column('ticker', sa.String(length=10), nullable=False),
+    sa.Column('amount', sa.Integer(), nullable=False),
+    sa.Column('price', sa.Integer(), nullable=False),
+    sa.Column('seq', sa.BigInteger(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['buy_order_id'], ['orders.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['sell_order_id'], ['orders.id'], ondelete='CASCADE'),
+    )
+    op.execute("""
+        INSERT INTO transactions_heap
+            (id, buy_order_id, sell_order_id, ticker, amount, price, seq, created_at, updated_at)
+        SELECT id, buy_order_id, sell_order_id, ticker, amount, price, seq, created_at, updated_at
+        FROM transactions
+    """)
+    op.drop_table('transactions')
+    op.execute("ALTER TABLE transactions_heap RENAME TO transactions")
+    op.create_primary_key('transactions_pkey', 'transactions', ['id'])
+    op.create_index('ix_transactions_ticker', 'transactions', ['ticker'])
+    op.create_index('ix_transactions_created_at', 'transactions', ['created_at'])
+    op.create_index('ix_transactions_ticker_seq', 'transactions', ['ticker', 'seq'], unique=True)
@@ -0,0 +1,31 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = '9d2f5a7c3b81'
+down_revision = '4c8e2b6a1f09'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table('balance_ledger',
+    sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+    sa.Column('user_id', sa.UUID(), nullable=False),
+    sa.Column('ticker', sa.String(length=10), nullable=False),
+    sa.Column('amount', sa.Integer(), nullable=False),
+    sa.Column('frozen', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_balance_ledger_user_id_ticker', 'balance_ledger', ['user_id', 'ticker'])
+
+def downgrade():
+    # Fold whatever has not been compacted yet before dropping the ledger
+    op.execute("""
+        INSERT INTO balances (user_id, ticker, amount, frozen)
+        SELECT user_id, ticker, sum(amount), sum(frozen) FROM balance_ledger GROUP BY user_id, ticker
+        ON CONFLICT (user_id, ticker) DO UPDATE
+        SET amount = balances.amount + excluded.amount, frozen = balances.frozen + excluded.frozen
+    """)
+    op.drop_index('ix_balance_ledger_user_id_ticker', table_name='balance_ledger')
+    op.drop_table('balance_ledger')
@@ -0,0 +1,21 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'bc9aedc20fb8'
+down_revision = '2533a9b27361'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table('order_book_state',
+    sa.Column('ticker', sa.String(length=10), nullable=False),
+    sa.Column('book_seq', sa.BigInteger(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('ticker')
+    )
+
+    # Resting-order scan used to (re)load the in-memory book
+    op.create_index('ix_orders_ticker_status_created_at', 'orders', ['ticker', 'status', 'created_at'])
+
+def downgrade():
+    op.drop_index('ix_orders_ticker_status_created_at', table_name='orders')
+    op.drop_table('order_book_state')
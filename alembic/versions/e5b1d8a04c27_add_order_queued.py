@@ -0,0 +1,17 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'e5b1d8a04c27'
+down_revision = '9d2f5a7c3b81'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('orders', sa.Column('queued', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+    # Sweep of queued orders nobody matched: only ever a handful of rows
+    op.execute("CREATE INDEX ix_orders_queued_created_at ON orders (created_at) WHERE queued")
+
+def downgrade():
+    op.drop_index('ix_orders_queued_created_at', table_name='orders')
+    op.drop_column('orders', 'queued')
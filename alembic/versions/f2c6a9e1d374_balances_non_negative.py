@@ -0,0 +1,13 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = 'f2c6a9e1d374'
+down_revision = 'e5b1d8a04c27'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_check_constraint('ck_balances_non_negative', 'balances', 'frozen >= 0 AND amount >= 0')
+
+def downgrade():
+    op.drop_constraint('ck_balances_non_negative', 'balances', type_='check')
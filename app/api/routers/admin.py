@@ -1,13 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.responses import FileResponse
-from sqlalchemy import delete
+import os
+from datetime import datetime, timezone
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import FileResponse, StreamingResponse
+from sqlalchemy import delete, select
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.core.models.order import Order
+from app.core.models.order import Order, OrderStatus
 from app.core.models.transaction import Transaction
 from app.core.schemas.common import Ok
 from core.schemas.balance import BalanceOperation
-from core.database import get_db
+from core.database import get_db, pool_status
+from core.log_segments import log_store
 from core.dependencies import require_admin
+from core.invalidation import invalidation_bus
 from core.schemas.user import User
 from core.schemas.instrument import InstrumentCreate
 from repositories import (
@@ -16,14 +20,48 @@ from repositories import (
     instrument_repo,
     balance_repo
 )
+from services.instrument_catalog import instrument_catalog
+from services.order_book import order_books
+from services.order_matching import order_matching_service
 from uuid import UUID
 
 router = APIRouter(prefix="/api/v1/admin", tags=["admin"])
 
 
 @router.get("/logs", include_in_schema=False)
-async def get_logs(admin: User = Depends(require_admin)):
-    return FileResponse("/app/requests.log")
+async def get_logs(
+    tail: int | None = Query(None, ge=1, le=100_000),
+    since: datetime | None = None,
+    until: datetime | None = None,
+    admin: User = Depends(require_admin)
+):
+    # NDJSON request log lines within [since, until]; with no range, the last `tail` (default 1000)
+    if since is None and until is None and tail is None:
+        tail = 1000
+    lines = log_store.read(_utc(since), _utc(until), tail)
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+@router.get("/logs/segments", include_in_schema=False)
+async def list_log_segments(admin: User = Depends(require_admin)):
+    return log_store.segments()
+
+@router.get("/logs/segments/{name}", include_in_schema=False)
+async def get_log_segment(name: str, admin: User = Depends(require_admin)):
+    # FileResponse honours Range headers, so large segments can be fetched in parts
+    path = log_store.path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Segment not found")
+    return FileResponse(path, filename=name)
+
+def _utc(value: datetime | None) -> datetime | None:
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+@router.get("/pool")
+async def get_pool_status(admin: User = Depends(require_admin)):
+    # Connection pool of the worker that served this request
+    return {"pid": os.getpid(), **pool_status()}
 
 @router.delete("/user/{user_id}", response_model=User)
 async def delete_user(
@@ -34,9 +72,42 @@ async def delete_user(
     user = await user_repo.get(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    
-    await db.delete(user)
-    await db.commit()
+
+    # The user's resting orders go with it, so their books move like on a cancel. Done here rather
+    # than by the tickers' actors: their owners see the bumped sequence and reload once (rare)
+    resting = (await db.execute(
+        select(Order.id, Order.ticker, Order.direction, Order.price)
+        .where(
+            Order.user_id == user_id,
+            Order.status.in_([OrderStatus.NEW, OrderStatus.PARTIALLY_EXECUTED]),
+            Order.price != None
+        )
+    )).all()
+    all_tickers = sorted({ticker for _, ticker, _, _ in resting})
+    tickers = all_tickers if order_matching_service.in_memory else []
+    touched = {}
+    for _, ticker, direction, price in resting:
+        touched.setdefault(ticker, set()).add((direction, price))
+    try:
+        for ticker in tickers:
+            await order_books.sync(db, ticker)
+        seqs = await order_matching_service.bump_books(db, all_tickers)
+        await db.delete(user)
+        await db.flush()
+        levels = await order_matching_service.read_levels(db, seqs, touched)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        for ticker in tickers:
+            order_books.invalidate(ticker)
+        raise
+
+    for order_id, ticker, _, _ in resting:
+        if ticker in tickers:
+            order_books.get(ticker).remove(order_id)
+    for ticker in all_tickers:
+        await order_matching_service.publish(ticker, levels=levels.get(ticker))
+    await invalidation_bus.publish("user", user.api_key)
     return user
 
 
@@ -46,11 +117,12 @@ async def add_instrument(
     db: AsyncSession = Depends(get_db),
     user = Depends(require_admin)
 ):
-    existing = await instrument_repo.get_by_ticker(db, instrument_in.ticker)
+    existing = await instrument_catalog.get(instrument_in.ticker)
     if existing:
         raise HTTPException(status_code=400, detail="Instrument already exists")
 
     await instrument_repo.create(db=db, obj_in=instrument_in)
+    await invalidation_bus.publish("instrument", instrument_in.ticker)
     return {"success": True}
 
 @router.delete("/instrument/{ticker}", response_model=Ok)
@@ -83,6 +155,7 @@ async def delete_instrument(
     await db.execute(delete(Order).where(Order.ticker == ticker))
     await db.execute(delete(Transaction).where(Transaction.ticker == ticker))
     await db.commit()
+    await invalidation_bus.publish("instrument", ticker)
     return {"success": True}
 
 
@@ -97,7 +170,7 @@ async def deposit(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    instrument = await instrument_repo.get_by_ticker(db, payload.ticker)
+    instrument = await instrument_catalog.get(payload.ticker)
     if not instrument:
         raise HTTPException(status_code=404, detail="Instrument not found")
 
@@ -120,7 +193,7 @@ async def withdraw(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    instrument = await instrument_repo.get_by_ticker(db, payload.ticker)
+    instrument = await instrument_catalog.get(payload.ticker)
     if not instrument:
         raise HTTPException(status_code=404, detail="Instrument not found")
 
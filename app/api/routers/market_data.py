@@ -0,0 +1,52 @@
+import asyncio
+import json
+from contextlib import suppress
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status
+from services.instrument_catalog import instrument_catalog
+from services.market_data import Subscriber, level_list, market_data
+from services.order_book import order_books
+
+router = APIRouter(prefix="/api/v1/public", tags=["public"])
+
+@router.websocket("/ws/{ticker}")
+async def stream_market_data(websocket: WebSocket, ticker: str):
+    # Sends a "snapshot" first (and again whenever the client falls behind), then "book"
+    # steps that apply on top of it (prev_version == current version) and "trades".
+    if not await instrument_catalog.get(ticker):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Instrument not found")
+        return
+    await websocket.accept()
+    subscriber = market_data.subscribe(ticker)
+    sender = asyncio.create_task(_send_updates(websocket, subscriber))
+    receiver = asyncio.create_task(_discard_incoming(websocket))
+    try:
+        await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        sender.cancel()
+        receiver.cancel()
+        market_data.unsubscribe(subscriber)
+
+async def _send_updates(websocket: WebSocket, subscriber: Subscriber):
+    with suppress(WebSocketDisconnect, OSError):
+        while True:
+            message = await subscriber.get()
+            if message is None:
+                message = await _snapshot(subscriber)
+            await websocket.send_text(message)
+
+async def _discard_incoming(websocket: WebSocket):
+    with suppress(WebSocketDisconnect):
+        while True:
+            await websocket.receive_text()
+
+async def _snapshot(subscriber: Subscriber) -> str:
+    view = await order_books.l2(subscriber.ticker)
+    bids, asks = view.levels(None)
+    subscriber.resume(view.version)
+    return json.dumps({
+        "type": "snapshot",
+        "ticker": subscriber.ticker,
+        "version": view.version,
+        "bid_levels": level_list(bids),
+        "ask_levels": level_list(asks),
+    })
@@ -1,36 +1,83 @@
+import asyncio
 import logging
 from uuid import UUID, uuid4
 from typing import Union
 
-from fastapi import APIRouter, Body, Depends, HTTPException
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from pydantic import ValidationError
+from sqlalchemy import inspect
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from core.exceptions import InsufficientBalanceException
+from core.config import settings
+from core.database import get_private_read_db, read_session
+from core.exceptions import InsufficientBalanceException, MatchingUnavailableException
+from core.metrics import commit_duration
+from core.pagination import decode_cursor, encode_cursor
+from core.responses import FastJSONResponse
 from core.schemas.common import Ok
-from core.schemas.order import LimitOrder, LimitOrderBody, MarketOrder, MarketOrderBody, CreateOrderResponse, OrderResponse
+from core.schemas.order import (
+    BatchOrderResponse, BatchOrderResult, CreateOrderResponse, LimitOrder, LimitOrderBody,
+    MarketOrder, MarketOrderBody, OrderResponse
+)
 from core.models.order import Order, OrderStatus
 from repositories.order import OrderRepository
 from repositories.balance import BalanceRepository
-from repositories.instrument import InstrumentRepository
-from tasks.match_order import match_order_task
-from services.order_matching import order_matching_service
+from services.order_matching import FINAL_STATUSES, order_matching_service
+from services.matching_actor import matching_actors
+from services.instrument_catalog import instrument_catalog
+from services.matching_queue import matching_queue
 from core.dependencies import get_db, get_current_user
 
 router = APIRouter(prefix="/api/v1/order", tags=["order"])
 
 order_repo = OrderRepository()
 balance_repo = BalanceRepository()
-instrument_repo = InstrumentRepository()
 
 
 @router.get("", response_model=list[OrderResponse])
 async def get_orders(
-    db: AsyncSession = Depends(get_db),
+    limit: int | None = Query(None, ge=1, le=1000),
+    cursor: str | None = None,
+    db: AsyncSession = Depends(get_private_read_db),
     user = Depends(get_current_user)
 ):
-    orders = await order_repo.get_user_orders(db, user.id)
-    return [_build_order_response(order) for order in orders]
+    # Without `limit` every open order is returned, as before
+    orders = await order_repo.get_user_orders(
+        db, user.id, limit=limit, before=decode_cursor(cursor, UUID)
+    )
+    response = FastJSONResponse([_order_dict(order) for order in orders])
+    _set_next_cursor(response, orders, limit)
+    return response
+
+@router.get("/history", response_model=list[OrderResponse])
+async def get_order_history(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str | None = None,
+    db: AsyncSession = Depends(get_private_read_db),
+    user = Depends(get_current_user)
+):
+    orders = await order_repo.get_user_orders(
+        db, user.id, FINAL_STATUSES, limit, decode_cursor(cursor, UUID)
+    )
+    response = FastJSONResponse([_order_dict(order) for order in orders])
+    _set_next_cursor(response, orders, limit)
+    return response
+
+@router.get("/export")
+async def export_orders(user = Depends(get_current_user)):
+    # NDJSON of all orders, newest first; the body is written while rows are fetched
+    return StreamingResponse(_export_lines(user.id), media_type="application/x-ndjson")
+
+async def _export_lines(user_id: UUID):
+    # The request's session is closed before the body is streamed, so use a separate one
+    async with read_session(settings.REPLICA_MAX_LAG_PRIVATE_SECONDS) as db:
+        async for order in order_repo.stream_user_orders(db, user_id):
+            yield _build_order_response(order).model_dump_json(by_alias=True) + "\n"
+
+def _set_next_cursor(response: Response, orders: list, limit: int | None):
+    if limit is not None and len(orders) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(orders[-1].created_at, orders[-1].id)
 
 @router.get("/{order_id}", response_model=OrderResponse)
 async def get_order(
@@ -72,92 +119,244 @@ def _build_order_response(order):
             )
         )
 
+def _order_dict(order) -> dict:
+    # Same JSON as _build_order_response(order), without building the models. asyncpg
+    # returns its own UUID type, which orjson doesn't serialize, hence the str()
+    body = {
+        "direction": order.direction,
+        "ticker": order.ticker,
+        "qty": max(order.qty - order.filled, 0),
+    }
+    if order.price is not None:
+        body["price"] = order.price
+    return {
+        "id": str(order.id),
+        "status": order.status,
+        "user_id": str(order.user_id),
+        "timestamp": order.created_at,
+        "filled": order.filled,
+        "body": body,
+    }
+
 @router.delete("/{order_id}", response_model=Ok)
 async def cancel_order(
     order_id: UUID,
     db: AsyncSession = Depends(get_db),
     user=Depends(get_current_user)
 ):
-    order = await order_repo.get(db, order_id)
-    if not order or order.user_id != user.id:
-        raise HTTPException(status_code=404, detail="Order not found")
-    
-    if order.price is None:
-        raise HTTPException(status_code=400, detail="Market orders cannot be cancelled")
-
-    if order.status != OrderStatus.NEW:
-        raise HTTPException(status_code=400, detail="Only NEW limit orders can be cancelled")
-
-    remaining_qty = order.qty - order.filled
-    if remaining_qty > 0:
-        if order.direction == "BUY":
-            rub_to_return = remaining_qty * order.price
-            await balance_repo.unfreeze(db, order.user_id, "RUB", rub_to_return)
-        else:
-            await balance_repo.unfreeze(db, order.user_id, order.ticker, remaining_qty)
-
-    await order_repo.cancel(db, order)
+    if settings.MATCHING_MODE == "actor":
+        order = await order_repo.get(db, order_id)
+        if not order or order.user_id != user.id:
+            raise HTTPException(status_code=404, detail="Order not found")
+        try:
+            await matching_actors.cancel(order.ticker, order_id, user.id)
+        except MatchingUnavailableException as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    else:
+        await order_matching_service.cancel(db, order_id, user.id)
     return {"success": True}
 
 
 @router.post("", response_model=CreateOrderResponse)
 async def create_order(
+    response: Response,
     body: dict = Body(...),
     db: AsyncSession = Depends(get_db),
     user = Depends(get_current_user)
     ):
-    try:
-        if "price" in body:
-            parsed = LimitOrderBody(**body)
-            if parsed.qty <= 0 or parsed.price <= 0:
-                raise HTTPException(status_code=422, detail="qty and price must be > 0")
-        else:
-            parsed = MarketOrderBody(**body)
-            if parsed.qty <= 0:
-                raise HTTPException(status_code=422, detail="qty must be > 0")
-    except ValidationError as e:
-        raise HTTPException(status_code=422, detail=e.errors())
+    parsed = _parse_order_body(body)
 
     ticker = parsed.ticker.upper()
-    instrument = await instrument_repo.get_by_ticker(db, ticker)
+    instrument = await instrument_catalog.get(ticker)
     if not instrument:
         raise HTTPException(status_code=404, detail="Instrument not found")
-    order_id = uuid4()
+
+    if settings.MATCHING_MODE == "queue" and await matching_queue.depth(ticker) >= settings.MATCHING_QUEUE_MAX_DEPTH:
+        raise HTTPException(
+            status_code=503,
+            detail="Matching queue is full, retry later",
+            headers={"Retry-After": "1"}
+        )
 
     try:
-        if isinstance(parsed, LimitOrderBody):
-            if parsed.direction == "BUY":
-                await balance_repo.freeze(db, user.id, "RUB", parsed.qty * parsed.price)
-            else:
-                await balance_repo.freeze(db, user.id, ticker, parsed.qty)
-
-            order = Order(
-                id=order_id,
-                user_id=user.id,
-                status=OrderStatus.NEW,
-                direction=parsed.direction,
-                ticker=ticker,
-                qty=parsed.qty,
-                price=parsed.price,
-                filled=0
-            )
-        else: 
-            order = Order(
-                id=order_id,
-                user_id=user.id,
-                status=OrderStatus.NEW,
-                direction=parsed.direction,
-                ticker=ticker,
-                qty=parsed.qty,
-                price=None,
-                filled=0
-            )
+        order, reserve = _new_order(user.id, ticker, parsed)
+
+        if settings.MATCHING_MODE == "actor":
+            # The ticker's actor (in whichever worker holds it) freezes, inserts and matches
+            # the order inside its batch transaction
+            await matching_actors.submit(ticker, order, reserve)
+            return {"success": True, "order_id": order.id}
 
+        if reserve:
+            await balance_repo.freeze(db, user.id, *reserve)
         db.add(order)
-        await db.commit()
-        await order_matching_service.match_order(db, order)
+        with commit_duration.labels("order").time():
+            await db.commit()
+        if settings.MATCHING_MODE == "queue":
+            await _enqueue(order, response)
+        else:
+            await order_matching_service.match_order(db, order)
         return {"success": True, "order_id": order.id}
 
     except InsufficientBalanceException as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except MatchingUnavailableException as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+
+@router.post("/batch", response_model=BatchOrderResponse)
+async def create_orders_batch(
+    body: dict = Body(...),
+    db: AsyncSession = Depends(get_db),
+    user = Depends(get_current_user)
+):
+    # {"orders": [<order body>, ...]}: one freeze statement, one insert and one matching
+    # transaction per ticker. Results come back in request order.
+    bodies = body.get("orders")
+    if not isinstance(bodies, list) or not bodies:
+        raise HTTPException(status_code=422, detail="orders must be a non-empty list")
+    if len(bodies) > settings.ORDER_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=422, detail=f"At most {settings.ORDER_BATCH_MAX_SIZE} orders per batch")
+
+    results: list[BatchOrderResult | None] = [None] * len(bodies)
+    accepted = []
+    queue_full = {}
+    for index, order_body in enumerate(bodies):
+        try:
+            parsed = _parse_order_body(order_body if isinstance(order_body, dict) else {})
+        except HTTPException as e:
+            results[index] = BatchOrderResult(success=False, error=str(e.detail))
+            continue
+        ticker = parsed.ticker.upper()
+        if not await instrument_catalog.get(ticker):
+            results[index] = BatchOrderResult(success=False, error="Instrument not found")
+            continue
+        if settings.MATCHING_MODE == "queue":
+            if ticker not in queue_full:
+                queue_full[ticker] = await matching_queue.depth(ticker) >= settings.MATCHING_QUEUE_MAX_DEPTH
+            if queue_full[ticker]:
+                results[index] = BatchOrderResult(success=False, error="Matching queue is full, retry later")
+                continue
+        accepted.append((index, *_new_order(user.id, ticker, parsed)))
+
+    if settings.MATCHING_MODE == "actor":
+        placed = await asyncio.gather(
+            *(matching_actors.submit(order.ticker, order, reserve) for _, order, reserve in accepted),
+            return_exceptions=True
+        )
+        for (index, order, _), result in zip(accepted, placed):
+            results[index] = _batch_result(order.id, result)
+        return BatchOrderResponse(results=results)
+
+    # Reserve the per-ticker totals at once; only tickers that came up short fall back
+    # to freezing order by order, so as many orders as the balance covers get through
+    totals = {}
+    for _, _, reserve in accepted:
+        if reserve:
+            totals[reserve[0]] = totals.get(reserve[0], 0) + reserve[1]
+    frozen = await balance_repo.freeze_many(db, user.id, totals) if totals else set()
+
+    orders = []
+    for index, order, reserve in accepted:
+        if reserve and reserve[0] not in frozen:
+            try:
+                await balance_repo.freeze(db, user.id, *reserve)
+            except InsufficientBalanceException as e:
+                results[index] = BatchOrderResult(success=False, error=str(e))
+                continue
+        orders.append((index, order))
+
+    db.add_all([order for _, order in orders])
+    await db.commit()
+
+    if settings.MATCHING_MODE == "queue":
+        for index, order in orders:
+            await _enqueue(order)
+            results[index] = _batch_result(order.id, order.id)
+    else:
+        # One matching transaction per ticker, tickers in a fixed order and request order kept
+        # within each, so a batch never holds one ticker's book while waiting for another's
+        by_ticker = {}
+        for index, order in orders:
+            by_ticker.setdefault(order.ticker, []).append((index, order))
+        for ticker in sorted(by_ticker):
+            await _place_ticker(db, by_ticker[ticker], results)
+    return BatchOrderResponse(results=results)
+
+async def _enqueue(order: Order, response: Response | None = None):
+    # The order is committed already, so a failed push doesn't fail the request: it stays
+    # queued in the database and the stale-order sweep hands it to the drainer later
+    try:
+        depth = await matching_queue.submit(order.ticker, order.id)
+    except Exception as e:
+        logging.warning(f"Failed to enqueue order {order.id}, leaving it to the sweep: {e}")
+        return
+    if response is not None:
+        response.headers["X-Matching-Queue-Depth"] = str(depth)
+
+async def _place_ticker(db: AsyncSession, orders: list[tuple[int, Order]], results: list):
+    # A rollback while placing an earlier ticker expires every order in the session
+    for _, order in orders:
+        if inspect(order).expired_attributes:
+            await db.refresh(order)
+    # Keys read before matching: a rolled back placement expires its order
+    keys = [(order.id, order.ticker) for _, order in orders]
+    try:
+        matched = await order_matching_service.place_batch(db, [(order, None) for _, order in orders])
+    except Exception as e:
+        matched = [e] * len(orders)
+    failed = [key for key, result in zip(keys, matched) if isinstance(result, Exception)]
+    if failed:
+        # Frozen and stored already: reported as failed, so they must not stay on the book
+        try:
+            await order_matching_service.cancel_unplaced(db, failed)
+        except Exception as e:
+            logging.error(f"Failed to cancel unplaced batch orders {[order_id for order_id, _ in failed]}: {e}")
+    for (index, _), (order_id, _), result in zip(orders, keys, matched):
+        results[index] = _batch_result(order_id, result)
+
+def _batch_result(order_id: UUID, result) -> BatchOrderResult:
+    if isinstance(result, (InsufficientBalanceException, MatchingUnavailableException)):
+        return BatchOrderResult(success=False, error=str(result))
+    if isinstance(result, Exception):
+        logging.error(f"Batch matching failed for order {order_id}: {result}")
+        return BatchOrderResult(success=False, error="Order matching failed")
+    return BatchOrderResult(success=True, order_id=order_id)
+
+def _parse_order_body(body: dict) -> LimitOrderBody | MarketOrderBody:
+    try:
+        if "price" in body:
+            parsed = LimitOrderBody(**body)
+            if parsed.qty <= 0 or parsed.price <= 0:
+                raise HTTPException(status_code=422, detail="qty and price must be > 0")
+        else:
+            parsed = MarketOrderBody(**body)
+            if parsed.qty <= 0:
+                raise HTTPException(status_code=422, detail="qty must be > 0")
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors())
+    return parsed
+
+def _new_order(user_id: UUID, ticker: str, parsed) -> tuple[Order, tuple[str, int] | None]:
+    if isinstance(parsed, LimitOrderBody):
+        if parsed.direction == "BUY":
+            reserve = ("RUB", parsed.qty * parsed.price)
+        else:
+            reserve = (ticker, parsed.qty)
+        price = parsed.price
+    else:
+        reserve = None
+        price = None
 
+    order = Order(
+        id=uuid4(),
+        user_id=user_id,
+        status=OrderStatus.NEW,
+        direction=parsed.direction,
+        ticker=ticker,
+        qty=parsed.qty,
+        price=price,
+        filled=0,
+        queued=settings.MATCHING_MODE == "queue"
+    )
+    return order, reserve
@@ -1,5 +1,5 @@
 import uuid
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy import delete, select
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.models.balance import Balance
@@ -7,10 +7,14 @@ from app.core.models.order import Order
 from app.core.models.transaction import Transaction
 from core.schemas.transaction import Transaction as TransactionSchema
 from core.schemas.user import User, UserCreate
-from core.database import get_db
-from repositories import instrument_repo, user_repo, order_repo, transaction_repo
-from core.schemas.order import  L2OrderBook, OrderBookLevel
+from core.database import get_db, get_read_db
+from core.pagination import decode_cursor, encode_cursor
+from core.responses import FastJSONResponse
+from repositories import user_repo, transaction_repo
+from core.schemas.order import  L2OrderBook, L2OrderBookDelta, OrderBookLevel
 from core.schemas.instrument import Instrument
+from services.instrument_catalog import instrument_catalog
+from services.order_book import order_books
 
 router = APIRouter(prefix="/api/v1/public", tags=["public"])
 
@@ -56,34 +60,73 @@ async def register_user(
         )
 
 @router.get("/orderbook/{ticker}", response_model=L2OrderBook)
-async def get_orderbook(ticker: str, limit: int = 10, db: AsyncSession = Depends(get_db)):
-    bids = await order_repo.get_bids(db, ticker, limit)
-    asks = await order_repo.get_asks(db, ticker, limit)
+async def get_orderbook(ticker: str, limit: int = 10):
+    # Served from the process's L2 view with either engine: a round trip to Redis for the
+    # shared version, and to Postgres only when another worker's step was missed
+    version = None
+    if not await instrument_catalog.get(ticker):
+        # No view is built (and cached) for tickers that don't exist
+        bids, asks = [], []
+    else:
+        view = await order_books.l2(ticker)
+        bids, asks = view.levels(limit)
+        version = view.version
 
-    bid_levels = [
-        OrderBookLevel(price=o.price, qty=max(o.qty - o.filled, 0))
-        for o in bids if o.qty > o.filled and o.price is not None
-    ]
-    ask_levels = [
-        OrderBookLevel(price=o.price, qty=max(o.qty - o.filled, 0))
-        for o in asks if o.qty > o.filled and o.price is not None
-    ]
+    # Serialized as L2OrderBook would be (prices as floats), without building the models
+    response = FastJSONResponse({
+        "bid_levels": [{"price": float(price), "qty": qty} for price, qty in bids],
+        "ask_levels": [{"price": float(price), "qty": qty} for price, qty in asks],
+    })
+    if version is not None:
+        response.headers["X-Book-Version"] = str(version)
+    return response
 
-    return L2OrderBook(
-        bid_levels=sorted(bid_levels, key=lambda x: -x.price),
-        ask_levels=sorted(ask_levels, key=lambda x: x.price)
+@router.get("/orderbook/{ticker}/delta", response_model=L2OrderBookDelta)
+async def get_orderbook_delta(ticker: str, since: int = Query(..., ge=0)):
+    # Levels with qty 0 were removed. When `since` is too old (or unknown) the full book is
+    # returned with snapshot=true and the client should replace its copy.
+    if not await instrument_catalog.get(ticker):
+        bids, asks = [], []
+        version, snapshot = 0, True
+    else:
+        view = await order_books.l2(ticker)
+        version = view.version
+        changes = view.delta(since)
+        if changes is None:
+            bids, asks = view.levels(None)
+            snapshot = True
+        else:
+            bids = sorted(((p, q) for d, p, q in changes if d == "BUY"), reverse=True)
+            asks = sorted((p, q) for d, p, q in changes if d == "SELL")
+            snapshot = False
+
+    return L2OrderBookDelta(
+        version=version,
+        snapshot=snapshot,
+        bid_levels=[OrderBookLevel(price=price, qty=qty) for price, qty in bids],
+        ask_levels=[OrderBookLevel(price=price, qty=qty) for price, qty in asks]
     )
 
 @router.get("/transactions/{ticker}", response_model=list[TransactionSchema], tags=["public"])
 async def get_transactions(
     ticker: str,
     limit: int = Query(10, ge=1, le=100),
-    db: AsyncSession = Depends(get_db)
+    cursor: str | None = None,
+    db: AsyncSession = Depends(get_read_db)
 ):
-    transactions = await transaction_repo.get_by_ticker(db, ticker, limit)
-    return [TransactionSchema.from_orm(tx) for tx in transactions]
+    # Newest first; pass X-Next-Cursor back as `cursor` for the next (older) page
+    before = decode_cursor(cursor, int)
+    transactions = await transaction_repo.get_by_ticker(db, ticker, limit, before)
+    # The schema encodes timestamps with isoformat() ("+00:00"), so they are formatted here too
+    response = FastJSONResponse([
+        {"ticker": tx.ticker, "amount": tx.amount, "price": tx.price, "timestamp": tx.created_at.isoformat()}
+        for tx in transactions
+    ])
+    if len(transactions) == limit:
+        last = transactions[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last.created_at, last.seq)
+    return response
 
 @router.get("/instrument", response_model=list[Instrument])
-async def list_instruments(db: AsyncSession = Depends(get_db)):
-    instruments = await instrument_repo.get_all(db)
-    return [Instrument.model_validate(i) for i in instruments]
+async def list_instruments():
+    return Response(await instrument_catalog.json(), media_type="application/json")
@@ -1,3 +1,4 @@
+from pydantic import model_validator
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -6,8 +7,106 @@ class Settings(BaseSettings):
     SECRET_KEY: str
     ALGORITHM: str = "HS256"
 
+    # JSON lines written off the request path; bodies and headers only when LOG_BODIES is on
+    LOG_LEVEL: str = "INFO"
+    # Per-worker segments rotated by size/age, gzipped and listed in LOG_DIR/index.jsonl
+    LOG_DIR: str = "logs"
+    LOG_SEGMENT_MAX_BYTES: int = 64 * 1024 * 1024
+    LOG_SEGMENT_MAX_SECONDS: int = 3600
+    LOG_RETENTION_DAYS: float = 7
+    LOG_SAMPLE_RATE: float = 1.0
+    LOG_BODIES: bool = False
+    LOG_BODY_LIMIT: int = 200
+
+    # GET /metrics. With PROMETHEUS_MULTIPROC_DIR set (it must be in the environment before
+    # start, prometheus_client reads it on import) every worker writes its samples there;
+    # METRICS_WORKER_DIR is the Celery worker's directory, merged into the same output
+    PROMETHEUS_MULTIPROC_DIR: str | None = None
+    METRICS_WORKER_DIR: str | None = None
+
+    # Per-process pool: a gunicorn worker can hold up to DB_POOL_SIZE + DB_MAX_OVERFLOW connections
+    DB_POOL_SIZE: int = 8
+    DB_MAX_OVERFLOW: int = 8
+    DB_POOL_TIMEOUT: float = 30
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = False
+    DB_COMMAND_TIMEOUT: float | None = None
+    # asyncpg prepared statement cache per connection; DB_PGBOUNCER disables all
+    # server-side statement reuse for PgBouncer in transaction pooling mode
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    DB_PGBOUNCER: bool = False
+
+    # Opt-in per-request SQL profiling: statement count and DB time in X-SQL-* response headers,
+    # statements slower than SQL_SLOW_QUERY_MS and ones repeated SQL_REPEAT_THRESHOLD+ times
+    # within a request (N+1) logged to the "sql" logger with their parameter types
+    SQL_PROFILE: bool = False
+    SQL_SLOW_QUERY_MS: float = 100
+    SQL_REPEAT_THRESHOLD: int = 5
+
+    # Optional streaming replica for read-only routes. It is used while its replay lag is
+    # within the route's limit; on probe failure reads go to the primary for a while.
+    DATABASE_REPLICA_URL: str | None = None
+    REPLICA_MAX_LAG_SECONDS: float = 5
+    REPLICA_MAX_LAG_PRIVATE_SECONDS: float = 0.5
+    REPLICA_CHECK_INTERVAL_SECONDS: float = 1
+    REPLICA_RETRY_SECONDS: float = 10
+    REPLICA_CONNECT_TIMEOUT: float = 2
+
+    # "row" settles fills straight into `balances`; "ledger" appends them to balance_ledger
+    # without touching the row locks and folds them in every BALANCE_COMPACT_INTERVAL_SECONDS
+    BALANCE_MODE: str = "row"
+    BALANCE_COMPACT_INTERVAL_SECONDS: float = 5
+    BALANCE_COMPACT_BATCH_SIZE: int = 10000
+
+    # "db" scans orders in Postgres. "memory" matches against a resident per-ticker book kept
+    # by the ticker's actor, so it needs MATCHING_MODE="actor": a pass that finds the book moved
+    # by another process reloads all of the ticker's orders. Both publish a book step per commit
+    MATCHING_ENGINE: str = "memory"
+    # "inline" matches inside the request handler, "actor" hands placements and cancels to the
+    # ticker's actor, "queue" returns right after persisting and leaves matching to the Celery workers
+    MATCHING_MODE: str = "actor"
+    # Page size and lock mode for the candidate scan of the "db" engine
+    MATCHING_FETCH_BATCH_SIZE: int = 100
+    MATCHING_SKIP_LOCKED: bool = False
+    # Orders per drain batch in "queue" mode and backlog depth at which new orders get 503
+    MATCHING_QUEUE_BATCH_SIZE: int = 100
+    MATCHING_QUEUE_MAX_DEPTH: int = 10000
+    # Orders still unmatched this long after they were stored are pushed to the backlog again
+    # (their id was lost on the way to it), checked every MATCHING_QUEUE_SWEEP_INTERVAL_SECONDS
+    MATCHING_QUEUE_SWEEP_AFTER_SECONDS: float = 60
+    MATCHING_QUEUE_SWEEP_INTERVAL_SECONDS: float = 30
+    # Group commit of "actor" mode: up to N orders or M ms of arrivals per transaction
+    MATCHING_BATCH_MAX_ORDERS: int = 50
+    MATCHING_BATCH_WINDOW_MS: int = 2
+    # "actor" mode across workers: a ticker is matched by the process holding its Redis lease
+    # (claimed by the first one to see an order, renewed every third of the TTL); the others
+    # forward to it and answer 503 when it doesn't reply within MATCHING_FORWARD_TIMEOUT_SECONDS
+    MATCHING_OWNER_TTL_SECONDS: float = 10
+    MATCHING_FORWARD_TIMEOUT_SECONDS: float = 10
+    # Largest accepted POST /api/v1/order/batch
+    ORDER_BATCH_MAX_SIZE: int = 500
+
+    # Book changes kept per ticker for GET /public/orderbook/{ticker}/delta
+    ORDERBOOK_DELTA_HISTORY: int = 1000
+    # Messages buffered per market data websocket before the client is resynced with a snapshot
+    MARKET_DATA_CLIENT_BUFFER: int = 256
+
+    # Monthly trade partitions created ahead of time, and months kept attached (0 keeps all)
+    TRADES_PARTITIONS_AHEAD: int = 3
+    TRADES_RETENTION_MONTHS: int = 12
+
+    # Per-worker api_key -> user cache; entries are also dropped on admin changes
+    AUTH_CACHE_TTL_SECONDS: int = 60
+    AUTH_CACHE_MAX_SIZE: int = 10000
+
     model_config = {
         "extra": "ignore"
     }
 
+    @model_validator(mode="after")
+    def check_matching(self):
+        if self.MATCHING_ENGINE == "memory" and self.MATCHING_MODE != "actor":
+            raise ValueError('MATCHING_ENGINE="memory" requires MATCHING_MODE="actor"')
+        return self
+
 settings = Settings()
\ No newline at end of file
@@ -1,24 +1,185 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
 from typing import AsyncGenerator
+from uuid import uuid4
+from sqlalchemy import exc, text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from .config import settings
 from .models.base import Base
 
+
+class PoolStats:
+    # Checkout telemetry of this process' pool, see GET /api/v1/admin/pool
+    def __init__(self):
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.overflow_opened = 0
+        self.timeouts = 0
+        self.listeners = []
+
+    def record(self, wait: float, overflowed: bool):
+        self.checkouts += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        if overflowed:
+            self.overflow_opened += 1
+        for listener in self.listeners:
+            listener(wait)
+
+    def snapshot(self) -> dict:
+        return {
+            "checkouts": self.checkouts,
+            "wait_total_seconds": self.wait_total,
+            "wait_avg_seconds": self.wait_total / self.checkouts if self.checkouts else 0.0,
+            "wait_max_seconds": self.wait_max,
+            "overflow_opened": self.overflow_opened,
+            "timeouts": self.timeouts,
+        }
+
+
+pool_stats = PoolStats()
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    # Times how long each checkout waits for a free connection (or a new one to open)
+    def _do_get(self):
+        overflow = self._overflow
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            pool_stats.timeouts += 1
+            raise
+        pool_stats.record(time.perf_counter() - start, self._overflow > max(overflow, 0))
+        return connection
+
+
+def _connect_args() -> dict:
+    args = {"statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE}
+    if settings.DB_COMMAND_TIMEOUT is not None:
+        args["command_timeout"] = settings.DB_COMMAND_TIMEOUT
+    if settings.DB_PGBOUNCER:
+        # Transaction pooling hands each transaction a different server connection:
+        # no server-side statement caches, and unique names for the unnamed ones
+        args["statement_cache_size"] = 0
+        args["prepared_statement_cache_size"] = 0
+        args["prepared_statement_name_func"] = lambda: f"__asyncpg_{uuid4()}__"
+    return args
+
+
 engine = create_async_engine(
     settings.DATABASE_URL,
-    pool_size=8,
-    max_overflow=8,
-    pool_timeout=30,
-    pool_recycle=1800,
+    poolclass=TimedQueuePool,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+    connect_args=_connect_args(),
 )
 async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+# NULL while the standby has no streaming WAL receiver: its replay position then only tells
+# how far it got before losing the primary. Without pg_read_all_stats the receiver's status
+# reads as NULL, so only its presence is checked then. Receive and replay positions match
+# when the standby is caught up, even if the primary is idle.
+REPLICA_LAG_QUERY = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN NOT EXISTS (
+        SELECT 1 FROM pg_stat_wal_receiver WHERE coalesce(status, 'streaming') = 'streaming'
+    ) THEN NULL
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+END
+"""
+
+
+class ReplicaMonitor:
+    # Replay lag of the read replica as last probed; None while it is unreachable.
+    # Probes run as a background task, at most one at a time, so requests never wait for them.
+    def __init__(self, engine):
+        self._engine = engine
+        self._probe_task: asyncio.Task | None = None
+        self._next_check = 0.0
+        self.lag: float | None = None
+
+    def current_lag(self) -> float | None:
+        if time.monotonic() >= self._next_check and (self._probe_task is None or self._probe_task.done()):
+            self._probe_task = asyncio.create_task(self._probe(), name="replica-lag-probe")
+        return self.lag
+
+    async def _probe(self):
+        try:
+            async with self._engine.connect() as conn:
+                lag = (await conn.execute(text(REPLICA_LAG_QUERY))).scalar()
+        except (exc.SQLAlchemyError, OSError, asyncio.TimeoutError) as e:
+            lag, reason = None, e
+        else:
+            reason = "no WAL receiver streaming from the primary"
+        if lag is None:
+            logging.warning(f"Read replica unavailable, reading from primary: {reason}")
+            self.lag = None
+            self._next_check = time.monotonic() + settings.REPLICA_RETRY_SECONDS
+        else:
+            self.lag = float(lag)
+            self._next_check = time.monotonic() + settings.REPLICA_CHECK_INTERVAL_SECONDS
+
+if settings.DATABASE_REPLICA_URL:
+    replica_engine = create_async_engine(
+        settings.DATABASE_REPLICA_URL,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args={**_connect_args(), "timeout": settings.REPLICA_CONNECT_TIMEOUT},
+    )
+    replica_session = sessionmaker(replica_engine, class_=AsyncSession, expire_on_commit=False)
+    replica_monitor = ReplicaMonitor(replica_engine)
+else:
+    replica_engine = replica_session = replica_monitor = None
+
+def pool_status() -> dict:
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+        **pool_stats.snapshot(),
+    }
+
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
     async with async_session() as session:
         yield session
 
+@asynccontextmanager
+async def read_session(max_lag: float):
+    # Replica session if it is reachable and at most `max_lag` seconds behind, else primary
+    factory = async_session
+    if replica_monitor is not None:
+        lag = replica_monitor.current_lag()
+        if lag is not None and lag <= max_lag:
+            factory = replica_session
+    async with factory() as session:
+        yield session
+
+async def get_read_db() -> AsyncGenerator[AsyncSession, None]:
+    async with read_session(settings.REPLICA_MAX_LAG_SECONDS) as session:
+        yield session
+
+async def get_private_read_db() -> AsyncGenerator[AsyncSession, None]:
+    # A user's own orders and balances: only a nearly caught-up replica will do
+    async with read_session(settings.REPLICA_MAX_LAG_PRIVATE_SECONDS) as session:
+        yield session
+
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
-
-        
\ No newline at end of file
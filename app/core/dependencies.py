@@ -2,9 +2,16 @@ from fastapi import Depends, HTTPException, Header
 from sqlalchemy.ext.asyncio import AsyncSession
 from core.schemas.user import User
 from repositories import user_repo
+from core.cache import TTLCache
+from core.config import settings
 from core.database import get_db
+from core.invalidation import invalidation_bus
 from typing import Optional
 
+# api_key -> User; the session below only checks out a connection on a miss
+user_cache = TTLCache(settings.AUTH_CACHE_MAX_SIZE, settings.AUTH_CACHE_TTL_SECONDS)
+invalidation_bus.subscribe("user", lambda api_key: user_cache.pop(api_key) if api_key else user_cache.clear())
+
 async def get_current_user(
     authorization: Optional[str] = Header(None),
     db: AsyncSession = Depends(get_db)
@@ -16,10 +23,17 @@ async def get_current_user(
     if not token:
         raise HTTPException(status_code=401, detail="Empty TOKEN")
 
-    user = await user_repo.get_by_api_key(db, token)
-    if not user:
+    user = user_cache.get(token)
+    if user is not None:
+        return user
+
+    generation = user_cache.generation
+    db_user = await user_repo.get_by_api_key(db, token)
+    if not db_user:
         raise HTTPException(status_code=401, detail="Invalid TOKEN")
 
+    user = User.model_validate(db_user)
+    user_cache.set(token, user, generation)
     return user
 
 
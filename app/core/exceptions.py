@@ -1,4 +1,9 @@
 class InsufficientBalanceException(Exception):
     def __init__(self, message="Insufficient balance for transfer"):
         self.message = message
-        super().__init__(self.message)
\ No newline at end of file
+        super().__init__(self.message)
+
+
+class MatchingUnavailableException(Exception):
+    # The ticker's matcher could not be reached or did not answer in time
+    pass
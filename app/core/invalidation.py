@@ -0,0 +1,72 @@
+import asyncio
+import json
+import logging
+from contextlib import suppress
+
+from redis.exceptions import RedisError
+
+from .redis import redis_client
+
+CHANNEL = "cache:invalidate"
+
+
+class InvalidationBus:
+    # Process-local caches register a handler per topic. publish() runs it here and, through
+    # Redis pub/sub, in every other worker. A key of None means "drop everything".
+    def __init__(self, redis):
+        self._redis = redis
+        self._handlers: dict[str, list] = {}
+        self._listener: asyncio.Task | None = None
+
+    def subscribe(self, topic: str, handler):
+        self._handlers.setdefault(topic, []).append(handler)
+
+    async def publish(self, topic: str, key: str | None = None):
+        self._dispatch(topic, key)
+        try:
+            await self._redis.publish(CHANNEL, json.dumps({"topic": topic, "key": key}))
+        except RedisError as e:
+            logging.warning(f"Failed to publish invalidation of {topic}: {e}")
+
+    async def start(self, timeout: float = 5):
+        # Waits for the first subscription so caches filled after this can't miss a message
+        if self._listener is None or self._listener.done():
+            subscribed = asyncio.Event()
+            self._listener = asyncio.create_task(self._listen(subscribed), name="invalidation-listener")
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(subscribed.wait(), timeout)
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._listener
+            self._listener = None
+
+    def _dispatch(self, topic: str, key: str | None):
+        for handler in self._handlers.get(topic, ()):
+            handler(key)
+
+    async def _listen(self, subscribed: asyncio.Event):
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.subscribe(CHANNEL)
+                if subscribed.is_set():
+                    # Resubscribed: whatever was published in between is unknown
+                    for topic in self._handlers:
+                        self._dispatch(topic, None)
+                subscribed.set()
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        data = json.loads(message["data"])
+                        self._dispatch(data["topic"], data.get("key"))
+            except RedisError as e:
+                logging.warning(f"Cache invalidation subscription lost: {e}")
+                await asyncio.sleep(1)
+            finally:
+                with suppress(RedisError):
+                    await pubsub.aclose()
+
+
+invalidation_bus = InvalidationBus(redis_client)
@@ -0,0 +1,219 @@
+import gzip
+import heapq
+import json
+import logging
+import os
+import shutil
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from .config import settings
+
+INDEX_NAME = "index.jsonl"
+SEGMENT_PREFIX = "requests-"
+
+
+def _segment_start(name: str) -> float:
+    # requests-<pid>-<YYYYmmddTHHMMSSffffff>.jsonl[.gz]
+    stamp = name[len(SEGMENT_PREFIX):].split("-", 1)[1].split(".", 1)[0]
+    return datetime.strptime(stamp, "%Y%m%dT%H%M%S%f").replace(tzinfo=timezone.utc).timestamp()
+
+
+class SegmentedFileHandler(logging.Handler):
+    # Each worker writes its own segment and rotates it by size or age. A rotated segment is
+    # gzipped and gets one line in index.jsonl with its time range; expired ones are deleted.
+    def __init__(self, directory: str, max_bytes: int, max_seconds: float, retention_seconds: float):
+        super().__init__()
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.retention_seconds = retention_seconds
+        os.makedirs(directory, exist_ok=True)
+        self._stream = None
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            line = (self.format(record) + "\n").encode("utf-8")
+            if self._stream is not None and (
+                self._bytes >= self.max_bytes or record.created - self._start >= self.max_seconds
+            ):
+                self._rotate()
+            if self._stream is None:
+                self._open(record.created)
+            self._stream.write(line)
+            self._stream.flush()
+            self._bytes += len(line)
+            self._lines += 1
+            self._end = record.created
+        except Exception:
+            self.handleError(record)
+
+    def _open(self, start: float):
+        stamp = datetime.fromtimestamp(start, timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        self._name = f"{SEGMENT_PREFIX}{os.getpid()}-{stamp}.jsonl"
+        self._stream = open(os.path.join(self.directory, self._name), "ab")
+        self._start = self._end = start
+        self._bytes = self._lines = 0
+
+    def _rotate(self):
+        self._stream.close()
+        self._stream = None
+        path = os.path.join(self.directory, self._name)
+        with open(path, "rb") as src, gzip.open(path + ".gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(path)
+
+        entry = {
+            "segment": self._name + ".gz",
+            "pid": os.getpid(),
+            "start": self._start,
+            "end": self._end,
+            "lines": self._lines,
+            "bytes": self._bytes,
+        }
+        # Lines this short are appended atomically, so workers can share the index
+        with open(os.path.join(self.directory, INDEX_NAME), "a") as index:
+            index.write(json.dumps(entry) + "\n")
+        self._prune()
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_seconds
+        for segment in LogStore(self.directory).segments():
+            if not segment["active"] and segment["end"] < cutoff:
+                try:
+                    os.remove(os.path.join(self.directory, segment["segment"]))
+                except FileNotFoundError:
+                    pass
+
+    def close(self):
+        try:
+            if self._stream is not None:
+                self._rotate()
+        finally:
+            super().close()
+
+
+class LogStore:
+    # Read side of the segmented log, used by the admin endpoints
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path(self, name: str) -> str | None:
+        if os.path.basename(name) != name or not name.startswith(SEGMENT_PREFIX):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+    def segments(self) -> list[dict]:
+        segments = {}
+        try:
+            with open(os.path.join(self.directory, INDEX_NAME)) as index:
+                for line in index:
+                    entry = json.loads(line)
+                    if self.path(entry["segment"]):
+                        segments[entry["segment"]] = {**entry, "active": False}
+        except FileNotFoundError:
+            pass
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            names = []
+        # Segments still being written (or left behind by a dead worker) are not indexed
+        for name in names:
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(".jsonl") and name not in segments:
+                stat = os.stat(os.path.join(self.directory, name))
+                segments[name] = {
+                    "segment": name,
+                    "start": _segment_start(name),
+                    "end": stat.st_mtime,
+                    "bytes": stat.st_size,
+                    "active": True,
+                }
+        return sorted(segments.values(), key=lambda segment: segment["start"])
+
+    def _lines(self, segment: dict):
+        path = os.path.join(self.directory, segment["segment"])
+        opener = gzip.open if path.endswith(".gz") else open
+        try:
+            with opener(path, "rt", encoding="utf-8", errors="replace") as stream:
+                yield from stream
+        except FileNotFoundError:
+            return
+
+    def read(self, since: datetime | None = None, until: datetime | None = None, tail: int | None = None):
+        # Lines of every segment overlapping [since, until] in timestamp order; with `tail`, only
+        # the last `tail` of them. Segments written at the same time by different workers are
+        # merged by "ts"; a segment overlapping no other one (and no bound) is not parsed.
+        low = since.timestamp() if since else float("-inf")
+        high = until.timestamp() if until else float("inf")
+        selected = [s for s in self.segments() if s["end"] >= low and s["start"] <= high]
+        clusters = _clusters(selected)
+
+        if tail is not None and since is None:
+            # Walk back from the newest cluster until enough lines are collected
+            chunks = []
+            needed = tail
+            for cluster in reversed(clusters):
+                lines = deque(self._merged(cluster, low, high), maxlen=needed)
+                chunks.append(lines)
+                needed -= len(lines)
+                if needed <= 0:
+                    break
+            for lines in reversed(chunks):
+                yield from lines
+            return
+
+        lines = (line for cluster in clusters for line in self._merged(cluster, low, high))
+        yield from (deque(lines, maxlen=tail) if tail is not None else lines)
+
+    def _merged(self, cluster: list[dict], low: float, high: float):
+        if len(cluster) == 1:
+            yield from self._filtered(cluster[0], low, high)
+            return
+        stamped = [self._stamped(segment, low, high) for segment in cluster]
+        for _, line in heapq.merge(*stamped, key=lambda item: item[0]):
+            yield line
+
+    def _stamped(self, segment: dict, low: float, high: float):
+        # (ts, line); a line without a readable "ts" sorts with the line before it
+        ts = segment["start"]
+        for line in self._lines(segment):
+            stamp = _line_ts(line)
+            if stamp is not None:
+                ts = stamp
+            if low <= ts <= high:
+                yield ts, line
+
+    def _filtered(self, segment: dict, low: float, high: float):
+        if segment["start"] >= low and segment["end"] <= high:
+            yield from self._lines(segment)
+            return
+        for line in self._lines(segment):
+            ts = _line_ts(line)
+            if ts is not None and low <= ts <= high:
+                yield line
+
+
+def _line_ts(line: str) -> float | None:
+    try:
+        return datetime.fromisoformat(json.loads(line)["ts"]).timestamp()
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def _clusters(segments: list[dict]) -> list[list[dict]]:
+    # Groups segments (sorted by start) into runs whose time ranges overlap
+    clusters = []
+    end = float("-inf")
+    for segment in segments:
+        if clusters and segment["start"] <= end:
+            clusters[-1].append(segment)
+            end = max(end, segment["end"])
+        else:
+            clusters.append([segment])
+            end = segment["end"]
+    return clusters
+
+
+log_store = LogStore(settings.LOG_DIR)
@@ -1,63 +1,115 @@
+import atexit
+import json
 import logging
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
-
-logging.basicConfig(
-    filename='requests.log',
-    level=logging.INFO,
-    format='%(asctime)s %(levelname)s %(message)s',
-)
-
-class LoggingMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        method = request.method
-        url = request.url.path
-
-        body = None
-        if method in ("POST", "PUT", "PATCH"):
-            try:
-                body_bytes = await request.body()
-                body = body_bytes.decode('utf-8', errors='ignore')
-            except Exception as e:
-                body = f"<<error reading body: {e}>>"
-        else:
-            body = ""
-
-        headers = dict(request.headers)
-        for k in list(headers.keys()):
-            if k.lower() in ["authorization", "cookie", "set-cookie"]:
-                headers[k] = "<<hidden>>"
-
-        log_msg = (
-            f"{method} {url} | "
-            f"Headers: {headers} | "
-            f"Body: {body[:200]}{'...' if len(body) > 200 else ''}" 
-        )
-        logging.info(log_msg)
-        print(log_msg) 
+import queue
+import random
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
 
+from .config import settings
+from .log_segments import SegmentedFileHandler
+
+logger = logging.getLogger("requests")
+
+HIDDEN_HEADERS = {b"authorization", b"cookie", b"set-cookie"}
+
+
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line; structured fields are passed as extra={"fields": {...}}
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def configure_logging():
+    # Request handlers only put records on a queue; a background thread formats and writes them
+    handler = SegmentedFileHandler(
+        settings.LOG_DIR,
+        settings.LOG_SEGMENT_MAX_BYTES,
+        settings.LOG_SEGMENT_MAX_SECONDS,
+        settings.LOG_RETENTION_DAYS * 86400,
+    )
+    handler.setFormatter(JsonFormatter())
+    records = queue.SimpleQueue()
+    listener = QueueListener(records, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    root.setLevel(settings.LOG_LEVEL)
+    root.addHandler(QueueHandler(records))
+
+
+class LoggingMiddleware:
+    # Plain ASGI: the body streams through untouched and is only copied (up to
+    # LOG_BODY_LIMIT bytes) when LOG_BODIES is on. Errors are always logged,
+    # other requests with probability LOG_SAMPLE_RATE.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        sampled = random.random() < settings.LOG_SAMPLE_RATE
+        capture = settings.LOG_BODIES
+        limit = settings.LOG_BODY_LIMIT
+        request_body = bytearray()
+        response_body = bytearray()
+        status = 500
+
+        async def receive_logged():
+            message = await receive()
+            if message["type"] == "http.request" and len(request_body) < limit:
+                request_body.extend(message.get("body", b"")[:limit - len(request_body)])
+            return message
+
+        async def send_logged(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif capture and status >= 400 and message["type"] == "http.response.body" and len(response_body) < limit:
+                response_body.extend(message.get("body", b"")[:limit - len(response_body)])
+            await send(message)
+
+        error = None
         try:
-            response: Response = await call_next(request)
-            status_code = response.status_code
-
-            if status_code >= 400:
-                resp_body = b""
-                async for chunk in response.body_iterator:
-                    resp_body += chunk
-                try:
-                    resp_data = resp_body.decode("utf-8")
-                    if len(resp_data) > 200:
-                        resp_data = resp_data[:200] + "..."
-                except Exception:
-                    resp_data = "<<binary data>>"
-                error_log = f"RESPONSE {status_code} | {url} | Body: {resp_data}"
-                logging.warning(error_log)
-                print(error_log)
-                response = Response(content=resp_body, status_code=status_code, headers=dict(response.headers), media_type=response.media_type)
-
-            return response
-        except Exception as exc:
-            error_log = f"EXCEPTION in {method} {url}: {exc}"
-            logging.error(error_log)
-            print(error_log)
-            raise exc
+            await self.app(scope, receive_logged if capture else receive, send_logged)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            if sampled or status >= 400 or error is not None:
+                fields = {
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status,
+                    "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+                }
+                if scope.get("client"):
+                    fields["client"] = scope["client"][0]
+                if capture:
+                    fields["headers"] = {
+                        key.decode("latin-1"): "<<hidden>>" if key in HIDDEN_HEADERS else value.decode("latin-1")
+                        for key, value in scope["headers"]
+                    }
+                    fields["body"] = request_body.decode("utf-8", errors="replace")
+                    if response_body:
+                        fields["response_body"] = response_body.decode("utf-8", errors="replace")
+                if error is not None:
+                    fields["error"] = repr(error)
+                level = logging.ERROR if error is not None or status >= 500 else (
+                    logging.WARNING if status >= 400 else logging.INFO
+                )
+                logger.log(level, "request", extra={"fields": fields})
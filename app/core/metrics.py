@@ -0,0 +1,121 @@
+import glob
+import logging
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Histogram, generate_latest
+)
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.multiprocess import MultiProcessCollector
+from redis.exceptions import RedisError
+
+from .config import settings
+
+# Always import this module as `core.metrics`: a second copy would register everything twice
+
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+request_duration = Histogram(
+    "http_request_duration_seconds", "Request latency by route template",
+    ["method", "route", "status"],
+)
+match_duration = Histogram(
+    "matching_order_duration_seconds", "match_order() wall time, commit included",
+    ["engine"],
+)
+match_fills = Histogram(
+    "matching_fills_per_order", "Trades produced by one match_order() pass",
+    buckets=COUNT_BUCKETS,
+)
+match_candidates = Histogram(
+    "matching_candidates_scanned", "Resting orders fetched and locked by one match_order() pass",
+    ["engine"], buckets=COUNT_BUCKETS,
+)
+balance_lock_wait = Histogram(
+    "balance_lock_wait_seconds", "Round trip of the statements that lock balance rows",
+    ["op"],
+)
+commit_duration = Histogram(
+    "db_commit_duration_seconds", "COMMIT round trip on the order paths",
+    ["path"],
+)
+pool_wait = Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+CELERY_QUEUES = ("matching", "maintenance")
+
+
+class _MultiProcessDirs:
+    # Samples of every gunicorn worker (PROMETHEUS_MULTIPROC_DIR) and of the Celery
+    # worker (METRICS_WORKER_DIR), merged into one family per metric
+    def __init__(self, paths: list[str]):
+        self.paths = paths
+
+    def collect(self):
+        files = [name for path in self.paths for name in glob.glob(os.path.join(path, "*.db"))]
+        return MultiProcessCollector.merge(files, accumulate=True)
+
+
+class _Static:
+    def __init__(self, families):
+        self.families = families
+
+    def collect(self):
+        return self.families
+
+
+def _registry() -> CollectorRegistry:
+    if not settings.PROMETHEUS_MULTIPROC_DIR:
+        return REGISTRY
+    registry = CollectorRegistry()
+    paths = [settings.PROMETHEUS_MULTIPROC_DIR]
+    if settings.METRICS_WORKER_DIR:
+        paths.append(settings.METRICS_WORKER_DIR)
+    registry.register(_MultiProcessDirs(paths))
+    return registry
+
+
+async def render_metrics(redis) -> bytes:
+    # Queue depths are read at scrape time rather than kept in every process
+    queues = GaugeMetricFamily("celery_queue_length", "Tasks waiting in a Celery queue", labels=["queue"])
+    try:
+        for queue in CELERY_QUEUES:
+            queues.add_metric([queue], await redis.llen(queue))
+    except RedisError as e:
+        logging.warning(f"Celery queue depth unavailable: {e}")
+
+    scraped = CollectorRegistry()
+    scraped.register(_Static([queues]))
+    return generate_latest(_registry()) + generate_latest(scraped)
+
+
+class MetricsMiddleware:
+    # Plain ASGI like LoggingMiddleware. The route label is the matched path template,
+    # so /api/v1/order/{order_id} is one series however many orders there are.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_timed(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            route = scope.get("route")
+            request_duration.labels(
+                scope["method"], getattr(route, "path", "unmatched"), str(status)
+            ).observe(time.perf_counter() - start)
@@ -1,15 +1,18 @@
 from .base import Base
 from .user import User
 from .instrument import Instrument
-from .balance import Balance
+from .balance import Balance, BalanceLedger
 from .order import Order
 from .transaction import Transaction
+from .order_book import OrderBookState
 
 __all__ = [
     'Base',
     'User',
     'Instrument',
     'Balance',
+    'BalanceLedger',
     'Order',
-    'Transaction'
+    'Transaction',
+    'OrderBookState'
 ]
\ No newline at end of file
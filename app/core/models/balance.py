@@ -1,11 +1,14 @@
-from sqlalchemy import Column, Integer, ForeignKey, String
+from sqlalchemy import BigInteger, CheckConstraint, Column, DateTime, Integer, ForeignKey, Index, String
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func
 from .base import Base
 
 class Balance(Base):
     __tablename__ = "balances"
-    
+    # Backstop for the guarded updates: no path may overdraw an account
+    __table_args__ = (CheckConstraint("frozen >= 0 AND amount >= 0", name="ck_balances_non_negative"),)
+
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete='CASCADE'), primary_key=True)
     ticker = Column(String(10), primary_key=True)
     amount = Column(Integer, default=0)
@@ -17,4 +20,19 @@ class Balance(Base):
     )
 
     def __repr__(self):
-        return f"<Balance(user_id={self.user_id}, ticker={self.ticker}, amount={self.amount})>"
\ No newline at end of file
+        return f"<Balance(user_id={self.user_id}, ticker={self.ticker}, amount={self.amount})>"
+
+class BalanceLedger(Base):
+    # Append-only balance deltas of BALANCE_MODE="ledger", folded into `balances` later
+    __tablename__ = "balance_ledger"
+    __table_args__ = (Index("ix_balance_ledger_user_id_ticker", "user_id", "ticker"),)
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete='CASCADE'), nullable=False)
+    ticker = Column(String(10), nullable=False)
+    amount = Column(Integer, nullable=False, default=0)
+    frozen = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<BalanceLedger(user_id={self.user_id}, ticker={self.ticker}, amount={self.amount}, frozen={self.frozen})>"
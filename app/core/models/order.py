@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, ForeignKey, String
+from sqlalchemy import Boolean, Column, Integer, ForeignKey, String, false
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from .base import Base, TimestampMixin
@@ -18,6 +18,8 @@ class Order(Base, TimestampMixin):
     price = Column(Integer)
     status = Column(SqlEnum(OrderStatus, name="order_statuses", native_enum=False), default=OrderStatus.NEW)
     filled = Column(Integer, default=0)
+    # Stored in "queue" mode and not matched yet
+    queued = Column(Boolean, nullable=False, default=False, server_default=false())
 
     user = relationship(
         "User",
@@ -0,0 +1,12 @@
+from sqlalchemy import BigInteger, Column, String
+from .base import Base
+
+class OrderBookState(Base):
+    __tablename__ = "order_book_state"
+
+    ticker = Column(String(10), primary_key=True)
+    book_seq = Column(BigInteger, nullable=False, default=0, server_default="0")
+    trade_seq = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+    def __repr__(self):
+        return f"<OrderBookState(ticker={self.ticker}, book_seq={self.book_seq})>"
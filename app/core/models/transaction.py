@@ -1,6 +1,7 @@
-from sqlalchemy import Column, Integer, ForeignKey, String
+from sqlalchemy import BigInteger, Column, DateTime, Integer, ForeignKey, String
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func
 from .base import Base, TimestampMixin
 import uuid
 
@@ -13,6 +14,9 @@ class Transaction(Base, TimestampMixin):
     ticker = Column(String(10), nullable=False)
     amount = Column(Integer, nullable=False)
     price = Column(Integer, nullable=False)
+    seq = Column(BigInteger, nullable=False)
+    # Partition key of the range-partitioned table, hence part of the primary key
+    created_at = Column(DateTime(timezone=True), primary_key=True, server_default=func.now())
 
     buy_order = relationship(
         "Order",
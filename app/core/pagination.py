@@ -0,0 +1,17 @@
+from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Opaque keyset cursor: "<created_at in epoch microseconds>_<tie-breaker>"
+def encode_cursor(created_at: datetime, key) -> str:
+    return f"{(created_at - EPOCH) // timedelta(microseconds=1)}_{key}"
+
+def decode_cursor(cursor: str | None, key_type=str):
+    if cursor is None:
+        return None
+    try:
+        micros, key = cursor.split("_", 1)
+        return EPOCH + timedelta(microseconds=int(micros)), key_type(key)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
@@ -0,0 +1,4 @@
+from redis import asyncio as aioredis
+from .config import settings
+
+redis_client = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
@@ -0,0 +1,11 @@
+from typing import Any
+
+import orjson
+from fastapi.responses import ORJSONResponse
+
+
+class FastJSONResponse(ORJSONResponse):
+    # Hot read endpoints return plain dicts/lists straight from SQL rows, skipping the
+    # response_model re-validation. OPT_UTC_Z keeps UTC timestamps as "...Z", like pydantic.
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_UTC_Z)
@@ -22,10 +22,24 @@ class L2OrderBook(BaseModel):
     bid_levels: List[OrderBookLevel]
     ask_levels: List[OrderBookLevel]
 
+class L2OrderBookDelta(BaseModel):
+    version: int
+    snapshot: bool
+    bid_levels: List[OrderBookLevel]
+    ask_levels: List[OrderBookLevel]
+
 class CreateOrderResponse(BaseModel):
     success: bool = True
     order_id: UUID
 
+class BatchOrderResult(BaseModel):
+    success: bool
+    order_id: Optional[UUID] = None
+    error: Optional[str] = None
+
+class BatchOrderResponse(BaseModel):
+    results: List[BatchOrderResult]
+
 class LimitOrderBody(BaseModel):
     direction: Direction
     ticker: str
@@ -0,0 +1,120 @@
+import logging
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+from .config import settings
+
+logger = logging.getLogger("sql")
+
+
+class RequestProfile:
+    # Statements run on behalf of one request. Tasks spawned by the request inherit it,
+    # so it stops counting once the response is done.
+    def __init__(self, path: str):
+        self.path = path
+        self.statements = 0
+        self.seconds = 0.0
+        self.repeats: dict[str, list] = {}
+        self.closed = False
+
+    def record(self, statement: str, parameters, seconds: float):
+        if self.closed:
+            return
+        self.statements += 1
+        self.seconds += seconds
+        seen = self.repeats.setdefault(statement, [0, 0.0])
+        seen[0] += 1
+        seen[1] += seconds
+        if seconds * 1000 >= settings.SQL_SLOW_QUERY_MS:
+            logger.warning("slow query", extra={"fields": {
+                "path": self.path,
+                "duration_ms": round(seconds * 1000, 3),
+                "statement": statement,
+                "params": param_shape(parameters),
+            }})
+
+    def repeated(self) -> dict[str, list]:
+        # Identical SQL issued SQL_REPEAT_THRESHOLD+ times: usually a query per row (N+1)
+        return {
+            statement: seen for statement, seen in self.repeats.items()
+            if seen[0] >= settings.SQL_REPEAT_THRESHOLD
+        }
+
+    def close(self):
+        self.closed = True
+        for statement, (count, seconds) in self.repeated().items():
+            logger.warning("repeated statement", extra={"fields": {
+                "path": self.path,
+                "count": count,
+                "total_ms": round(seconds * 1000, 3),
+                "statement": statement,
+            }})
+
+
+current_profile: ContextVar[RequestProfile | None] = ContextVar("current_profile", default=None)
+
+
+def param_shape(parameters):
+    # Types instead of values: no balances or api keys end up in the log
+    if isinstance(parameters, list) and parameters and isinstance(parameters[0], (tuple, list, dict)):
+        return f"{len(parameters)} x {param_shape(parameters[0])}"
+    if isinstance(parameters, dict):
+        return {key: _value_shape(value) for key, value in parameters.items()}
+    if isinstance(parameters, (tuple, list)):
+        return [_value_shape(value) for value in parameters]
+    return type(parameters).__name__
+
+
+def _value_shape(value) -> str:
+    if isinstance(value, (tuple, list)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+
+def install(engine):
+    # Cursor-level events, so executemany batches and statements issued by flushes count too
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        conn.info["profile_start"] = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _finish(conn, cursor, statement, parameters, context, executemany):
+        profile = current_profile.get()
+        start = conn.info.pop("profile_start", None)
+        if profile is not None and start is not None:
+            profile.record(statement, parameters, time.perf_counter() - start)
+
+
+class SQLProfilerMiddleware:
+    # Adds X-SQL-Statements, X-SQL-Time-Ms and X-SQL-Repeated (statements over the
+    # repeat threshold) to every response; only mounted when SQL_PROFILE is on
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["path"])
+        token = current_profile.set(profile)
+
+        async def send_profiled(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"x-sql-statements", str(profile.statements).encode()),
+                    (b"x-sql-time-ms", f"{profile.seconds * 1000:.3f}".encode()),
+                    (b"x-sql-repeated", str(len(profile.repeated())).encode()),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_profiled)
+        finally:
+            current_profile.reset(token)
+            profile.close()
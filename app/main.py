@@ -1,24 +1,72 @@
 from fastapi import FastAPI
 from fastapi.openapi.utils import get_openapi
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
 from api.routers import (
     public,
     balance,
     orders,
-    admin
+    admin,
+    market_data
 )
 from fastapi.middleware.cors import CORSMiddleware
 
-from core.logging_middleware import LoggingMiddleware
+from core.config import settings
+from core.database import engine, pool_stats, replica_engine
+from core.invalidation import invalidation_bus
+from core.logging_middleware import LoggingMiddleware, configure_logging
+from core.metrics import CONTENT_TYPE_LATEST, MetricsMiddleware, pool_wait, render_metrics
+from core.redis import redis_client
+from core import sql_profiler
+from services.market_data import market_data as market_data_hub
+from services.instrument_catalog import instrument_catalog
+from services.matching_actor import matching_actors
+
+configure_logging()
+pool_stats.listeners.append(pool_wait.observe)
 
 app = FastAPI(title="API Tochka", version="0.1.0")
 
 app.add_middleware(LoggingMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+if settings.SQL_PROFILE:
+    sql_profiler.install(engine)
+    if replica_engine is not None:
+        sql_profiler.install(replica_engine)
+    app.add_middleware(sql_profiler.SQLProfilerMiddleware)
+
+@app.on_event("startup")
+async def start_invalidation_bus():
+    await invalidation_bus.start()
+
+@app.on_event("startup")
+async def preload_instruments():
+    await instrument_catalog.load()
+
+@app.on_event("startup")
+async def start_market_data():
+    await market_data_hub.start()
+
+@app.on_event("shutdown")
+async def stop_invalidation_bus():
+    await invalidation_bus.stop()
+
+@app.on_event("shutdown")
+async def stop_matching_actors():
+    await matching_actors.stop()
+
+@app.on_event("shutdown")
+async def stop_market_data():
+    await market_data_hub.stop()
 
 @app.get("/health", include_in_schema=False)
 def health():
     return {"status": "ok"}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(await render_metrics(redis_client), media_type=CONTENT_TYPE_LATEST)
+
 
 def custom_openapi():
     if app.openapi_schema:
@@ -57,3 +105,4 @@ app.include_router(public.router)
 app.include_router(balance.router)
 app.include_router(orders.router)
 app.include_router(admin.router)
+app.include_router(market_data.router)
@@ -2,20 +2,38 @@ import logging
 from uuid import UUID
 from fastapi import HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import Integer, String, column, delete, func, select, tuple_, union_all, update, values
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID, insert
 from core.exceptions import InsufficientBalanceException
-from core.models.balance import Balance
+from core.config import settings
+from core.metrics import balance_lock_wait
+from core.models.balance import Balance, BalanceLedger
 
 class BalanceRepository:
+    def __init__(self, mode: str = settings.BALANCE_MODE):
+        self.ledger = mode == "ledger"
+
     async def get_user_balances(
         self, 
         db: AsyncSession, 
         user_id: UUID
     ) -> list[Balance]:
+        if not self.ledger:
+            result = await db.execute(
+                select(Balance).where(Balance.user_id == user_id)
+            )
+            return result.scalars().all()
+
+        # Effective balances: the row plus whatever is still waiting in the ledger
+        parts = union_all(
+            select(Balance.ticker, Balance.amount, Balance.frozen).where(Balance.user_id == user_id),
+            select(BalanceLedger.ticker, BalanceLedger.amount, BalanceLedger.frozen).where(BalanceLedger.user_id == user_id),
+        ).subquery()
         result = await db.execute(
-            select(Balance).where(Balance.user_id == user_id)
+            select(parts.c.ticker, func.sum(parts.c.amount).label("amount"), func.sum(parts.c.frozen).label("frozen"))
+            .group_by(parts.c.ticker)
         )
-        return result.scalars().all()
+        return result.all()
 
     async def get_balances_by_ticker(self, db: AsyncSession, ticker: str) -> list[Balance]:
         result = await db.execute(
@@ -32,31 +50,47 @@ class BalanceRepository:
     ) -> Balance | None:
         stmt = select(Balance).where(Balance.user_id == user_id, Balance.ticker == ticker)
         if for_update:
-            stmt = stmt.with_for_update()
+            stmt = stmt.with_for_update().execution_options(populate_existing=True)
         result = await db.execute(stmt)
         return result.scalars().first()
 
+    async def _adjust(self, db: AsyncSession, user_id: UUID, ticker: str, amount: int, frozen: int, guard) -> bool:
+        # One conditional UPDATE: the row is changed (and locked) only if `guard` holds
+        with balance_lock_wait.labels("adjust").time():
+            result = await db.execute(
+                update(Balance)
+                .where(Balance.user_id == user_id, Balance.ticker == ticker, guard)
+                .values(amount=Balance.amount + amount, frozen=Balance.frozen + frozen)
+                .returning(Balance.amount, Balance.frozen)
+                .execution_options(synchronize_session=False)
+            )
+        return result.first() is not None
+
     async def deposit(self, db: AsyncSession, user_id: UUID, ticker: str, amount: int):
-        logging.info(f"Deposit: user={user_id}, ticker={ticker}, amount={amount}")
+        logging.debug("Deposit: user=%s, ticker=%s, amount=%s", user_id, ticker, amount)
         if amount <= 0:
             raise HTTPException(status_code=400, detail="Amount must be positive")
-        balance = await self.get_balance(db, user_id, ticker, for_update=True)
-        if balance:
-            balance.amount += amount
-        else:
-            balance = Balance(user_id=user_id, ticker=ticker, amount=amount, frozen=0)
-            db.add(balance)
+        await db.execute(
+            insert(Balance)
+            .values(user_id=user_id, ticker=ticker, amount=amount, frozen=0)
+            .on_conflict_do_update(
+                index_elements=[Balance.user_id, Balance.ticker],
+                set_={"amount": Balance.amount + amount}
+            )
+        )
 
     async def withdraw(self, db: AsyncSession, user_id: UUID, ticker: str, amount: int):
         if amount <= 0:
             raise HTTPException(status_code=400, detail="Amount must be positive")
-        balance = await self.get_balance(db, user_id, ticker, for_update=True)
-        if not balance:
+        if await self._adjust(db, user_id, ticker, -amount, 0, Balance.amount >= amount):
+            return
+        if self.ledger:
+            await self.fold(db, user_id, ticker)
+            if await self._adjust(db, user_id, ticker, -amount, 0, Balance.amount >= amount):
+                return
+        if not await self.get_balance(db, user_id, ticker):
             raise HTTPException(status_code=404, detail="Balance entry not found")
-        if balance.amount < amount:
-            raise HTTPException(status_code=400, detail="Insufficient funds")
-        balance.amount -= amount
-        db.add(balance)
+        raise HTTPException(status_code=400, detail="Insufficient funds")
 
     async def transfer(
         self,
@@ -81,33 +115,198 @@ class BalanceRepository:
         db.add(to_balance)
 
     async def freeze(self, db: AsyncSession, user_id: UUID, ticker: str, amount: int):
-        logging.info(f"Freeze: user={user_id}, ticker={ticker}, amount={amount}")
+        logging.debug("Freeze: user=%s, ticker=%s, amount=%s", user_id, ticker, amount)
         if amount <= 0:
             raise InsufficientBalanceException("Freeze amount must be positive")
-        balance = await self.get_balance(db, user_id, ticker, for_update=True)
-        if not balance or balance.amount < amount:
-            raise InsufficientBalanceException("Недостаточно средств для резервации")
-        balance.amount -= amount
-        balance.frozen += amount
-        db.add(balance)
+        if await self._adjust(db, user_id, ticker, -amount, amount, Balance.amount >= amount):
+            return
+        if self.ledger:
+            # Credits may still sit in the ledger: fold this account only when it matters
+            await self.fold(db, user_id, ticker)
+            if await self._adjust(db, user_id, ticker, -amount, amount, Balance.amount >= amount):
+                return
+        raise InsufficientBalanceException("Недостаточно средств для резервации")
+
+    async def freeze_many(self, db: AsyncSession, user_id: UUID, amounts: dict[str, int]) -> set[str]:
+        # Freezes several tickers of one user in one statement, rows locked in key order.
+        # Returns the tickers that had enough; the others are left untouched.
+        logging.debug("Freeze many: user=%s, amounts=%s", user_id, amounts)
+        rows = values(
+            column("ticker", String),
+            column("amount", Integer),
+            name="reserve",
+        ).data(sorted(amounts.items()))
+        locked = (
+            select(Balance.ticker)
+            .where(Balance.user_id == user_id, Balance.ticker.in_(list(amounts)))
+            .order_by(Balance.ticker)
+            .with_for_update()
+            .cte("locked")
+            .prefix_with("MATERIALIZED")
+        )
+        with balance_lock_wait.labels("freeze_many").time():
+            result = await db.execute(
+                update(Balance)
+                .where(
+                    Balance.user_id == user_id,
+                    Balance.ticker == rows.c.ticker,
+                    Balance.ticker.in_(select(locked.c.ticker)),
+                    Balance.amount >= rows.c.amount,
+                )
+                .values(amount=Balance.amount - rows.c.amount, frozen=Balance.frozen + rows.c.amount)
+                .returning(Balance.ticker)
+                .execution_options(synchronize_session=False)
+            )
+        return set(result.scalars().all())
 
     async def unfreeze(self, db: AsyncSession, user_id: UUID, ticker: str, amount: int):
-        logging.info(f"Unfreeze: user={user_id}, ticker={ticker}, amount={amount}")
+        logging.debug("Unfreeze: user=%s, ticker=%s, amount=%s", user_id, ticker, amount)
         if amount <= 0:
             raise InsufficientBalanceException("Unfreeze amount must be positive")
-        balance = await self.get_balance(db, user_id, ticker, for_update=True)
-        if not balance or balance.frozen < amount:
+        if self.ledger:
+            # Ledger entries only ever lower `frozen`, so the row alone would overstate it
+            await self.fold(db, user_id, ticker)
+        if not await self._adjust(db, user_id, ticker, amount, -amount, Balance.frozen >= amount):
             raise InsufficientBalanceException("Недостаточно замороженного баланса")
-        balance.amount += amount
-        balance.frozen -= amount
-        db.add(balance)
 
     async def spend_frozen(self, db: AsyncSession, user_id: UUID, ticker: str, amount: int):
-        logging.info(f"Spend frozen: user={user_id}, ticker={ticker}, amount={amount}")
+        logging.debug("Spend frozen: user=%s, ticker=%s, amount=%s", user_id, ticker, amount)
         if amount <= 0:
             raise InsufficientBalanceException("Spend amount must be positive")
-        balance = await self.get_balance(db, user_id, ticker, for_update=True)
-        if not balance or balance.frozen < amount:
+        if self.ledger:
+            await self.fold(db, user_id, ticker)
+        if not await self._adjust(db, user_id, ticker, 0, -amount, Balance.frozen >= amount):
             raise InsufficientBalanceException("Недостаточно замороженного баланса для списания")
-        balance.frozen -= amount
-        db.add(balance)
+
+    async def apply_deltas(
+        self,
+        db: AsyncSession,
+        deltas: list[tuple[UUID, str, int, int]],
+        unreserved: set[tuple[UUID, str]] = frozenset()
+    ):
+        # deltas: (user_id, ticker, amount_delta, frozen_delta), applied in one UPDATE ... FROM (VALUES ...).
+        # `unreserved` accounts spend `frozen` nothing was reserved for, so they are always checked.
+        if self.ledger:
+            # Other than that settlement only adds to `amount` and spends `frozen` reserved at
+            # placement, so it can be appended without checking or locking the balance rows
+            guarded = [delta for delta in deltas if delta[:2] in unreserved]
+            appended = [delta for delta in deltas if delta[:2] not in unreserved]
+            if appended:
+                await db.execute(insert(BalanceLedger).values([
+                    {"user_id": user_id, "ticker": ticker, "amount": amount, "frozen": frozen}
+                    for user_id, ticker, amount, frozen in appended
+                ]))
+            if guarded:
+                for user_id, ticker, _, _ in guarded:
+                    await self.fold(db, user_id, ticker)
+                await self._settle_rows(db, guarded)
+            return
+        await self._settle_rows(db, deltas)
+
+    async def _settle_rows(self, db: AsyncSession, deltas: list[tuple[UUID, str, int, int]]):
+        credited = [
+            {"user_id": user_id, "ticker": ticker, "amount": 0, "frozen": 0}
+            for user_id, ticker, amount, _ in deltas if amount > 0
+        ]
+        if credited:
+            await db.execute(insert(Balance).values(credited).on_conflict_do_nothing())
+
+        rows = values(
+            column("user_id", PG_UUID(as_uuid=True)),
+            column("ticker", String),
+            column("amount", Integer),
+            column("frozen", Integer),
+            name="deltas",
+        ).data(deltas)
+        locked = (
+            select(Balance.user_id, Balance.ticker)
+            .where(tuple_(Balance.user_id, Balance.ticker).in_([(user_id, ticker) for user_id, ticker, _, _ in deltas]))
+            .order_by(Balance.user_id, Balance.ticker)
+            .with_for_update()
+            .cte("locked")
+            .prefix_with("MATERIALIZED")
+        )
+        with balance_lock_wait.labels("settle").time():
+            result = await db.execute(
+                update(Balance)
+                .where(
+                    Balance.user_id == rows.c.user_id,
+                    Balance.ticker == rows.c.ticker,
+                    tuple_(Balance.user_id, Balance.ticker).in_(select(locked.c.user_id, locked.c.ticker)),
+                    Balance.amount + rows.c.amount >= 0,
+                    Balance.frozen + rows.c.frozen >= 0,
+                )
+                .values(amount=Balance.amount + rows.c.amount, frozen=Balance.frozen + rows.c.frozen)
+                .returning(Balance.user_id)
+                .execution_options(synchronize_session=False)
+            )
+        if len(result.all()) != len(deltas):
+            raise InsufficientBalanceException("Insufficient balance to settle trades")
+
+
+    async def fold(
+        self,
+        db: AsyncSession,
+        user_id: UUID | None = None,
+        ticker: str | None = None,
+        limit: int | None = None
+    ) -> int:
+        # Moves the ledger entries of one account (or of the accounts behind the oldest `limit`
+        # entries) into `balances` and returns how many balance rows changed. Folds lock the
+        # balance rows before the entries and take all entries of the accounts they hold, so the
+        # per-account fold waits for a compaction holding its account instead of missing entries
+        # (which left `frozen` overstated), and compaction skips accounts somebody else holds.
+        ledger = BalanceLedger.__table__
+        if user_id is not None:
+            accounts = [(user_id, ticker)]
+            with balance_lock_wait.labels("fold").time():
+                await db.execute(
+                    select(Balance.user_id)
+                    .where(Balance.user_id == user_id, Balance.ticker == ticker)
+                    .with_for_update()
+                )
+        else:
+            oldest = select(ledger.c.user_id, ledger.c.ticker).order_by(ledger.c.id)
+            if limit is not None:
+                oldest = oldest.limit(limit)
+            pending = sorted(set((await db.execute(oldest)).all()))
+            if not pending:
+                return 0
+            accounts = await self._lock_accounts(db, pending)
+            if not accounts:
+                return 0
+
+        moved = (
+            delete(ledger)
+            .where(tuple_(ledger.c.user_id, ledger.c.ticker).in_(accounts))
+            .returning(ledger.c.user_id, ledger.c.ticker, ledger.c.amount, ledger.c.frozen)
+            .cte("moved")
+        )
+        sums = (
+            select(moved.c.user_id, moved.c.ticker, func.sum(moved.c.amount), func.sum(moved.c.frozen))
+            .group_by(moved.c.user_id, moved.c.ticker)
+            .order_by(moved.c.user_id, moved.c.ticker)
+        )
+        stmt = insert(Balance).from_select(["user_id", "ticker", "amount", "frozen"], sums).add_cte(moved)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Balance.user_id, Balance.ticker],
+            set_={"amount": Balance.amount + stmt.excluded.amount, "frozen": Balance.frozen + stmt.excluded.frozen}
+        )
+        result = await db.execute(stmt.returning(Balance.user_id).execution_options(synchronize_session=False))
+        return len(result.all())
+
+    async def _lock_accounts(self, db: AsyncSession, accounts: list[tuple[UUID, str]]) -> list:
+        # Creates the missing balance rows, then locks those nobody else holds, in key order
+        await db.execute(
+            insert(Balance)
+            .values([{"user_id": user_id, "ticker": ticker, "amount": 0, "frozen": 0} for user_id, ticker in accounts])
+            .on_conflict_do_nothing()
+        )
+        with balance_lock_wait.labels("fold").time():
+            result = await db.execute(
+                select(Balance.user_id, Balance.ticker)
+                .where(tuple_(Balance.user_id, Balance.ticker).in_(accounts))
+                .order_by(Balance.user_id, Balance.ticker)
+                .with_for_update(skip_locked=True)
+            )
+        return [tuple(row) for row in result.all()]
@@ -1,7 +1,8 @@
 import logging
+from datetime import datetime
 from uuid import UUID
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import func, select, tuple_
 from core.exceptions import InsufficientBalanceException
 from repositories.balance import BalanceRepository
 from core.models.order import Order
@@ -14,20 +15,53 @@ class OrderRepository(BaseRepository[Order, LimitOrderBody, LimitOrderBody]):
     def __init__(self):
         super().__init__(Order)
 
+    async def get_many(self, db: AsyncSession, order_ids: list, skip_locked: bool = False) -> list[Order]:
+        # One round trip; results follow `order_ids`, missing ids are skipped (and with
+        # skip_locked, so are rows another transaction holds: they come back locked)
+        query = select(Order).where(Order.id.in_([UUID(str(i)) for i in order_ids]))
+        if skip_locked:
+            query = query.with_for_update(skip_locked=True)
+        result = await db.execute(query)
+        orders = {order.id: order for order in result.scalars().all()}
+        return [orders[UUID(str(i))] for i in order_ids if UUID(str(i)) in orders]
+
     async def get_by_user(self, db: AsyncSession, user_id) -> list[Order]:
         result = await db.execute(
             select(Order).where(Order.user_id == user_id)
         )
         return result.scalars().all()
 
-    async def get_user_orders(self, db: AsyncSession, user_id: UUID):
-        result = await db.execute(
-            select(Order).where(
-                Order.user_id == user_id,
-                Order.status.in_(["NEW", "PARTIALLY_EXECUTED"])
-            )
+    async def get_user_orders(
+        self,
+        db: AsyncSession,
+        user_id: UUID,
+        statuses=(OrderStatus.NEW, OrderStatus.PARTIALLY_EXECUTED),
+        limit: int | None = None,
+        before: tuple[datetime, UUID] | None = None
+    ):
+        # Newest first, keyset-paged on (created_at, id); only the columns the API returns
+        query = select(
+            Order.id, Order.status, Order.user_id, Order.created_at, Order.filled,
+            Order.direction, Order.ticker, Order.qty, Order.price
+        ).where(Order.user_id == user_id, Order.status.in_(statuses))
+        if before is not None:
+            query = query.where(tuple_(Order.created_at, Order.id) < before)
+        query = query.order_by(Order.created_at.desc(), Order.id.desc())
+        if limit is not None:
+            query = query.limit(limit)
+        result = await db.execute(query)
+        return result.all()
+
+    async def stream_user_orders(self, db: AsyncSession, user_id: UUID, batch_size: int = 1000):
+        # Server-side cursor: only one batch of rows is held in memory at a time
+        result = await db.stream(
+            select(Order)
+            .where(Order.user_id == user_id)
+            .order_by(Order.created_at.desc(), Order.id.desc())
+            .execution_options(yield_per=batch_size)
         )
-        return result.scalars().all()
+        async for order in result.scalars():
+            yield order
     
     async def get(self, db: AsyncSession, order_id: UUID) -> Order | None:
         return await db.get(Order, order_id)
@@ -82,3 +116,46 @@ class OrderRepository(BaseRepository[Order, LimitOrderBody, LimitOrderBody]):
             .limit(limit)
         )
         return result.scalars().all()
+
+    async def get_stale_queued(self, db: AsyncSession, before: datetime, limit: int) -> list[tuple[UUID, str]]:
+        # (id, ticker) of orders still waiting for queued matching that were stored before `before`
+        result = await db.execute(
+            select(Order.id, Order.ticker)
+            .where(Order.queued.is_(True), Order.created_at < before)
+            .order_by(Order.created_at.asc())
+            .limit(limit)
+        )
+        return result.all()
+
+    async def get_level_qty(self, db: AsyncSession, ticker: str, levels) -> list[tuple[str, int, int]]:
+        # Resting qty at each (direction, price) in `levels`, 0 for levels that are now empty
+        if not levels:
+            return []
+        result = await db.execute(
+            select(Order.direction, Order.price, func.sum(Order.qty - Order.filled))
+            .where(
+                Order.ticker == ticker,
+                tuple_(Order.direction, Order.price).in_(list(levels)),
+                Order.status.in_([OrderStatus.NEW, OrderStatus.PARTIALLY_EXECUTED]),
+                Order.qty > Order.filled
+            )
+            .group_by(Order.direction, Order.price)
+        )
+        found = {(direction, price): qty for direction, price, qty in result}
+        return [(direction, price, found.get((direction, price), 0)) for direction, price in sorted(levels)]
+
+    async def get_levels(self, db: AsyncSession, ticker: str, direction: str, limit: int):
+        result = await db.execute(
+            select(Order.price, func.sum(Order.qty - Order.filled))
+            .where(
+                Order.ticker == ticker,
+                Order.direction == direction,
+                Order.status.in_([OrderStatus.NEW, OrderStatus.PARTIALLY_EXECUTED]),
+                Order.price != None,
+                Order.qty > Order.filled
+            )
+            .group_by(Order.price)
+            .order_by(Order.price.desc() if direction == "BUY" else Order.price.asc())
+            .limit(limit)
+        )
+        return result.all()
@@ -1,17 +1,99 @@
-from sqlalchemy import select
+import re
+from datetime import date, datetime
+from uuid import uuid4
+from sqlalchemy import insert, select, text, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.models.order_book import OrderBookState
 from app.core.models.transaction import Transaction
 from app.repositories.base import BaseRepository
 
+PARTITION_NAME = re.compile(r"^transactions_p(\d{4})(\d{2})$")
+
+def next_month(day: date) -> date:
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
 class TransactionRepository(BaseRepository):
     def __init__(self):
         super().__init__(Transaction)
 
-    async def get_by_ticker(self, db: AsyncSession, ticker: str, limit: int = 10) -> list[Transaction]:
+    async def get_by_ticker(
+        self,
+        db: AsyncSession,
+        ticker: str,
+        limit: int = 10,
+        before: tuple[datetime, int] | None = None
+    ):
+        # Keyset page over ix_transactions_ticker_created_at; only the newest partitions are touched
+        query = select(
+            Transaction.ticker, Transaction.amount, Transaction.price,
+            Transaction.created_at, Transaction.seq
+        ).where(Transaction.ticker == ticker)
+        if before is not None:
+            query = query.where(tuple_(Transaction.created_at, Transaction.seq) < before)
         result = await db.execute(
-            select(Transaction)
-            .where(Transaction.ticker == ticker)
-            .order_by(Transaction.created_at.desc())
+            query
+            .order_by(Transaction.created_at.desc(), Transaction.seq.desc())
             .limit(limit)
         )
-        return result.scalars().all()
+        return result.all()
+
+    async def reserve_seq(self, db: AsyncSession, ticker: str, count: int) -> int:
+        # The counter row stays locked until commit, so sequence numbers are gap-free per ticker
+        state = OrderBookState.__table__
+        result = await db.execute(
+            pg_insert(state)
+            .values(ticker=ticker, trade_seq=count)
+            .on_conflict_do_update(
+                index_elements=[state.c.ticker],
+                set_={"trade_seq": state.c.trade_seq + count}
+            )
+            .returning(state.c.trade_seq)
+        )
+        return result.scalar_one() - count + 1
+
+    async def insert_trades(self, db: AsyncSession, trades: list[dict]) -> list[dict]:
+        by_ticker: dict[str, list[dict]] = {}
+        for trade in trades:
+            by_ticker.setdefault(trade["ticker"], []).append(trade)
+
+        rows = []
+        for ticker, ticker_trades in by_ticker.items():
+            first_seq = await self.reserve_seq(db, ticker, len(ticker_trades))
+            for offset, trade in enumerate(ticker_trades):
+                rows.append({**trade, "id": uuid4(), "seq": first_seq + offset})
+
+        await db.execute(insert(Transaction.__table__).values(rows))
+        return rows
+
+
+    async def ensure_partitions(self, db: AsyncSession, first: date, last: date) -> list[str]:
+        created = []
+        month = first.replace(day=1)
+        while month <= last:
+            name = f"transactions_p{month:%Y%m}"
+            exists = (await db.execute(text("SELECT to_regclass(:name)"), {"name": name})).scalar()
+            if exists is None:
+                await db.execute(text(
+                    f"CREATE TABLE {name} PARTITION OF transactions "
+                    f"FOR VALUES FROM ('{month}') TO ('{next_month(month)}')"
+                ))
+                created.append(name)
+            month = next_month(month)
+        return created
+
+    async def detach_partitions(self, db: AsyncSession, before: date) -> list[str]:
+        # Detached partitions stay around as plain tables for archiving; nothing is dropped here
+        result = await db.execute(text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = 'transactions'"
+        ))
+        detached = []
+        for name in sorted(result.scalars()):
+            match = PARTITION_NAME.match(name)
+            if match and next_month(date(int(match[1]), int(match[2]), 1)) <= before:
+                await db.execute(text(f"ALTER TABLE transactions DETACH PARTITION {name}"))
+                detached.append(name)
+        return detached
\ No newline at end of file
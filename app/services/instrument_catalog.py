@@ -0,0 +1,59 @@
+import asyncio
+
+import orjson
+
+from core.database import async_session
+from core.invalidation import invalidation_bus
+from core.schemas.instrument import Instrument
+from repositories import instrument_repo
+
+
+class InstrumentCatalog:
+    # Every instrument, loaded in one query per worker and dropped whenever an admin
+    # change is published on the "instrument" topic. `version` moves on each drop.
+    def __init__(self, session_factory):
+        self._session_factory = session_factory
+        self._instruments: dict[str, Instrument] | None = None
+        self._lock = asyncio.Lock()
+        self._json: tuple[int, bytes] | None = None
+        self.version = 0
+
+    def invalidate(self, _key: str | None = None):
+        self._instruments = None
+        self.version += 1
+
+    async def load(self) -> dict[str, Instrument]:
+        instruments = self._instruments
+        if instruments is not None:
+            return instruments
+        async with self._lock:
+            if self._instruments is not None:
+                return self._instruments
+            version = self.version
+            async with self._session_factory() as db:
+                rows = await instrument_repo.get_all(db)
+            instruments = {row.ticker: Instrument.model_validate(row) for row in rows}
+            # An invalidation that arrived during the query wins over what we just read
+            if version == self.version:
+                self._instruments = instruments
+            return instruments
+
+    async def get(self, ticker: str) -> Instrument | None:
+        return (await self.load()).get(ticker)
+
+    async def all(self) -> list[Instrument]:
+        return list((await self.load()).values())
+
+    async def json(self) -> bytes:
+        # GET /public/instrument body, encoded once per catalog version
+        version = self.version
+        if self._json is not None and self._json[0] == version:
+            return self._json[1]
+        body = orjson.dumps([instrument.model_dump() for instrument in await self.all()])
+        if version == self.version:
+            self._json = (version, body)
+        return body
+
+
+instrument_catalog = InstrumentCatalog(async_session)
+invalidation_bus.subscribe("instrument", instrument_catalog.invalidate)
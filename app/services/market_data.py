@@ -0,0 +1,160 @@
+import asyncio
+import json
+import logging
+from contextlib import suppress
+
+from redis.exceptions import RedisError
+
+from core.config import settings
+from core.redis import redis_client
+from services.order_book import order_books
+
+CHANNEL_PREFIX = "md:"
+
+
+def level_list(levels) -> list[dict]:
+    return [{"price": price, "qty": qty} for price, qty in levels]
+
+
+class Subscriber:
+    # Bounded outbox of one client. A None in the queue asks the sender for a snapshot:
+    # on overflow the backlog is dropped instead of slowing down the whole ticker
+    def __init__(self, ticker: str):
+        self.ticker = ticker
+        self.version = 0
+        self.lagged = False
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=settings.MARKET_DATA_CLIENT_BUFFER)
+        self.resync()
+
+    def offer(self, message: str):
+        if self.lagged:
+            return
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.resync()
+
+    def resync(self):
+        if self.lagged:
+            return
+        self.lagged = True
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._queue.put_nowait(None)
+
+    def resume(self, version: int):
+        self.version = version
+        self.lagged = False
+
+    async def get(self) -> str | None:
+        return await self._queue.get()
+
+
+class MarketDataHub:
+    # Matching publishes every committed book step and trade batch once to Redis;
+    # each worker relays them from a single pattern subscription to its local clients
+    def __init__(self, redis):
+        self._redis = redis
+        self._subscribers: dict[str, set[Subscriber]] = {}
+        self._listener: asyncio.Task | None = None
+
+    async def publish(self, ticker: str, step, trades: list[dict]):
+        messages = []
+        if step is not None:
+            prev_version, version, changes = step
+            messages.append({
+                "type": "book",
+                "ticker": ticker,
+                "prev_version": prev_version,
+                "version": version,
+                "bid_levels": [{"price": p, "qty": q} for d, p, q in changes if d == "BUY"],
+                "ask_levels": [{"price": p, "qty": q} for d, p, q in changes if d == "SELL"],
+            })
+        if trades:
+            messages.append({
+                "type": "trades",
+                "ticker": ticker,
+                "trades": [
+                    {"seq": trade["seq"], "price": trade["price"], "amount": trade["amount"]}
+                    for trade in trades
+                ],
+            })
+        try:
+            for message in messages:
+                await self._redis.publish(f"{CHANNEL_PREFIX}{ticker}", json.dumps(message))
+        except RedisError as e:
+            logging.warning(f"Failed to publish market data for {ticker}: {e}")
+
+    async def start(self, timeout: float = 5):
+        # Runs for the worker's lifetime, not just while it has clients: the relayed book
+        # steps also keep this worker's L2 views current without rebuilds
+        if self._listener is None or self._listener.done():
+            subscribed = asyncio.Event()
+            self._listener = asyncio.create_task(self._listen(subscribed), name="market-data-listener")
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(subscribed.wait(), timeout)
+
+    def subscribe(self, ticker: str) -> Subscriber:
+        subscriber = Subscriber(ticker)
+        self._subscribers.setdefault(ticker, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscribers = self._subscribers.get(subscriber.ticker)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[subscriber.ticker]
+
+    async def _listen(self, subscribed: asyncio.Event):
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.psubscribe(f"{CHANNEL_PREFIX}*")
+                subscribed.set()
+                async for message in pubsub.listen():
+                    if message["type"] == "pmessage":
+                        self._receive(message["channel"][len(CHANNEL_PREFIX):], message["data"])
+            except RedisError as e:
+                logging.warning(f"Market data subscription lost: {e}")
+                # Anything published meanwhile is gone, so every client starts over from a snapshot
+                for subscribers in self._subscribers.values():
+                    for subscriber in subscribers:
+                        subscriber.resync()
+                await asyncio.sleep(1)
+            finally:
+                with suppress(RedisError):
+                    await pubsub.aclose()
+
+    def _receive(self, ticker: str, data: str):
+        message = json.loads(data)
+        if message["type"] != "book":
+            for subscriber in self._subscribers.get(ticker, ()):
+                subscriber.offer(data)
+            return
+
+        prev_version, version = message["prev_version"], message["version"]
+        order_books.apply_remote(
+            ticker, prev_version, version,
+            [("BUY", level["price"], level["qty"]) for level in message["bid_levels"]]
+            + [("SELL", level["price"], level["qty"]) for level in message["ask_levels"]]
+        )
+        for subscriber in self._subscribers.get(ticker, ()):
+            if subscriber.lagged or version <= subscriber.version:
+                continue
+            if prev_version != subscriber.version:
+                # The client would miss a step: resync it instead of sending a broken delta
+                subscriber.resync()
+                continue
+            subscriber.version = version
+            subscriber.offer(data)
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._listener
+            self._listener = None
+
+
+market_data = MarketDataHub(redis_client)
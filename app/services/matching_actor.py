@@ -0,0 +1,319 @@
+import asyncio
+import json
+import logging
+import time
+from contextlib import suppress
+from uuid import UUID, uuid4
+
+from fastapi import HTTPException
+from redis.exceptions import RedisError
+
+from core.config import settings
+from core.database import async_session
+from core.exceptions import InsufficientBalanceException, MatchingUnavailableException
+from core.models.order import Order, OrderStatus
+from core.redis import redis_client
+from services.order_matching import order_matching_service
+
+# Extend / drop the ticker lease only while this process still holds it
+RENEW_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class TickerActor:
+    def __init__(self, ticker: str, handler):
+        self.ticker = ticker
+        self._handler = handler
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._stopped = False
+        self._closing = False
+        self._task = asyncio.create_task(self._run(), name=f"matching-actor-{ticker}")
+
+    async def submit(self, job):
+        if self._stopped:
+            raise MatchingUnavailableException(f"Matching actor {self.ticker} is shutting down")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((job, future))
+        return await future
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    async def _next_batch(self) -> list:
+        # Collect up to MATCHING_BATCH_MAX_ORDERS jobs, waiting at most
+        # MATCHING_BATCH_WINDOW_MS after the first one arrives. None marks the end of the queue.
+        loop = asyncio.get_running_loop()
+        item = await self._queue.get()
+        if item is None:
+            self._closing = True
+            return []
+        batch = [item]
+        deadline = loop.time() + settings.MATCHING_BATCH_WINDOW_MS / 1000
+        while len(batch) < settings.MATCHING_BATCH_MAX_ORDERS:
+            timeout = deadline - loop.time()
+            try:
+                if timeout > 0:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                else:
+                    item = self._queue.get_nowait()
+            except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                break
+            if item is None:
+                self._closing = True
+                break
+            batch.append(item)
+        return batch
+
+    async def _run(self):
+        while not self._closing:
+            batch = await self._next_batch()
+            if not batch:
+                continue
+            try:
+                results = await self._handler([job for job, _ in batch])
+            except Exception as e:
+                logging.error(f"Matching actor {self.ticker}: batch of {len(batch)} failed: {e}")
+                results = [e] * len(batch)
+
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    async def stop(self):
+        # Jobs already accepted are still placed; nothing is accepted after them
+        self._stopped = True
+        await self._queue.put(None)
+        await self._task
+
+
+class MatchingActors:
+    # One actor per ticker across all processes: the process holding the ticker's Redis lease
+    # matches it, the others forward their placements and cancels to it and wait for the
+    # outcome. Postgres stays the arbiter, so a lapsed lease costs exclusivity, not correctness.
+    def __init__(self, redis, session_factory, matcher):
+        self._redis = redis
+        self._session_factory = session_factory
+        self._matcher = matcher
+        self._token = uuid4().hex
+        self._actors: dict[str, TickerActor] = {}
+        self._keepers: dict[str, asyncio.Task] = {}
+        self._serving: set[asyncio.Task] = set()
+
+    @staticmethod
+    def _owner_key(ticker: str) -> str:
+        return f"matching:owner:{ticker}"
+
+    @staticmethod
+    def _inbox_key(ticker: str) -> str:
+        return f"matching:inbox:{ticker}"
+
+    async def submit(self, ticker: str, order: Order, reserve: tuple[str, int] | None):
+        return await self._run_job(ticker, ("place", order, reserve))
+
+    async def cancel(self, ticker: str, order_id: UUID, user_id: UUID):
+        # Cancels move the resident book too, so they go through the ticker's owner as well
+        return await self._run_job(ticker, ("cancel", order_id, user_id))
+
+    async def _run_job(self, ticker: str, job: tuple):
+        try:
+            actor = await self._local(ticker)
+        except RedisError as e:
+            logging.warning(f"Matching lease of {ticker} unavailable, handling the job in this process: {e}")
+            return self._unwrap((await self._handle([job]))[0])
+        if actor is not None:
+            return await actor.submit(job)
+        return await self._forward(ticker, job)
+
+    async def _local(self, ticker: str) -> TickerActor | None:
+        actor = self._actors.get(ticker)
+        if actor is not None:
+            return actor
+        ttl_ms = int(settings.MATCHING_OWNER_TTL_SECONDS * 1000)
+        claimed = await self._redis.set(self._owner_key(ticker), self._token, nx=True, px=ttl_ms)
+        if ticker in self._actors:
+            return self._actors[ticker]
+        if not claimed:
+            return None
+        actor = self._actors[ticker] = TickerActor(ticker, self._handle)
+        self._keepers[ticker] = asyncio.create_task(self._keep(ticker, actor), name=f"matching-lease-{ticker}")
+        return actor
+
+    async def _keep(self, ticker: str, actor: TickerActor):
+        # Renews the lease and serves forwarded jobs until the lease is lost or released
+        consumer = asyncio.create_task(self._consume(ticker, actor), name=f"matching-inbox-{ticker}")
+        ttl = settings.MATCHING_OWNER_TTL_SECONDS
+        renewed = time.monotonic()
+        try:
+            while True:
+                await asyncio.sleep(ttl / 3)
+                try:
+                    held = await self._redis.eval(
+                        RENEW_SCRIPT, 1, self._owner_key(ticker), self._token, int(ttl * 1000)
+                    )
+                except RedisError as e:
+                    logging.warning(f"Failed to renew the matching lease of {ticker}: {e}")
+                    held = time.monotonic() - renewed < ttl
+                else:
+                    renewed = time.monotonic()
+                if not held:
+                    logging.warning(f"Matching lease of {ticker} lost, forwarding its orders from now on")
+                    break
+        finally:
+            consumer.cancel()
+            with suppress(asyncio.CancelledError):
+                await consumer
+            if self._actors.get(ticker) is actor:
+                del self._actors[ticker]
+            self._keepers.pop(ticker, None)
+            await actor.stop()
+
+    async def _consume(self, ticker: str, actor: TickerActor):
+        while True:
+            try:
+                item = await self._redis.blpop([self._inbox_key(ticker)], timeout=1)
+            except RedisError as e:
+                logging.warning(f"Matching inbox of {ticker} unavailable: {e}")
+                await asyncio.sleep(1)
+                continue
+            if item is None:
+                continue
+            job = json.loads(item[1])
+            if job["deadline"] < time.time():
+                # The sender has given up and reported a failure: don't place it behind its back
+                continue
+            task = asyncio.create_task(self._serve(actor, job))
+            self._serving.add(task)
+            task.add_done_callback(self._serving.discard)
+
+    async def _serve(self, actor: TickerActor, message: dict):
+        try:
+            result = await actor.submit(self._decode(message))
+            reply = {"result": None if result is None else str(result)}
+        except InsufficientBalanceException as e:
+            reply = {"error": "insufficient", "detail": str(e)}
+        except HTTPException as e:
+            reply = {"error": "http", "status": e.status_code, "detail": e.detail}
+        except Exception as e:
+            reply = {"error": "failed", "detail": str(e)}
+        try:
+            await self._redis.rpush(message["reply"], json.dumps(reply))
+            await self._redis.expire(message["reply"], int(settings.MATCHING_FORWARD_TIMEOUT_SECONDS) + 1)
+        except RedisError as e:
+            logging.warning(f"Failed to reply to a forwarded {message['kind']} job: {e}")
+
+    async def _forward(self, ticker: str, job: tuple):
+        # A job that timed out here may still have been carried out just before its deadline
+        timeout = settings.MATCHING_FORWARD_TIMEOUT_SECONDS
+        message = self._encode(job)
+        message["reply"] = f"matching:reply:{uuid4().hex}"
+        message["deadline"] = time.time() + timeout
+        try:
+            await self._redis.rpush(self._inbox_key(ticker), json.dumps(message))
+            item = await self._redis.blpop([message["reply"]], timeout=timeout)
+        except RedisError as e:
+            raise MatchingUnavailableException(f"Matching of {ticker} unreachable: {e}")
+        if item is None:
+            raise MatchingUnavailableException(f"Matching of {ticker} did not answer in time")
+        reply = json.loads(item[1])
+        if reply.get("error") == "insufficient":
+            raise InsufficientBalanceException(reply["detail"])
+        if reply.get("error") == "http":
+            raise HTTPException(status_code=reply["status"], detail=reply["detail"])
+        if "error" in reply:
+            raise RuntimeError(reply["detail"])
+        return None if reply["result"] is None else UUID(reply["result"])
+
+    @staticmethod
+    def _encode(job: tuple) -> dict:
+        if job[0] == "cancel":
+            _, order_id, user_id = job
+            return {"kind": "cancel", "order_id": str(order_id), "user_id": str(user_id)}
+        _, order, reserve = job
+        return {
+            "kind": "place",
+            "order": {
+                "id": str(order.id),
+                "user_id": str(order.user_id),
+                "direction": order.direction,
+                "ticker": order.ticker,
+                "qty": order.qty,
+                "price": order.price,
+            },
+            "reserve": reserve,
+        }
+
+    @staticmethod
+    def _decode(message: dict) -> tuple:
+        if message["kind"] == "cancel":
+            return ("cancel", UUID(message["order_id"]), UUID(message["user_id"]))
+        fields = message["order"]
+        order = Order(
+            id=UUID(fields["id"]),
+            user_id=UUID(fields["user_id"]),
+            status=OrderStatus.NEW,
+            direction=fields["direction"],
+            ticker=fields["ticker"],
+            qty=fields["qty"],
+            price=fields["price"],
+            filled=0
+        )
+        return ("place", order, tuple(message["reserve"]) if message["reserve"] else None)
+
+    async def _handle(self, jobs: list[tuple]) -> list:
+        # Consecutive placements share one group commit; cancels run on their own, in order
+        results = []
+        async with self._session_factory() as db:
+            start = 0
+            while start < len(jobs):
+                if jobs[start][0] == "cancel":
+                    _, order_id, user_id = jobs[start]
+                    try:
+                        results.append(await self._matcher.cancel(db, order_id, user_id))
+                    except Exception as e:
+                        results.append(e)
+                    start += 1
+                    continue
+                end = start
+                while end < len(jobs) and jobs[end][0] == "place":
+                    end += 1
+                try:
+                    results.extend(await self._matcher.place_batch(db, [job[1:] for job in jobs[start:end]]))
+                except Exception as e:
+                    results.extend([e] * (end - start))
+                start = end
+        return results
+
+    @staticmethod
+    def _unwrap(result):
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def stop(self):
+        keepers, self._keepers = dict(self._keepers), {}
+        for ticker, keeper in keepers.items():
+            keeper.cancel()
+            with suppress(asyncio.CancelledError):
+                await keeper
+            with suppress(RedisError):
+                await self._redis.eval(RELEASE_SCRIPT, 1, self._owner_key(ticker), self._token)
+        for task in list(self._serving):
+            with suppress(asyncio.CancelledError):
+                await task
+
+
+matching_actors = MatchingActors(redis_client, async_session, order_matching_service)
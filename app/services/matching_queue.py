@@ -0,0 +1,110 @@
+import asyncio
+import logging
+from uuid import UUID, uuid4
+
+from celery_app import celery_app
+from core.config import settings
+from core.redis import redis_client
+
+LOCK_TTL_SECONDS = 30
+SCHEDULE_TTL_SECONDS = 60
+
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+# Moves up to ARGV[1] ids from the head of the backlog to the tail of the processing list
+# in one step (a batch of LMOVEs), so an id is always in one of the two lists
+CLAIM_SCRIPT = """
+local ids = redis.call("lrange", KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #ids > 0 then
+    redis.call("ltrim", KEYS[1], #ids, -1)
+    redis.call("rpush", KEYS[2], unpack(ids))
+end
+return ids
+"""
+# Puts everything left in the processing list back at the head of the backlog, in order
+RETURN_SCRIPT = """
+local ids = redis.call("lrange", KEYS[2], 0, -1)
+for i = #ids, 1, -1 do
+    redis.call("lpush", KEYS[1], ids[i])
+end
+redis.call("del", KEYS[2])
+return #ids
+"""
+
+
+class MatchingQueue:
+    # Per-ticker backlog of order ids in Redis. A single drainer per ticker (guarded by
+    # a Redis lock) matches them in batches on the "matching" Celery queue. A batch stays in
+    # the ticker's processing list until its matching has committed, so a failed or killed
+    # drainer hands it back instead of losing it; the handler skips ids matched already.
+    def __init__(self, redis):
+        self._redis = redis
+
+    @staticmethod
+    def _backlog_key(ticker: str) -> str:
+        return f"matching:backlog:{ticker}"
+
+    @staticmethod
+    def _processing_key(ticker: str) -> str:
+        return f"matching:processing:{ticker}"
+
+    async def depth(self, ticker: str) -> int:
+        return await self._redis.llen(self._backlog_key(ticker))
+
+    async def submit(self, ticker: str, order_id: UUID) -> int:
+        depth = await self._redis.rpush(self._backlog_key(ticker), str(order_id))
+        await self._schedule(ticker)
+        return depth
+
+    async def requeue(self, ticker: str, order_ids: list[UUID]):
+        await self._redis.rpush(self._backlog_key(ticker), *[str(order_id) for order_id in order_ids])
+        await self._schedule(ticker)
+
+    async def _schedule(self, ticker: str):
+        # One pending drain task per ticker is enough, the drainer empties the whole backlog
+        if await self._redis.set(f"matching:scheduled:{ticker}", 1, nx=True, ex=SCHEDULE_TTL_SECONDS):
+            await asyncio.to_thread(celery_app.send_task, "tasks.drain_ticker", args=[ticker])
+
+    async def drain(self, ticker: str, handler):
+        await self._redis.delete(f"matching:scheduled:{ticker}")
+
+        lock_key = f"matching:lock:{ticker}"
+        token = uuid4().hex
+        if not await self._redis.set(lock_key, token, nx=True, ex=LOCK_TTL_SECONDS):
+            return
+
+        backlog, processing = self._backlog_key(ticker), self._processing_key(ticker)
+        try:
+            # Left over by a drainer that died mid-batch
+            returned = await self._redis.eval(RETURN_SCRIPT, 2, backlog, processing)
+            if returned:
+                logging.warning(f"Requeued {returned} orders of {ticker} left by an interrupted drain")
+            while True:
+                order_ids = await self._redis.eval(
+                    CLAIM_SCRIPT, 2, backlog, processing, settings.MATCHING_QUEUE_BATCH_SIZE
+                )
+                if not order_ids:
+                    break
+                try:
+                    await handler(order_ids)
+                except Exception as e:
+                    await self._redis.eval(RETURN_SCRIPT, 2, backlog, processing)
+                    logging.error(f"Matching batch of {ticker} failed, requeued {len(order_ids)} orders: {e}")
+                    break
+                # The handler has committed: acknowledge the batch
+                await self._redis.delete(processing)
+                await self._redis.expire(lock_key, LOCK_TTL_SECONDS)
+        finally:
+            await self._redis.eval(RELEASE_SCRIPT, 1, lock_key, token)
+
+        # Orders pushed while we were releasing the lock would otherwise wait for the next submit
+        if await self.depth(ticker):
+            logging.info(f"Matching backlog for {ticker} refilled, rescheduling drain")
+            await self._schedule(ticker)
+
+
+matching_queue = MatchingQueue(redis_client)
@@ -0,0 +1,354 @@
+import asyncio
+import bisect
+import logging
+from collections import deque
+from uuid import UUID
+
+from redis.exceptions import RedisError
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import settings
+from core.database import async_session
+from core.models.order import Order, OrderStatus
+from core.models.order_book import OrderBookState
+from core.redis import redis_client
+
+# Only ever move the shared version forward: publishes from different workers may race
+SET_MAX_SCRIPT = """
+local current = tonumber(redis.call("get", KEYS[1]) or "0")
+if tonumber(ARGV[1]) > current then
+    redis.call("set", KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+
+class BookEntry:
+    __slots__ = ("order_id", "user_id", "direction", "price", "qty")
+
+    def __init__(self, order_id: UUID, user_id: UUID, direction: str, price: int, qty: int):
+        self.order_id = order_id
+        self.user_id = user_id
+        self.direction = direction
+        self.price = price
+        self.qty = qty
+
+
+class BookSide:
+    # Prices are kept as sort keys (negated for bids) so that best price is always first
+    def __init__(self, descending: bool):
+        self.descending = descending
+        self._keys: list[int] = []
+        self._levels: dict[int, deque[BookEntry]] = {}
+        # Aggregated resting qty per price and the prices changed since the last publish
+        self.level_qty: dict[int, int] = {}
+        self.dirty: set[int] = set()
+
+    def _key(self, price: int) -> int:
+        return -price if self.descending else price
+
+    def add(self, entry: BookEntry):
+        level = self._levels.get(entry.price)
+        if level is None:
+            level = self._levels[entry.price] = deque()
+            bisect.insort(self._keys, self._key(entry.price))
+        level.append(entry)
+        self.level_qty[entry.price] = self.level_qty.get(entry.price, 0) + entry.qty
+        self.dirty.add(entry.price)
+
+    def reduce(self, entry: BookEntry, qty: int):
+        entry.qty -= qty
+        self.level_qty[entry.price] -= qty
+        self.dirty.add(entry.price)
+
+    def discard(self, entry: BookEntry):
+        level = self._levels.get(entry.price)
+        if level is None:
+            return
+        if level and level[0] is entry:
+            level.popleft()
+        else:
+            try:
+                level.remove(entry)
+            except ValueError:
+                return
+        self.level_qty[entry.price] -= entry.qty
+        self.dirty.add(entry.price)
+        if not level:
+            del self._levels[entry.price]
+            del self.level_qty[entry.price]
+            del self._keys[bisect.bisect_left(self._keys, self._key(entry.price))]
+
+    def walk(self, limit_price: int | None = None):
+        limit_key = None if limit_price is None else self._key(limit_price)
+        for key in self._keys:
+            if limit_key is not None and key > limit_key:
+                break
+            yield from self._levels[-key if self.descending else key]
+
+    def clear(self):
+        self.dirty.update(self._levels)
+        self._keys.clear()
+        self._levels.clear()
+        self.level_qty.clear()
+
+
+class OrderBook:
+    def __init__(self, ticker: str):
+        self.ticker = ticker
+        self.seq: int | None = None
+        self.published_seq: int | None = None
+        self.reloaded = False
+        self.bids = BookSide(descending=True)
+        self.asks = BookSide(descending=False)
+        self._orders: dict[UUID, BookEntry] = {}
+
+    def side(self, direction: str) -> BookSide:
+        return self.bids if direction == "BUY" else self.asks
+
+    def add(self, order_id: UUID, user_id: UUID, direction: str, price: int, qty: int):
+        if qty <= 0 or order_id in self._orders:
+            return
+        entry = BookEntry(order_id, user_id, direction, price, qty)
+        self._orders[order_id] = entry
+        self.side(direction).add(entry)
+
+    def remove(self, order_id: UUID):
+        entry = self._orders.pop(order_id, None)
+        if entry:
+            self.side(entry.direction).discard(entry)
+
+    def fill(self, entry: BookEntry, qty: int):
+        self.side(entry.direction).reduce(entry, qty)
+        if entry.qty <= 0:
+            self.remove(entry.order_id)
+
+    def match_plan(self, direction: str, price: int | None, qty: int) -> list[tuple[BookEntry, int]]:
+        opposite = self.asks if direction == "BUY" else self.bids
+        plan = []
+        for entry in opposite.walk(price):
+            if qty <= 0:
+                break
+            trade_qty = min(qty, entry.qty)
+            plan.append((entry, trade_qty))
+            qty -= trade_qty
+        return plan
+
+    def take_changes(self) -> list[tuple[str, int, int]]:
+        changes = []
+        for direction, side in (("BUY", self.bids), ("SELL", self.asks)):
+            changes.extend((direction, price, side.level_qty.get(price, 0)) for price in side.dirty)
+            side.dirty.clear()
+        return changes
+
+    def clear(self):
+        self.bids.clear()
+        self.asks.clear()
+        self._orders.clear()
+
+
+class L2View:
+    # Committed, aggregated price levels of one ticker as of book sequence `version`,
+    # plus a bounded history of (from_version, to_version, level changes)
+    def __init__(self, version: int, bids: dict[int, int], asks: dict[int, int]):
+        self.version = version
+        self.bids = bids
+        self.asks = asks
+        self.history: deque = deque(maxlen=settings.ORDERBOOK_DELTA_HISTORY)
+        self._sorted = None
+
+    def apply(self, version: int, changes: list[tuple[str, int, int]]):
+        for direction, price, qty in changes:
+            levels = self.bids if direction == "BUY" else self.asks
+            if qty > 0:
+                levels[price] = qty
+            else:
+                levels.pop(price, None)
+        self.history.append((self.version, version, changes))
+        self.version = version
+        self._sorted = None
+
+    def reset(self, version: int, bids: dict[int, int], asks: dict[int, int]):
+        # Diffing against the new state keeps the history contiguous across full rebuilds
+        changes = []
+        for direction, old, new in (("BUY", self.bids, bids), ("SELL", self.asks, asks)):
+            changes.extend(
+                (direction, price, new.get(price, 0))
+                for price in old.keys() | new.keys()
+                if old.get(price) != new.get(price)
+            )
+        self.apply(version, changes)
+
+    def delta(self, since: int) -> list[tuple[str, int, int]] | None:
+        # None means `since` is not a version this view passed through: send a snapshot
+        if since == self.version:
+            return []
+        merged = {}
+        found = False
+        for prev_version, _, changes in self.history:
+            found = found or prev_version == since
+            if found:
+                for direction, price, qty in changes:
+                    merged[(direction, price)] = qty
+        if not found:
+            return None
+        return [(direction, price, qty) for (direction, price), qty in merged.items()]
+
+    def levels(self, limit: int) -> tuple[list[tuple[int, int]], list[tuple[int, int]]]:
+        if self._sorted is None:
+            self._sorted = (sorted(self.bids.items(), reverse=True), sorted(self.asks.items()))
+        bids, asks = self._sorted
+        return bids[:limit], asks[:limit]
+
+
+class OrderBookRegistry:
+    def __init__(self, redis):
+        self._redis = redis
+        self._books: dict[str, OrderBook] = {}
+        self._views: dict[str, L2View] = {}
+        self._view_locks: dict[str, asyncio.Lock] = {}
+
+    def get(self, ticker: str) -> OrderBook:
+        book = self._books.get(ticker)
+        if book is None:
+            book = self._books[ticker] = OrderBook(ticker)
+        return book
+
+    def _install(self, ticker: str, version: int, bids: dict[int, int], asks: dict[int, int]) -> L2View:
+        view = self._views.get(ticker)
+        if view is None:
+            view = self._views[ticker] = L2View(version, bids, asks)
+        elif version > view.version:
+            view.reset(version, bids, asks)
+        return view
+
+    def invalidate(self, ticker: str):
+        book = self._books.get(ticker)
+        if book:
+            book.seq = None
+
+    async def bump(self, db: AsyncSession, ticker: str) -> int:
+        # Every write to a ticker's resting orders bumps its sequence row first: that serializes
+        # the writers of the ticker across processes and numbers the book step of the commit
+        result = await db.execute(
+            insert(OrderBookState)
+            .values(ticker=ticker, book_seq=1)
+            .on_conflict_do_update(
+                index_elements=[OrderBookState.ticker],
+                set_={"book_seq": OrderBookState.book_seq + 1}
+            )
+            .returning(OrderBookState.book_seq)
+        )
+        return result.scalar_one()
+
+    async def sync(self, db: AsyncSession, ticker: str) -> tuple[OrderBook, bool]:
+        # The bump also tells us whether anyone else changed the book since our last pass
+        seq = await self.bump(db, ticker)
+        book = self.get(ticker)
+        reloaded = book.seq is None or seq != book.seq + 1
+        if reloaded:
+            await self.reload(db, book)
+        book.seq = seq
+        return book, reloaded
+
+    async def reload(self, db: AsyncSession, book: OrderBook):
+        result = await db.execute(
+            select(Order.id, Order.user_id, Order.direction, Order.price, Order.qty - Order.filled)
+            .where(
+                Order.ticker == book.ticker,
+                Order.status.in_([OrderStatus.NEW, OrderStatus.PARTIALLY_EXECUTED]),
+                Order.price != None,
+                Order.qty > Order.filled
+            )
+            .order_by(Order.created_at.asc(), Order.id.asc())
+        )
+        book.clear()
+        for order_id, user_id, direction, price, qty in result:
+            book.add(order_id, user_id, direction, price, qty)
+        book.reloaded = True
+
+    async def publish(self, ticker: str) -> tuple[int, int, list[tuple[str, int, int]]] | None:
+        # Called after commit: moves the book's committed level changes into the L2 view
+        # and returns the resulting (prev_version, version, changes) step, if any
+        book = self._books.get(ticker)
+        if book is None or book.seq is None:
+            return None
+        changes = book.take_changes()
+        view = self._views.get(ticker)
+        if book.reloaded or view is None or view.version != book.published_seq:
+            view = self._install(ticker, book.seq, dict(book.bids.level_qty), dict(book.asks.level_qty))
+        else:
+            view.apply(book.seq, changes)
+        book.published_seq = book.seq
+        book.reloaded = False
+
+        await self._set_version(ticker, book.seq)
+        if view.history and view.history[-1][1] == book.seq:
+            return view.history[-1]
+        return None
+
+    async def publish_levels(self, ticker: str, seq: int, changes: list[tuple[str, int, int]]):
+        # The "db" engine has no resident book: its writes bump the sequence once and read the
+        # resulting quantity of every level they touched in the same transaction, so the step
+        # from seq - 1 to seq is exact whichever process committed the steps before it
+        step = (seq - 1, seq, changes)
+        self.apply_remote(ticker, *step)
+        await self._set_version(ticker, seq)
+        return step
+
+    async def _set_version(self, ticker: str, seq: int):
+        try:
+            await self._redis.eval(SET_MAX_SCRIPT, 1, f"orderbook:version:{ticker}", seq)
+        except RedisError as e:
+            logging.warning(f"Failed to publish order book version for {ticker}: {e}")
+
+    def apply_remote(self, ticker: str, prev_version: int, version: int, changes: list[tuple[str, int, int]]):
+        # A step published by another process: keeps this view current without a rebuild
+        view = self._views.get(ticker)
+        if view is not None and view.version == prev_version:
+            view.apply(version, changes)
+
+    async def l2(self, ticker: str) -> L2View:
+        view = self._views.get(ticker)
+        try:
+            shared = await self._redis.get(f"orderbook:version:{ticker}")
+        except RedisError as e:
+            logging.warning(f"Failed to read order book version for {ticker}: {e}")
+            shared = None
+        if view is not None and (shared is None or int(shared) <= view.version):
+            return view
+
+        # Another worker committed a newer state: rebuild from the database once
+        lock = self._view_locks.setdefault(ticker, asyncio.Lock())
+        async with lock:
+            view = self._views.get(ticker)
+            if view is not None and (shared is None or int(shared) <= view.version):
+                return view
+            return await self._load_view(ticker)
+
+    async def _load_view(self, ticker: str) -> L2View:
+        async with async_session() as db:
+            seq = (await db.execute(
+                select(OrderBookState.book_seq).where(OrderBookState.ticker == ticker)
+            )).scalar_one_or_none()
+            result = await db.execute(
+                select(Order.direction, Order.price, func.sum(Order.qty - Order.filled))
+                .where(
+                    Order.ticker == ticker,
+                    Order.status.in_([OrderStatus.NEW, OrderStatus.PARTIALLY_EXECUTED]),
+                    Order.price != None,
+                    Order.qty > Order.filled
+                )
+                .group_by(Order.direction, Order.price)
+            )
+        bids, asks = {}, {}
+        for direction, price, qty in result:
+            (bids if direction == "BUY" else asks)[price] = qty
+
+        # A ticker nobody has traded yet is cached at version 0 until its first placement
+        return self._install(ticker, seq or 0, bids, asks)
+
+
+order_books = OrderBookRegistry(redis_client)
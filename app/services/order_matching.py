@@ -1,68 +1,308 @@
 import logging
+import time
+from uuid import UUID
+from fastapi import HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from app.repositories import balance_repo, order_repo
+from sqlalchemy import and_, or_, select, tuple_
+from app.repositories import balance_repo, order_repo, transaction_repo
+from core.config import settings
 from core.exceptions import InsufficientBalanceException
+from core.metrics import commit_duration, match_candidates, match_duration, match_fills
 from core.models.order import Order, OrderStatus
 from core.models.transaction import Transaction
 from repositories.order import OrderRepository
 from repositories.balance import BalanceRepository
+from services.market_data import market_data
+from services.order_book import OrderBook, order_books
+from services.settlement import Settlement
+
+ACTIVE_STATUSES = [OrderStatus.NEW, OrderStatus.PARTIALLY_EXECUTED]
+FINAL_STATUSES = [OrderStatus.EXECUTED, OrderStatus.CANCELLED]
 
 class OrderMatchingService:
-    def __init__(self, order_repo, balance_repo):
+    def __init__(self, order_repo, balance_repo, transaction_repo, engine: str = settings.MATCHING_ENGINE):
         self.order_repo = order_repo
         self.balance_repo = balance_repo
+        self.transaction_repo = transaction_repo
+        self.in_memory = engine == "memory"
+        self.engine = engine
 
-    async def match_order(self, db: AsyncSession, order: Order):
-        if order.status in [OrderStatus.EXECUTED, OrderStatus.CANCELLED]:
-            return
+    async def match_order(self, db: AsyncSession, order: Order, commit: bool = True):
+        if order.status in FINAL_STATUSES:
+            return []
 
-        is_buy = order.direction == "BUY"
-        remaining_qty = order.qty - order.filled
+        start = time.perf_counter()
+        settlement = Settlement()
+        try:
+            # Standalone passes number their own book step; in a batch place_batch does it once
+            seqs = await self.bump_books(db, [order.ticker]) if commit else {}
+            if self.in_memory:
+                book = await self.lock_book(db, order)
+                book.remove(order.id)
+                if order.status in FINAL_STATUSES:
+                    if commit:
+                        await db.commit()
+                    return []
+                scanned = await self._match_in_book(db, book, order, settlement)
+            else:
+                scanned = await self._match_in_db(db, order, settlement)
 
-        opposite_direction = "SELL" if is_buy else "BUY"
+            self._finalize(db, order, settlement)
+            await settlement.apply(db, self.balance_repo, self.transaction_repo)
 
-        is_market = order.price is None
+            if self.in_memory and order.price is not None and order.status in ACTIVE_STATUSES:
+                book.add(order.id, order.user_id, order.direction, order.price, order.qty - order.filled)
+
+            touched = {order.ticker: order_levels(order) | trade_levels(settlement.trades)}
+            levels = await self.read_levels(db, seqs, touched)
+
+            if commit:
+                with commit_duration.labels("matching").time():
+                    await db.commit()
+
+        except Exception as e:
+            if commit:
+                await db.rollback()
+            if self.in_memory:
+                order_books.invalidate(order.ticker)
+            logging.error(f"Order matching failed for order {order.id}: {e}")
+            raise
+
+        match_duration.labels(self.engine).observe(time.perf_counter() - start)
+        match_fills.observe(len(settlement.trades))
+        match_candidates.labels(self.engine).observe(scanned)
+        if commit:
+            await self.publish(order.ticker, settlement.trades, levels.get(order.ticker))
+        return settlement.trades
+
+    async def place_batch(self, db: AsyncSession, placements: list[tuple[Order, tuple[str, int] | None]]) -> list:
+        # Group commit: every order gets its own savepoint (freeze, insert, match) so one
+        # failure doesn't sink the others, and the whole batch pays for a single commit
+        # Read up front: a rolled back savepoint expires the orders it touched
+        tickers = sorted({order.ticker for order, _ in placements})
+        touched = {ticker: set() for ticker in tickers}
+        for order, _ in placements:
+            touched[order.ticker] |= order_levels(order)
+        results = []
+        trades = []
+        try:
+            seqs = await self.bump_books(db, tickers)
+        except Exception:
+            await db.rollback()
+            raise
+        for order, reserve in placements:
+            try:
+                async with db.begin_nested():
+                    if reserve:
+                        await self.balance_repo.freeze(db, order.user_id, *reserve)
+                    db.add(order)
+                    placed = await self.match_order(db, order, commit=False)
+                trades.extend(placed)
+                results.append(order.id)
+            except Exception as e:
+                results.append(e)
 
-        if is_market:
-            base_query = (
+        try:
+            for ticker in tickers:
+                touched[ticker] |= trade_levels([trade for trade in trades if trade["ticker"] == ticker])
+            levels = await self.read_levels(db, seqs, touched)
+            with commit_duration.labels("batch").time():
+                await db.commit()
+        except Exception:
+            await db.rollback()
+            if self.in_memory:
+                for ticker in tickers:
+                    order_books.invalidate(ticker)
+            raise
+
+        for ticker in tickers:
+            if self.in_memory and order_books.get(ticker).seq is None:
+                # A failed placement dropped the book, but the ones around it did commit
+                await self._rebuild_book(db, ticker)
+            await self.publish(ticker, [trade for trade in trades if trade["ticker"] == ticker], levels.get(ticker))
+        return results
+
+    async def _rebuild_book(self, db: AsyncSession, ticker: str):
+        # Reloads the book from committed state under a new sequence, so the next publish
+        # installs it in the view as one step from whatever version clients have
+        try:
+            await order_books.sync(db, ticker)
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            order_books.invalidate(ticker)
+            logging.error(f"Order book rebuild failed for {ticker}: {e}")
+
+    async def cancel(self, db: AsyncSession, order_id: UUID, user_id: UUID):
+        order = await self.order_repo.get(db, order_id)
+        if not order or order.user_id != user_id:
+            raise HTTPException(status_code=404, detail="Order not found")
+        if order.price is None:
+            raise HTTPException(status_code=400, detail="Market orders cannot be cancelled")
+        if order.status != OrderStatus.NEW:
+            raise HTTPException(status_code=400, detail="Only NEW limit orders can be cancelled")
+
+        # lock_book bumps the book sequence: past this point every exit either commits or drops
+        # the local book, otherwise a rolled back bump would hide another worker's next change
+        book = await self.lock_book(db, order)
+        seqs = await self.bump_books(db, [order.ticker])
+        try:
+            # The order may have been refreshed by a reload
+            if order.status != OrderStatus.NEW:
+                raise HTTPException(status_code=400, detail="Only NEW limit orders can be cancelled")
+
+            remaining_qty = order.qty - order.filled
+            if remaining_qty > 0:
+                if order.direction == "BUY":
+                    await self.balance_repo.unfreeze(db, order.user_id, "RUB", remaining_qty * order.price)
+                else:
+                    await self.balance_repo.unfreeze(db, order.user_id, order.ticker, remaining_qty)
+
+            # Not order_repo.cancel: it unfreezes the remainder a second time
+            order.status = OrderStatus.CANCELLED
+            levels = await self.read_levels(db, seqs, {order.ticker: order_levels(order)})
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            if book:
+                order_books.invalidate(order.ticker)
+            raise
+
+        if book:
+            book.remove(order.id)
+        await self.publish(order.ticker, levels=levels.get(order.ticker))
+
+    async def cancel_unplaced(self, db: AsyncSession, orders: list[tuple[UUID, str]]):
+        # (order_id, ticker) of orders stored (and reserved for) before a batch whose placement
+        # failed: cancels them and releases what they still hold instead of leaving them to rest
+        tickers = sorted({ticker for _, ticker in orders}) if self.in_memory else []
+        touched = {}
+        try:
+            for ticker in tickers:
+                await order_books.sync(db, ticker)
+            seqs = await self.bump_books(db, {ticker for _, ticker in orders})
+            result = await db.execute(
                 select(Order)
-                .where(
-                    Order.ticker == order.ticker,
-                    Order.status.in_([OrderStatus.NEW, OrderStatus.PARTIALLY_EXECUTED]),
-                    Order.direction == opposite_direction,
-                    Order.price != None
-                )
-                .order_by(
-                    Order.price.asc() if is_buy else Order.price.desc(),
-                    Order.created_at.asc(),
-                    Order.id.asc()
-                )
+                .where(Order.id.in_([order_id for order_id, _ in orders]))
+                .order_by(Order.id)
                 .with_for_update()
+                .execution_options(populate_existing=True)
             )
+            for order in result.scalars().all():
+                if order.status not in ACTIVE_STATUSES:
+                    continue
+                remaining_qty = order.qty - order.filled
+                if order.price is not None and remaining_qty > 0:
+                    if order.direction == "BUY":
+                        await self.balance_repo.unfreeze(db, order.user_id, "RUB", remaining_qty * order.price)
+                    else:
+                        await self.balance_repo.unfreeze(db, order.user_id, order.ticker, remaining_qty)
+                order.status = OrderStatus.CANCELLED
+                touched.setdefault(order.ticker, set()).update(order_levels(order))
+            levels = await self.read_levels(db, seqs, touched)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            for ticker in tickers:
+                order_books.invalidate(ticker)
+            raise
+
+        for order_id, ticker in orders:
+            if ticker in tickers:
+                order_books.get(ticker).remove(order_id)
+        for ticker in sorted({ticker for _, ticker in orders}):
+            await self.publish(ticker, levels=levels.get(ticker))
+
+    async def publish(self, ticker: str, trades: list[dict] = (), levels: tuple[int, list] | None = None):
+        # `levels` is the (seq, changes) read by read_levels for the "db" engine
+        if self.in_memory:
+            step = await order_books.publish(ticker)
+        elif levels is not None:
+            step = await order_books.publish_levels(ticker, *levels)
         else:
-            price_cmp = Order.price <= order.price if is_buy else Order.price >= order.price
-            base_query = (
-                select(Order)
-                .where(
-                    Order.ticker == order.ticker,
-                    Order.status.in_([OrderStatus.NEW, OrderStatus.PARTIALLY_EXECUTED]),
-                    Order.direction == opposite_direction,
-                    price_cmp
-                )
-                .order_by(
-                    Order.price.asc() if is_buy else Order.price.desc(),
-                    Order.created_at.asc(),
-                    Order.id.asc()
-                )
-                .with_for_update()
-            )
+            step = None
+        await market_data.publish(ticker, step, trades)
 
-        result = await db.execute(base_query)
-        candidates = result.scalars().all()
-        executed = False
+    async def bump_books(self, db: AsyncSession, tickers) -> dict[str, int]:
+        # "db" engine: the resident book's sync does this for "memory". Taken in ticker order
+        # so that transactions writing several books always lock them in the same order
+        if self.in_memory:
+            return {}
+        return {ticker: await order_books.bump(db, ticker) for ticker in sorted(tickers)}
+
+    async def read_levels(self, db: AsyncSession, seqs: dict[str, int], touched: dict[str, set]) -> dict[str, tuple]:
+        # Resulting qty of every level this transaction touched, read before its commit while
+        # the bumped sequence rows still keep other writers of these books out
+        return {
+            ticker: (seq, await self.order_repo.get_level_qty(db, ticker, touched.get(ticker, set())))
+            for ticker, seq in seqs.items()
+        }
+
+    async def lock_book(self, db: AsyncSession, order: Order) -> OrderBook | None:
+        if not self.in_memory:
+            return None
+        book, reloaded = await order_books.sync(db, order.ticker)
+        if reloaded:
+            # Another process touched this ticker, so our copy of the order may be stale too
+            await db.refresh(order)
+        return book
+
+    async def _match_in_book(self, db: AsyncSession, book: OrderBook, order: Order, settlement: Settlement) -> int:
+        # Returns how many resting orders were locked
+        remaining_qty = order.qty - order.filled
+        plan = book.match_plan(order.direction, order.price, remaining_qty)
+        if not plan:
+            return 0
+
+        makers = await self._lock_makers(db, plan)
+        scanned = len(plan)
+        if makers is None:
+            logging.warning(f"Order book for {order.ticker} diverged from the database, reloading")
+            await order_books.reload(db, book)
+            book.remove(order.id)
+            plan = book.match_plan(order.direction, order.price, remaining_qty)
+            makers = await self._lock_makers(db, plan)
+            scanned += len(plan)
+            if makers is None:
+                raise RuntimeError(f"Order book for {order.ticker} is inconsistent after reload")
+
+        for entry, trade_qty in plan:
+            self._fill(db, order, makers[entry.order_id], trade_qty, settlement)
+            book.fill(entry, trade_qty)
+        return scanned
+
+    async def _lock_makers(self, db: AsyncSession, plan) -> dict | None:
+        if not plan:
+            return {}
+        result = await db.execute(
+            select(Order)
+            .where(Order.id.in_([entry.order_id for entry, _ in plan]))
+            .with_for_update()
+        )
+        makers = {match.id: match for match in result.scalars().all()}
+        for entry, _ in plan:
+            match = makers.get(entry.order_id)
+            if (
+                match is None
+                or match.status not in ACTIVE_STATUSES
+                or match.qty - match.filled != entry.qty
+            ):
+                return None
+        return makers
+
+    async def _match_in_db(self, db: AsyncSession, order: Order, settlement: Settlement) -> int:
+        # Returns how many candidate rows were fetched
+        remaining_qty = order.qty - order.filled
+        batch_size = settings.MATCHING_FETCH_BATCH_SIZE
+        last = None
+        scanned = 0
+
+        # Candidates are locked one price-ordered batch at a time, so a small order
+        # against a deep book only touches the rows it can actually trade with
+        while remaining_qty > 0:
+            candidates = await self._fetch_candidates(db, order, last, batch_size)
+            scanned += len(candidates)
 
-        try:
             for match in candidates:
                 if remaining_qty <= 0:
                     break
@@ -72,54 +312,99 @@ class OrderMatchingService:
                     continue
 
                 trade_qty = min(remaining_qty, available_qty)
-                trade_price = match.price
+                self._fill(db, order, match, trade_qty, settlement)
+                remaining_qty -= trade_qty
 
-                buy_order = order if is_buy else match
-                sell_order = match if is_buy else order
+            if len(candidates) < batch_size:
+                break
+            last = candidates[-1]
+        return scanned
 
-                await self.balance_repo.spend_frozen(db, buy_order.user_id, "RUB", trade_qty * trade_price)
-                await self.balance_repo.deposit(db, buy_order.user_id, order.ticker, trade_qty)
+    async def _fetch_candidates(self, db: AsyncSession, order: Order, last: Order | None, limit: int):
+        is_buy = order.direction == "BUY"
+        opposite_direction = "SELL" if is_buy else "BUY"
 
-                await self.balance_repo.spend_frozen(db, sell_order.user_id, order.ticker, trade_qty)
-                await self.balance_repo.deposit(db, sell_order.user_id, "RUB", trade_qty * trade_price)
+        if order.price is None:
+            price_cmp = Order.price != None
+        else:
+            price_cmp = Order.price <= order.price if is_buy else Order.price >= order.price
 
-                order.filled += trade_qty
-                match.filled += trade_qty
-                remaining_qty -= trade_qty
-                executed = True
+        query = (
+            select(Order)
+            .where(
+                Order.ticker == order.ticker,
+                Order.status.in_(ACTIVE_STATUSES),
+                Order.direction == opposite_direction,
+                price_cmp
+            )
+        )
+        if last is not None:
+            query = query.where(
+                or_(
+                    Order.price > last.price if is_buy else Order.price < last.price,
+                    and_(
+                        Order.price == last.price,
+                        tuple_(Order.created_at, Order.id) > tuple_(last.created_at, last.id)
+                    )
+                )
+            )
+        query = (
+            query
+            .order_by(
+                Order.price.asc() if is_buy else Order.price.desc(),
+                Order.created_at.asc(),
+                Order.id.asc()
+            )
+            .limit(limit)
+            .with_for_update(skip_locked=settings.MATCHING_SKIP_LOCKED)
+        )
 
-                match.status = update_status(match)
-                db.add(match)
+        result = await db.execute(query)
+        return result.scalars().all()
 
-            if is_market and order.filled == 0:
-                order.status = OrderStatus.CANCELLED
+    def _fill(self, db: AsyncSession, order: Order, match: Order, trade_qty: int, settlement: Settlement):
+        is_buy = order.direction == "BUY"
+        trade_price = match.price
+
+        buy_order = order if is_buy else match
+        sell_order = match if is_buy else order
+
+        settlement.trade(order.ticker, buy_order, sell_order, trade_qty, trade_price)
+
+        order.filled += trade_qty
+        match.filled += trade_qty
+
+        match.status = update_status(match)
+        db.add(match)
+
+    def _finalize(self, db: AsyncSession, order: Order, settlement: Settlement):
+        is_buy = order.direction == "BUY"
+        is_market = order.price is None
+
+        if is_market and order.filled == 0:
+            order.status = OrderStatus.CANCELLED
+        else:
+            order.status = update_status(order)
+
+        order.queued = False
+        db.add(order)
+
+        if not is_market:
+            if is_buy:
+                leftover_rub = (order.qty - order.filled) * order.price
+                if leftover_rub > 0:
+                    settlement.unfreeze(order.user_id, "RUB", leftover_rub)
             else:
-                order.status = update_status(order)
-
-            db.add(order)
-
-            if not is_market:
-                if is_buy:
-                    leftover_rub = (order.qty - order.filled) * order.price
-                    if leftover_rub > 0:
-                        try:
-                            await self.balance_repo.unfreeze(db, order.user_id, "RUB", leftover_rub)
-                        except Exception as e:
-                            logging.warning(f"Unfreeze failed: {e}")
-                else:
-                    leftover_qty = (order.qty - order.filled)
-                    if leftover_qty > 0:
-                        try:
-                            await self.balance_repo.unfreeze(db, order.user_id, order.ticker, leftover_qty)
-                        except Exception as e:
-                            logging.warning(f"Unfreeze failed: {e}")
+                leftover_qty = (order.qty - order.filled)
+                if leftover_qty > 0:
+                    settlement.unfreeze(order.user_id, order.ticker, leftover_qty)
 
-            await db.commit()
+def order_levels(order: Order) -> set[tuple[str, int]]:
+    return set() if order.price is None else {(order.direction, order.price)}
 
-        except Exception as e:
-            await db.rollback()
-            logging.error(f"Order matching failed for order {order.id}: {e}")
-            raise
+def trade_levels(trades: list[dict]) -> set[tuple[str, int]]:
+    # A trade takes from the maker's level, which is on either side depending on the taker
+    return {(direction, trade["price"]) for trade in trades for direction in ("BUY", "SELL")}
 
 def update_status(order):
     if order.filled == 0:
@@ -129,4 +414,4 @@ def update_status(order):
     else:
         return OrderStatus.EXECUTED
 
-order_matching_service = OrderMatchingService(order_repo, balance_repo)
\ No newline at end of file
+order_matching_service = OrderMatchingService(order_repo, balance_repo, transaction_repo)
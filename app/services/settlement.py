@@ -0,0 +1,62 @@
+from collections import defaultdict
+from uuid import UUID
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+class Settlement:
+    # Nets every balance change of a matching pass per (user_id, ticker) so they
+    # can be written in one statement instead of one locking round trip per fill
+    def __init__(self):
+        self._deltas: dict[tuple[UUID, str], list[int]] = defaultdict(lambda: [0, 0])
+        # Accounts spending `frozen` that no placement reserved (the market order side)
+        self._unreserved: set[tuple[UUID, str]] = set()
+        self.trades: list[dict] = []
+
+    def trade(self, ticker: str, buy_order, sell_order, qty: int, price: int):
+        if buy_order.price is None:
+            self._unreserved.add((buy_order.user_id, "RUB"))
+        if sell_order.price is None:
+            self._unreserved.add((sell_order.user_id, ticker))
+
+        self.spend_frozen(buy_order.user_id, "RUB", qty * price)
+        self.deposit(buy_order.user_id, ticker, qty)
+
+        self.spend_frozen(sell_order.user_id, ticker, qty)
+        self.deposit(sell_order.user_id, "RUB", qty * price)
+
+        self.trades.append({
+            "buy_order_id": buy_order.id,
+            "sell_order_id": sell_order.id,
+            "ticker": ticker,
+            "amount": qty,
+            "price": price,
+        })
+
+    def deposit(self, user_id: UUID, ticker: str, amount: int):
+        self._deltas[(user_id, ticker)][0] += amount
+
+    def spend_frozen(self, user_id: UUID, ticker: str, amount: int):
+        self._deltas[(user_id, ticker)][1] -= amount
+
+    def unfreeze(self, user_id: UUID, ticker: str, amount: int):
+        delta = self._deltas[(user_id, ticker)]
+        delta[0] += amount
+        delta[1] -= amount
+
+    def deltas(self) -> list[tuple[UUID, str, int, int]]:
+        return [
+            (user_id, ticker, amount, frozen)
+            for (user_id, ticker), (amount, frozen) in sorted(self._deltas.items())
+            if amount or frozen
+        ]
+
+    async def apply(self, db: AsyncSession, balance_repo, transaction_repo):
+        deltas = self.deltas()
+        unreserved = set(self._unreserved)
+        self._deltas.clear()
+        self._unreserved.clear()
+        if deltas:
+            await balance_repo.apply_deltas(db, deltas, unreserved)
+        if self.trades:
+            self.trades = await transaction_repo.insert_trades(db, self.trades)
@@ -0,0 +1,94 @@
+"""
+Diff two loadtest.py reports.
+
+    python bench/compare.py before.json after.json [--fail-above 10]
+
+Prints throughput, retries, deadlocks and per-route latency side by side. With --fail-above
+it exits with status 1 when throughput drops, or p50/p99 of any route grows, by more than
+that many percent.
+"""
+import argparse
+import json
+import sys
+
+PERCENTILES = ("p50", "p90", "p99", "max")
+
+
+def change(base: float, new: float) -> float | None:
+    if not base:
+        return None
+    return (new - base) / base * 100
+
+
+def fmt_change(value: float | None) -> str:
+    return "n/a" if value is None else f"{value:+.1f}%"
+
+
+def rows(base: dict, new: dict):
+    # (name, base value, new value, higher is better)
+    yield "orders/s", base["orders_per_sec"], new["orders_per_sec"], True
+    yield "requests/s", base["requests_per_sec"], new["requests_per_sec"], True
+    yield "retries (503)", base["retries_503"], new["retries_503"], False
+    if base["deadlocks"] is not None and new["deadlocks"] is not None:
+        yield "deadlocks (postgres)", base["deadlocks"], new["deadlocks"], False
+    for op in sorted(set(base["routes"]) | set(new["routes"])):
+        b, n = base["routes"].get(op), new["routes"].get(op)
+        if not b or not n or not (b["count"] and n["count"]):
+            continue
+        yield f"{op} req/s", b["rps"], n["rps"], True
+        for p in PERCENTILES:
+            yield f"{op} {p} ms", b["latency_ms"][p], n["latency_ms"][p], False
+
+
+def regressions(base: dict, new: dict, threshold: float) -> list[str]:
+    found = []
+    throughput = change(base["orders_per_sec"], new["orders_per_sec"])
+    if throughput is not None and throughput < -threshold:
+        found.append(f"orders/s {fmt_change(throughput)}")
+    for op, b in base["routes"].items():
+        n = new["routes"].get(op)
+        if not n or not (b["count"] and n["count"]):
+            continue
+        for p in ("p50", "p99"):
+            delta = change(b["latency_ms"][p], n["latency_ms"][p])
+            if delta is not None and delta > threshold:
+                found.append(f"{op} {p} {fmt_change(delta)}")
+    return found
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compare two loadtest.py reports")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--fail-above", type=float, default=None, metavar="PERCENT",
+                        help="exit 1 if throughput or p50/p99 regress by more than PERCENT")
+    args = parser.parse_args(argv)
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    print(f"base: {base.get('label') or args.base} ({base.get('git_revision')}, {base.get('started_at')})")
+    print(f"new:  {new.get('label') or args.new} ({new.get('git_revision')}, {new.get('started_at')})")
+    if base.get("config") != new.get("config"):
+        print("warning: the runs used different configurations", file=sys.stderr)
+    print()
+
+    print(f"{'metric':<28}{'base':>12}{'new':>12}{'change':>10}")
+    for name, b, n, higher_is_better in rows(base, new):
+        delta = change(b, n)
+        worse = delta is not None and (delta < 0 if higher_is_better else delta > 0)
+        marker = " *" if worse and abs(delta) >= 5 else ""
+        print(f"{name:<28}{b:>12.2f}{n:>12.2f}{fmt_change(delta):>10}{marker}")
+
+    if args.fail_above is not None:
+        found = regressions(base, new, args.fail_above)
+        if found:
+            print(f"\nregressions above {args.fail_above}%: " + ", ".join(found), file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
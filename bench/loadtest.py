@@ -0,0 +1,346 @@
+"""
+End-to-end load test of the exchange API.
+
+Provisions instruments and funded users through the admin API, then runs a weighted mix of
+limit / market / cancel / order book poll requests from concurrent clients for a fixed time.
+The report is JSON (orders/sec, latency percentiles per route, retries, deadlocks), so two
+runs can be diffed with compare.py. The API never retries internally: "retries_503" counts
+this client's retries of 503 + Retry-After responses (matching queue full or unavailable),
+and "deadlocks" is the growth of Postgres's own counter over the run (needs --dsn; a deadlock
+aborts one transaction, which the client only sees as a 500).
+
+    pip install -r bench/requirements.txt
+    python bench/loadtest.py --admin-key $ADMIN_API_KEY --duration 60 --out before.json
+    python bench/loadtest.py --admin-key $ADMIN_API_KEY --duration 60 --out after.json
+    python bench/compare.py before.json after.json
+
+By default it talks to a running server (--base-url). With --asgi it imports app.main:app and
+drives it in-process instead: no network or worker processes, but the client shares its loop.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+
+ROUTES = {
+    "limit": "POST /api/v1/order",
+    "market": "POST /api/v1/order",
+    "cancel": "DELETE /api/v1/order/{order_id}",
+    "orderbook": "GET /api/v1/public/orderbook/{ticker}",
+}
+DEFAULT_MIX = "limit=50,market=10,cancel=15,orderbook=25"
+DEADLOCK_QUERY = "SELECT deadlocks FROM pg_stat_database WHERE datname = current_database()"
+
+
+class Recorder:
+    # Everything finished inside the measured window; warmup requests are dropped
+    def __init__(self):
+        self.recording = False
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.statuses: dict[str, Counter] = defaultdict(Counter)
+        self.errors: Counter = Counter()
+        self.retries: Counter = Counter()
+        self.orders_placed = 0
+
+    def record(self, op: str, status: int | str, seconds: float):
+        if not self.recording:
+            return
+        self.latencies[op].append(seconds)
+        self.statuses[op][str(status)] += 1
+
+
+class User:
+    def __init__(self, user_id: str, api_key: str):
+        self.id = user_id
+        self.headers = {"Authorization": f"TOKEN {api_key}"}
+        self.open_orders: list[str] = []
+
+
+def parse_mix(mix: str) -> dict[str, int]:
+    weights = {}
+    for part in mix.split(","):
+        op, _, weight = part.partition("=")
+        op = op.strip()
+        if op not in ROUTES:
+            raise argparse.ArgumentTypeError(f"unknown operation {op!r}, expected one of {', '.join(ROUTES)}")
+        try:
+            weights[op] = int(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"weight of {op!r} must be an integer")
+    if not any(weights.values()):
+        raise argparse.ArgumentTypeError("at least one weight must be positive")
+    return weights
+
+
+async def call(client: httpx.AsyncClient, recorder: Recorder, op: str, method: str, url: str,
+               max_retries: int, **kwargs) -> httpx.Response | None:
+    # 503 + Retry-After (queue full, matching unavailable) is retried
+    for attempt in range(max_retries + 1):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            recorder.record(op, "transport_error", time.perf_counter() - start)
+            if recorder.recording:
+                recorder.errors[type(e).__name__] += 1
+            return None
+        recorder.record(op, response.status_code, time.perf_counter() - start)
+        if response.status_code == 503 and attempt < max_retries:
+            if recorder.recording:
+                recorder.retries[op] += 1
+            await asyncio.sleep(min(float(response.headers.get("Retry-After", 1)), 1.0))
+            continue
+        return response
+
+
+async def provision(client: httpx.AsyncClient, args) -> tuple[list[User], list[str]]:
+    admin = {"Authorization": f"TOKEN {args.admin_key}"}
+    tickers = [f"BENCH{chr(ord('A') + i)}" for i in range(args.tickers)]
+    for ticker, name in [("RUB", "Russian ruble"), *((t, f"Bench {t}") for t in tickers)]:
+        response = await client.post("/api/v1/admin/instrument", json={"name": name, "ticker": ticker}, headers=admin)
+        if response.status_code not in (200, 400):
+            response.raise_for_status()
+
+    run = uuid.uuid4().hex[:8]
+
+    async def register(index: int) -> User:
+        response = await client.post("/api/v1/public/register", json={"name": f"bench-{run}-{index}"})
+        response.raise_for_status()
+        body = response.json()
+        user = User(body["id"], body["api_key"])
+        for ticker in ["RUB", *tickers]:
+            amount = args.deposit_rub if ticker == "RUB" else args.deposit_qty
+            deposit = await client.post(
+                "/api/v1/admin/balance/deposit",
+                json={"user_id": user.id, "ticker": ticker, "amount": amount},
+                headers=admin,
+            )
+            deposit.raise_for_status()
+        return user
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(index: int) -> User:
+        async with semaphore:
+            return await register(index)
+
+    users = await asyncio.gather(*(limited(i) for i in range(args.users)))
+    return list(users), tickers
+
+
+async def run_client(client: httpx.AsyncClient, recorder: Recorder, users: list[User], tickers: list[str],
+                     weights: dict[str, int], args, deadline: float, rng: random.Random):
+    ops, op_weights = list(weights), list(weights.values())
+    while time.monotonic() < deadline:
+        user = rng.choice(users)
+        ticker = rng.choice(tickers)
+        op = rng.choices(ops, op_weights)[0]
+        if op == "cancel" and not user.open_orders:
+            op = "limit"
+
+        if op == "orderbook":
+            await call(client, recorder, op, "GET", f"/api/v1/public/orderbook/{ticker}",
+                       args.max_retries, params={"limit": 10})
+        elif op == "cancel":
+            order_id = user.open_orders.pop(rng.randrange(len(user.open_orders)))
+            await call(client, recorder, op, "DELETE", f"/api/v1/order/{order_id}",
+                       args.max_retries, headers=user.headers)
+        else:
+            body = {
+                "direction": rng.choice(("BUY", "SELL")),
+                "ticker": ticker,
+                "qty": rng.randint(1, args.max_qty),
+            }
+            if op == "limit":
+                body["price"] = max(1, args.mid_price + rng.randint(-args.spread, args.spread))
+            response = await call(client, recorder, op, "POST", "/api/v1/order",
+                                  args.max_retries, json=body, headers=user.headers)
+            if response is not None and response.status_code == 200:
+                if recorder.recording:
+                    recorder.orders_placed += 1
+                if op == "limit":
+                    user.open_orders.append(response.json()["order_id"])
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    # Nearest rank
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(q * len(sorted_values)) - 1)]
+
+
+def summarize(recorder: Recorder, elapsed: float) -> dict:
+    routes = {}
+    for op in ROUTES:
+        latencies = sorted(recorder.latencies.get(op, ()))
+        statuses = recorder.statuses.get(op, Counter())
+        ok = sum(count for status, count in statuses.items() if status.isdigit() and int(status) < 400)
+        routes[op] = {
+            "route": ROUTES[op],
+            "count": len(latencies),
+            "ok": ok,
+            "rps": len(latencies) / elapsed if elapsed else 0.0,
+            "statuses": dict(sorted(statuses.items())),
+            "retries_503": recorder.retries.get(op, 0),
+            "latency_ms": {
+                "p50": percentile(latencies, 0.50) * 1000,
+                "p90": percentile(latencies, 0.90) * 1000,
+                "p99": percentile(latencies, 0.99) * 1000,
+                "max": (latencies[-1] if latencies else 0.0) * 1000,
+                "mean": (sum(latencies) / len(latencies) if latencies else 0.0) * 1000,
+            },
+        }
+    total = sum(route["count"] for route in routes.values())
+    return {
+        "orders_per_sec": recorder.orders_placed / elapsed if elapsed else 0.0,
+        "requests_per_sec": total / elapsed if elapsed else 0.0,
+        "requests": total,
+        "retries_503": sum(recorder.retries.values()),
+        "transport_errors": dict(recorder.errors),
+        "routes": routes,
+    }
+
+
+async def read_deadlocks(dsn: str | None) -> int | None:
+    if not dsn:
+        return None
+    import asyncpg
+
+    conn = await asyncpg.connect(dsn.replace("postgresql+asyncpg://", "postgresql://"))
+    try:
+        return await conn.fetchval(DEADLOCK_QUERY)
+    finally:
+        await conn.close()
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_client(args) -> tuple[httpx.AsyncClient, object]:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    if not args.asgi:
+        return httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits), None
+
+    # Same import layout as the Docker image (PYTHONPATH=/app/app, gunicorn app.main:app)
+    sys.path[:0] = [str(ROOT / "app"), str(ROOT)]
+    from app.main import app
+
+    transport = httpx.ASGITransport(app=app)
+    return httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout), app
+
+
+async def main(args) -> dict:
+    weights = args.mix
+    client, app = make_client(args)
+    if app is not None:
+        # ASGITransport does not send lifespan events
+        await app.router.startup()
+    try:
+        users, tickers = await provision(client, args)
+        deadlocks_before = await read_deadlocks(args.dsn)
+
+        recorder = Recorder()
+        start = time.monotonic()
+        deadline = start + args.warmup + args.duration
+        rng = random.Random(args.seed)
+        clients = [
+            asyncio.create_task(run_client(
+                client, recorder, users, tickers, weights, args, deadline, random.Random(rng.random())
+            ))
+            for _ in range(args.concurrency)
+        ]
+        await asyncio.sleep(args.warmup)
+        recorder.recording = True
+        measured_from = time.monotonic()
+        await asyncio.gather(*clients)
+        elapsed = time.monotonic() - measured_from
+
+        deadlocks_after = await read_deadlocks(args.dsn)
+    finally:
+        await client.aclose()
+        if app is not None:
+            await app.router.shutdown()
+
+    report = {
+        "label": args.label,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "host": {"python": platform.python_version(), "cpus": os.cpu_count()},
+        "config": {
+            "target": "asgi" if args.asgi else args.base_url,
+            "users": args.users,
+            "tickers": args.tickers,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "mix": weights,
+            "seed": args.seed,
+        },
+        "elapsed_s": elapsed,
+        **summarize(recorder, elapsed),
+        "deadlocks": None if deadlocks_before is None else deadlocks_after - deadlocks_before,
+    }
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the exchange API and write a JSON report")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--asgi", action="store_true", help="drive app.main:app in-process instead of --base-url")
+    parser.add_argument("--admin-key", default=os.environ.get("ADMIN_API_KEY"), help="defaults to $ADMIN_API_KEY")
+    parser.add_argument("--dsn", default=os.environ.get("DATABASE_URL"),
+                        help="Postgres DSN for the deadlock counter (defaults to $DATABASE_URL, optional)")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--tickers", type=int, default=2, choices=range(1, 27), metavar="1..26")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds of traffic before measuring")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help=f"operation weights (default {DEFAULT_MIX})")
+    parser.add_argument("--mid-price", type=int, default=1000)
+    parser.add_argument("--spread", type=int, default=20, help="limit prices are mid-price +- spread")
+    parser.add_argument("--max-qty", type=int, default=10)
+    parser.add_argument("--deposit-rub", type=int, default=1_000_000_000)
+    parser.add_argument("--deposit-qty", type=int, default=1_000_000)
+    parser.add_argument("--max-retries", type=int, default=3, help="retries of a 503 with Retry-After")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--label", default=None, help="free-form name stored in the report")
+    parser.add_argument("--out", default=None, help="report path (default: stdout)")
+    args = parser.parse_args(argv)
+    if not args.admin_key:
+        parser.error("--admin-key or $ADMIN_API_KEY is required to provision users and instruments")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = asyncio.run(main(args))
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.out:
+        Path(args.out).write_text(text + "\n")
+        print(
+            f"{report['orders_per_sec']:.1f} orders/s, {report['requests_per_sec']:.1f} req/s -> {args.out}",
+            file=sys.stderr,
+        )
+    else:
+        print(text)
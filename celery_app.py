@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from app.core.config import settings
 
 celery_app = Celery(
     "app",
@@ -8,7 +9,30 @@ celery_app = Celery(
 )
 
 celery_app.conf.task_routes = {
-    "tasks.match_order": {"queue": "matching"}
+    "tasks.match_order": {"queue": "matching"},
+    "tasks.drain_ticker": {"queue": "matching"},
+    "tasks.requeue_stale_orders": {"queue": "maintenance"},
+    "tasks.maintain_trade_partitions": {"queue": "maintenance"},
+    "tasks.compact_balance_ledger": {"queue": "maintenance"}
 }
 
-import tasks.match_order
\ No newline at end of file
+celery_app.conf.beat_schedule = {
+    "maintain-trade-partitions": {
+        "task": "tasks.maintain_trade_partitions",
+        "schedule": 6 * 60 * 60
+    }
+}
+if settings.BALANCE_MODE == "ledger":
+    celery_app.conf.beat_schedule["compact-balance-ledger"] = {
+        "task": "tasks.compact_balance_ledger",
+        "schedule": settings.BALANCE_COMPACT_INTERVAL_SECONDS
+    }
+if settings.MATCHING_MODE == "queue":
+    celery_app.conf.beat_schedule["requeue-stale-orders"] = {
+        "task": "tasks.requeue_stale_orders",
+        "schedule": settings.MATCHING_QUEUE_SWEEP_INTERVAL_SECONDS
+    }
+
+import tasks.match_order
+import tasks.partitions
+import tasks.balances
\ No newline at end of file
@@ -7,6 +7,12 @@ echo "Waiting for PostgreSQL..."
 echo "Running Alembic migrations..."
 alembic upgrade head
 
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+  # Samples left by the previous run would be added to this one's
+  rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+  mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
 echo "Starting FastAPI..."
 exec gunicorn app.main:app \
   -k uvicorn.workers.UvicornWorker \
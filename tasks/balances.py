@@ -0,0 +1,27 @@
+import logging
+from celery_app import celery_app
+from app.core.config import settings
+from app.core.database import async_session
+from app.repositories.balance import BalanceRepository
+from tasks.loop import run
+
+balance_repo = BalanceRepository()
+
+# Upper bound of batches per run, so one run can't hold the worker indefinitely
+MAX_BATCHES = 10
+
+@celery_app.task(name="tasks.compact_balance_ledger")
+def compact_balance_ledger_task():
+    run(_compact())
+
+async def _compact():
+    folded = 0
+    for _ in range(MAX_BATCHES):
+        async with async_session() as db:
+            accounts = await balance_repo.fold(db, limit=settings.BALANCE_COMPACT_BATCH_SIZE)
+            await db.commit()
+        folded += accounts
+        if accounts == 0:
+            break
+    if folded:
+        logging.info(f"Balance ledger compacted into {folded} balance rows")
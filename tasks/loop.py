@@ -0,0 +1,12 @@
+import asyncio
+
+_loop = None
+
+def run(coro):
+    # Worker processes are long-lived: one event loop per process keeps the engine's
+    # connection pool and the Redis client alive between tasks
+    global _loop
+    if _loop is None:
+        _loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_loop)
+    return _loop.run_until_complete(coro)
@@ -1,24 +1,59 @@
-import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
 from celery_app import celery_app
-from sqlalchemy.ext.asyncio import AsyncSession
-from app.core.database import async_session
+from app.core.config import settings
+from app.core.database import async_session, pool_stats
+from core.metrics import pool_wait
 from app.repositories.order import OrderRepository
-from app.repositories.balance import BalanceRepository
-from app.services.order_matching import OrderMatchingService
+from app.services.order_matching import order_matching_service
+from app.services.matching_queue import matching_queue
+from tasks.loop import run
+
+order_repo = OrderRepository()
+pool_stats.listeners.append(pool_wait.observe)
+
+# Stale orders requeued per sweep
+SWEEP_BATCH_SIZE = 1000
 
 @celery_app.task(name="tasks.match_order", queue="matching")
 def match_order_task(order_id: str):
-    loop = asyncio.get_event_loop()
-    if loop.is_running():
-        asyncio.ensure_future(_inner(order_id))
-    else:
-        loop.run_until_complete(_inner(order_id))
+    run(_inner(order_id))
+
+@celery_app.task(name="tasks.drain_ticker", queue="matching")
+def drain_ticker_task(ticker: str):
+    run(matching_queue.drain(ticker, _match_batch))
+
+@celery_app.task(name="tasks.requeue_stale_orders")
+def requeue_stale_orders_task():
+    run(_requeue_stale())
 
 async def _inner(order_id: str):
     async with async_session() as db:
-        order_repo = OrderRepository()
-        balance_repo = BalanceRepository()
-        matcher = OrderMatchingService(order_repo, balance_repo)
         order = await order_repo.get(db, order_id)
         if order:
-            await matcher.match_order(db, order)
+            await order_matching_service.match_order(db, order)
+
+async def _match_batch(order_ids: list[str]):
+    async with async_session() as db:
+        # A requeued batch may hold orders that were matched before its drainer died (no longer
+        # queued) or that another drainer is matching right now (locked): both are skipped
+        orders = [order for order in await order_repo.get_many(db, order_ids, skip_locked=True) if order.queued]
+        # Read up front: a failed placement expires its order
+        loaded_ids = [order.id for order in orders]
+        results = await order_matching_service.place_batch(db, [(order, None) for order in orders])
+        for order_id, result in zip(loaded_ids, results):
+            if isinstance(result, Exception):
+                logging.error(f"Queued matching failed for order {order_id}: {result}")
+
+async def _requeue_stale():
+    before = datetime.now(timezone.utc) - timedelta(seconds=settings.MATCHING_QUEUE_SWEEP_AFTER_SECONDS)
+    async with async_session() as db:
+        stale = await order_repo.get_stale_queued(db, before, SWEEP_BATCH_SIZE)
+    by_ticker = {}
+    for order_id, ticker in stale:
+        by_ticker.setdefault(ticker, []).append(order_id)
+    for ticker, order_ids in by_ticker.items():
+        # Duplicates of ids still in the backlog are harmless: the second pass skips them
+        await matching_queue.requeue(ticker, order_ids)
+    if stale:
+        logging.warning(f"Requeued {len(stale)} orders that were never matched")
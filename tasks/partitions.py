@@ -0,0 +1,32 @@
+import logging
+from datetime import date
+from celery_app import celery_app
+from app.core.config import settings
+from app.core.database import async_session
+from app.repositories.transaction import TransactionRepository, next_month
+from tasks.loop import run
+
+transaction_repo = TransactionRepository()
+
+@celery_app.task(name="tasks.maintain_trade_partitions")
+def maintain_trade_partitions_task():
+    run(_maintain())
+
+async def _maintain():
+    this_month = date.today().replace(day=1)
+    last = this_month
+    for _ in range(settings.TRADES_PARTITIONS_AHEAD):
+        last = next_month(last)
+
+    async with async_session() as db:
+        created = await transaction_repo.ensure_partitions(db, this_month, last)
+        detached = []
+        if settings.TRADES_RETENTION_MONTHS > 0:
+            cutoff = this_month
+            for _ in range(settings.TRADES_RETENTION_MONTHS):
+                cutoff = date(cutoff.year - (cutoff.month == 1), (cutoff.month - 2) % 12 + 1, 1)
+            detached = await transaction_repo.detach_partitions(db, cutoff)
+        await db.commit()
+
+    if created or detached:
+        logging.info(f"Trade partitions created: {created}, detached: {detached}")
@@ -0,0 +1,12 @@
+import importlib
+
+
+def test_app_imports():
+    # Importing the app pulls in the routers, the Celery app and every task module
+    main = importlib.import_module("app.main")
+    assert main.app.routes
+
+
+def test_worker_imports():
+    celery_app = importlib.import_module("celery_app")
+    assert "tasks.drain_ticker" in celery_app.celery_app.tasks
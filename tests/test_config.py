@@ -0,0 +1,17 @@
+import pytest
+from pydantic import ValidationError
+
+from core.config import Settings
+
+
+def test_memory_engine_requires_actor_mode():
+    with pytest.raises(ValidationError):
+        Settings(MATCHING_ENGINE="memory", MATCHING_MODE="inline")
+    with pytest.raises(ValidationError):
+        Settings(MATCHING_ENGINE="memory", MATCHING_MODE="queue")
+    assert Settings(MATCHING_ENGINE="db", MATCHING_MODE="queue").MATCHING_MODE == "queue"
+
+
+def test_defaults_run_the_memory_engine_behind_actors():
+    settings = Settings()
+    assert (settings.MATCHING_ENGINE, settings.MATCHING_MODE) == ("memory", "actor")
@@ -0,0 +1,42 @@
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+from core.log_segments import LogStore
+
+T0 = datetime(2025, 3, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def write_segment(directory, pid, seconds):
+    # An active (unindexed) segment of worker `pid` with one line per offset in `seconds`
+    stamp = (T0 + timedelta(seconds=seconds[0])).strftime("%Y%m%dT%H%M%S%f")
+    path = directory / f"requests-{pid}-{stamp}.jsonl"
+    path.write_text("".join(
+        json.dumps({"ts": (T0 + timedelta(seconds=s)).isoformat(), "pid": pid, "n": s}) + "\n"
+        for s in seconds
+    ))
+    end = (T0 + timedelta(seconds=seconds[-1])).timestamp()
+    os.utime(path, (end, end))
+
+
+def read(store, **kwargs):
+    return [(line["pid"], line["n"]) for line in map(json.loads, store.read(**kwargs))]
+
+
+def test_concurrent_workers_are_merged_by_timestamp(tmp_path):
+    write_segment(tmp_path, 1, [0, 2, 4, 6])
+    write_segment(tmp_path, 2, [1, 3, 5])
+    store = LogStore(str(tmp_path))
+
+    assert read(store) == [(1, 0), (2, 1), (1, 2), (2, 3), (1, 4), (2, 5), (1, 6)]
+    assert read(store, tail=3) == [(1, 4), (2, 5), (1, 6)]
+    assert read(store, since=T0 + timedelta(seconds=2), until=T0 + timedelta(seconds=4)) == [(1, 2), (2, 3), (1, 4)]
+
+
+def test_tail_spans_consecutive_segments(tmp_path):
+    write_segment(tmp_path, 1, [0, 1, 2])
+    write_segment(tmp_path, 1, [10, 11])
+    store = LogStore(str(tmp_path))
+
+    assert read(store, tail=3) == [(1, 2), (1, 10), (1, 11)]
+    assert read(store, tail=10) == [(1, 0), (1, 1), (1, 2), (1, 10), (1, 11)]
@@ -0,0 +1,184 @@
+import asyncio
+from contextlib import asynccontextmanager
+from uuid import uuid4
+
+import pytest
+from fastapi import HTTPException
+
+from core.config import settings
+from core.exceptions import InsufficientBalanceException, MatchingUnavailableException
+from core.models.order import Order, OrderStatus
+from services import matching_actor
+from services.matching_actor import MatchingActors
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(autouse=True)
+def fast_timeouts(monkeypatch):
+    monkeypatch.setattr(settings, "MATCHING_FORWARD_TIMEOUT_SECONDS", 0.5)
+    monkeypatch.setattr(settings, "MATCHING_BATCH_WINDOW_MS", 1)
+
+
+class FakeRedis:
+    # The handful of commands the actors use, on one shared in-memory keyspace
+    def __init__(self):
+        self.values = {}
+        self.lists = {}
+        self._changed = asyncio.Condition()
+
+    async def set(self, key, value, nx=False, px=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        return True
+
+    async def eval(self, script, numkeys, key, token, *args):
+        if self.values.get(key) != token:
+            return 0
+        if script == matching_actor.RELEASE_SCRIPT:
+            del self.values[key]
+        return 1
+
+    async def rpush(self, key, value):
+        async with self._changed:
+            self.lists.setdefault(key, []).append(value)
+            self._changed.notify_all()
+        return len(self.lists[key])
+
+    async def expire(self, key, seconds):
+        return 1
+
+    async def blpop(self, keys, timeout=0):
+        async def pop():
+            async with self._changed:
+                while True:
+                    for key in keys:
+                        if self.lists.get(key):
+                            return [key, self.lists[key].pop(0)]
+                    await self._changed.wait()
+        try:
+            return await asyncio.wait_for(pop(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class FakeMatcher:
+    def __init__(self):
+        self.placed = []
+        self.cancelled = []
+
+    async def cancel(self, db, order_id, user_id):
+        if order_id not in [order.id for order, _ in self.placed]:
+            raise HTTPException(status_code=404, detail="Order not found")
+        self.cancelled.append((order_id, user_id))
+
+    async def place_batch(self, db, placements):
+        results = []
+        for order, reserve in placements:
+            self.placed.append((order, reserve))
+            if order.qty > 100:
+                results.append(InsufficientBalanceException("Недостаточно средств для резервации"))
+            else:
+                results.append(order.id)
+        return results
+
+
+@asynccontextmanager
+async def no_session():
+    yield None
+
+
+def new_order(qty=1, price=100):
+    return Order(
+        id=uuid4(), user_id=uuid4(), status=OrderStatus.NEW, direction="BUY",
+        ticker="MEMCOIN", qty=qty, price=price, filled=0
+    )
+
+
+async def test_second_process_forwards_to_the_owner():
+    redis = FakeRedis()
+    owner_matcher, other_matcher = FakeMatcher(), FakeMatcher()
+    owner = MatchingActors(redis, no_session, owner_matcher)
+    other = MatchingActors(redis, no_session, other_matcher)
+    try:
+        first = new_order()
+        assert await owner.submit("MEMCOIN", first, ("RUB", 100)) == first.id
+
+        forwarded = new_order(price=None)
+        assert await other.submit("MEMCOIN", forwarded, None) == forwarded.id
+
+        assert other_matcher.placed == []
+        placed_order, reserve = owner_matcher.placed[1]
+        assert (placed_order.id, placed_order.user_id, placed_order.price) == (forwarded.id, forwarded.user_id, None)
+        assert reserve is None
+    finally:
+        await owner.stop()
+        await other.stop()
+
+
+async def test_forwarded_rejection_keeps_its_type():
+    redis = FakeRedis()
+    owner = MatchingActors(redis, no_session, FakeMatcher())
+    other = MatchingActors(redis, no_session, FakeMatcher())
+    try:
+        await owner.submit("MEMCOIN", new_order(), ("RUB", 100))
+        with pytest.raises(InsufficientBalanceException):
+            await other.submit("MEMCOIN", new_order(qty=1000), ("RUB", 100_000))
+    finally:
+        await owner.stop()
+        await other.stop()
+
+
+async def test_cancels_are_forwarded_to_the_owner():
+    redis = FakeRedis()
+    owner_matcher, other_matcher = FakeMatcher(), FakeMatcher()
+    owner = MatchingActors(redis, no_session, owner_matcher)
+    other = MatchingActors(redis, no_session, other_matcher)
+    try:
+        order = new_order()
+        await owner.submit("MEMCOIN", order, ("RUB", 100))
+        assert await other.cancel("MEMCOIN", order.id, order.user_id) is None
+        assert owner_matcher.cancelled == [(order.id, order.user_id)]
+
+        with pytest.raises(HTTPException) as missing:
+            await other.cancel("MEMCOIN", uuid4(), order.user_id)
+        assert (missing.value.status_code, missing.value.detail) == (404, "Order not found")
+        assert other_matcher.cancelled == []
+    finally:
+        await owner.stop()
+        await other.stop()
+
+
+async def test_unanswered_forward_is_unavailable_and_dropped_later():
+    redis = FakeRedis()
+    # A lease held by a process that no longer serves its inbox
+    redis.values["matching:owner:MEMCOIN"] = "gone"
+    other_matcher = FakeMatcher()
+    other = MatchingActors(redis, no_session, other_matcher)
+    with pytest.raises(MatchingUnavailableException):
+        await other.submit("MEMCOIN", new_order(), ("RUB", 100))
+
+    # Once the lease is free the next owner skips the expired job
+    del redis.values["matching:owner:MEMCOIN"]
+    late = new_order()
+    try:
+        assert await other.submit("MEMCOIN", late, ("RUB", 100)) == late.id
+        await asyncio.sleep(0.05)
+        assert [order.id for order, _ in other_matcher.placed] == [late.id]
+    finally:
+        await other.stop()
+
+
+async def test_stop_releases_the_lease():
+    redis = FakeRedis()
+    owner = MatchingActors(redis, no_session, FakeMatcher())
+    await owner.submit("MEMCOIN", new_order(), ("RUB", 100))
+    assert "matching:owner:MEMCOIN" in redis.values
+    await owner.stop()
+    assert "matching:owner:MEMCOIN" not in redis.values
@@ -0,0 +1,112 @@
+import pytest
+
+from services import matching_queue
+from services.matching_queue import MatchingQueue
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+class FakeRedis:
+    # Lists, keys and the queue's scripts, run the way Redis would
+    def __init__(self):
+        self.values = {}
+        self.lists = {}
+
+    async def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        return True
+
+    async def delete(self, key):
+        self.values.pop(key, None)
+        self.lists.pop(key, None)
+
+    async def expire(self, key, seconds):
+        return 1
+
+    async def llen(self, key):
+        return len(self.lists.get(key, []))
+
+    async def rpush(self, key, *values):
+        self.lists.setdefault(key, []).extend(values)
+        return len(self.lists[key])
+
+    async def eval(self, script, numkeys, *args):
+        if script == matching_queue.RELEASE_SCRIPT:
+            key, token = args
+            if self.values.get(key) == token:
+                del self.values[key]
+            return 0
+        backlog = self.lists.setdefault(args[0], [])
+        processing = self.lists.setdefault(args[1], [])
+        if script == matching_queue.CLAIM_SCRIPT:
+            ids = backlog[:int(args[2])]
+            del backlog[:len(ids)]
+            processing.extend(ids)
+            return ids
+        returned = len(processing)
+        backlog[:0] = processing
+        processing.clear()
+        return returned
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    monkeypatch.setattr(matching_queue.settings, "MATCHING_QUEUE_BATCH_SIZE", 2)
+    queue = MatchingQueue(FakeRedis())
+    queue.scheduled = []
+
+    async def schedule(ticker):
+        queue.scheduled.append(ticker)
+
+    monkeypatch.setattr(queue, "_schedule", schedule)
+    return queue
+
+
+async def test_drain_acknowledges_each_batch_after_the_handler(queue):
+    await queue.requeue("MEMCOIN", ["a", "b", "c"])
+    batches = []
+
+    async def handler(order_ids):
+        # Still in the processing list while being matched
+        assert queue._redis.lists["matching:processing:MEMCOIN"] == order_ids
+        batches.append(order_ids)
+
+    await queue.drain("MEMCOIN", handler)
+
+    assert batches == [["a", "b"], ["c"]]
+    assert await queue.depth("MEMCOIN") == 0
+    assert queue._redis.lists.get("matching:processing:MEMCOIN", []) == []
+
+
+async def test_failed_batch_goes_back_to_the_head_of_the_backlog(queue):
+    await queue.requeue("MEMCOIN", ["a", "b", "c"])
+
+    async def handler(order_ids):
+        raise RuntimeError("database unavailable")
+
+    await queue.drain("MEMCOIN", handler)
+
+    assert queue._redis.lists["matching:backlog:MEMCOIN"] == ["a", "b", "c"]
+    assert queue._redis.lists["matching:processing:MEMCOIN"] == []
+    # Retried by the next drain instead of waiting for a new order
+    assert queue.scheduled[-1] == "MEMCOIN"
+
+
+async def test_batch_of_an_interrupted_drain_is_matched_first(queue):
+    queue._redis.lists["matching:processing:MEMCOIN"] = ["a"]
+    queue._redis.lists["matching:backlog:MEMCOIN"] = ["b"]
+    batches = []
+
+    async def handler(order_ids):
+        batches.append(order_ids)
+
+    await queue.drain("MEMCOIN", handler)
+
+    assert batches == [["a", "b"]]
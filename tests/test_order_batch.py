@@ -0,0 +1,105 @@
+from types import SimpleNamespace
+from uuid import uuid4
+
+import pytest
+
+from api.routers import orders
+from core.config import settings
+from core.exceptions import InsufficientBalanceException, MatchingUnavailableException
+from core.models.order import Order, OrderStatus
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(autouse=True)
+def instruments(monkeypatch):
+    async def get(ticker):
+        return ticker if ticker in ("MEMCOIN", "DODGE") else None
+
+    monkeypatch.setattr(orders.instrument_catalog, "get", get)
+
+
+def limit(qty, ticker="MEMCOIN", price=100):
+    return {"direction": "BUY", "ticker": ticker, "qty": qty, "price": price}
+
+
+async def test_actor_batch_reports_each_order_on_its_own(monkeypatch):
+    monkeypatch.setattr(settings, "MATCHING_MODE", "actor")
+
+    async def submit(ticker, order, reserve):
+        if order.qty == 2:
+            raise InsufficientBalanceException("Недостаточно средств для резервации")
+        if order.qty == 3:
+            raise MatchingUnavailableException("Matching of MEMCOIN did not answer in time")
+        if order.qty == 4:
+            raise RuntimeError("connection reset")
+        return order.id
+
+    monkeypatch.setattr(orders.matching_actors, "submit", submit)
+    user = SimpleNamespace(id=uuid4())
+    body = {"orders": [limit(1), limit(2), limit(3), limit(4), limit(1, ticker="NOPE"), {"ticker": "MEMCOIN"}, limit(5)]}
+
+    response = await orders.create_orders_batch(body=body, db=None, user=user)
+
+    results = response.results
+    assert [result.success for result in results] == [True, False, False, False, False, False, True]
+    assert results[1].error == "Недостаточно средств для резервации"
+    assert results[2].error == "Matching of MEMCOIN did not answer in time"
+    assert results[3].error == "Order matching failed"
+    assert results[4].error == "Instrument not found"
+    assert results[0].order_id and results[6].order_id
+
+
+async def test_failed_inline_placements_are_cancelled_and_reported(monkeypatch):
+    placed = [
+        Order(id=uuid4(), user_id=uuid4(), status=OrderStatus.NEW, direction="BUY",
+              ticker="MEMCOIN", qty=qty, price=100, filled=0)
+        for qty in (1, 2, 3)
+    ]
+    cancelled = []
+
+    async def place_batch(db, placements):
+        return [order.id if order.qty != 2 else RuntimeError("savepoint failed") for order, _ in placements]
+
+    async def cancel_unplaced(db, keys):
+        cancelled.extend(keys)
+
+    monkeypatch.setattr(orders.order_matching_service, "place_batch", place_batch)
+    monkeypatch.setattr(orders.order_matching_service, "cancel_unplaced", cancel_unplaced)
+    results = [None] * 4
+
+    await orders._place_ticker(None, list(zip((0, 1, 3), placed)), results)
+
+    # Stored and frozen already: the failed one must not stay on the book
+    assert cancelled == [(placed[1].id, "MEMCOIN")]
+    assert [result and result.success for result in results] == [True, False, None, True]
+    assert results[1].error == "Order matching failed"
+
+
+async def test_whole_ticker_failure_cancels_every_order(monkeypatch):
+    placed = [
+        Order(id=uuid4(), user_id=uuid4(), status=OrderStatus.NEW, direction="SELL",
+              ticker="DODGE", qty=1, price=100, filled=0)
+        for _ in range(2)
+    ]
+    cancelled = []
+
+    async def place_batch(db, placements):
+        raise RuntimeError("commit failed")
+
+    async def cancel_unplaced(db, keys):
+        cancelled.extend(keys)
+
+    monkeypatch.setattr(orders.order_matching_service, "place_batch", place_batch)
+    monkeypatch.setattr(orders.order_matching_service, "cancel_unplaced", cancel_unplaced)
+    results = [None] * 2
+
+    await orders._place_ticker(None, list(enumerate(placed)), results)
+
+    assert cancelled == [(order.id, "DODGE") for order in placed]
+    assert [result.success for result in results] == [False, False]
@@ -0,0 +1,139 @@
+from uuid import uuid4
+
+import pytest
+
+from services.order_book import L2View, OrderBook, OrderBookRegistry
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+class VersionRedis:
+    # SET_MAX_SCRIPT and the version read, nothing else
+    def __init__(self):
+        self.values = {}
+
+    async def eval(self, script, numkeys, key, value):
+        self.values[key] = max(int(self.values.get(key, 0)), int(value))
+
+    async def get(self, key):
+        return self.values.get(key)
+
+
+def make_book(*orders):
+    book = OrderBook("MEMCOIN")
+    ids = []
+    for direction, price, qty in orders:
+        order_id = uuid4()
+        book.add(order_id, uuid4(), direction, price, qty)
+        ids.append(order_id)
+    return book, ids
+
+
+def plan_of(plan):
+    return [(entry.price, entry.qty, qty) for entry, qty in plan]
+
+
+def test_match_plan_walks_best_price_first():
+    book, _ = make_book(("SELL", 102, 5), ("SELL", 100, 3), ("SELL", 101, 4))
+    assert plan_of(book.match_plan("BUY", None, 10)) == [(100, 3, 3), (101, 4, 4), (102, 5, 3)]
+
+
+def test_match_plan_respects_limit_price():
+    book, _ = make_book(("BUY", 99, 5), ("BUY", 101, 2), ("BUY", 100, 4))
+    assert plan_of(book.match_plan("SELL", 100, 10)) == [(101, 2, 2), (100, 4, 4)]
+    assert book.match_plan("SELL", 102, 10) == []
+
+
+def test_match_plan_keeps_time_priority_within_a_level():
+    book, ids = make_book(("SELL", 100, 1), ("SELL", 100, 1), ("SELL", 100, 1))
+    plan = book.match_plan("BUY", 100, 2)
+    assert [entry.order_id for entry, _ in plan] == ids[:2]
+
+
+def test_fill_and_remove_maintain_levels():
+    book, ids = make_book(("SELL", 100, 3), ("SELL", 100, 2), ("SELL", 101, 1))
+    entry, qty = book.match_plan("BUY", None, 1)[0]
+    book.fill(entry, qty)
+    assert book.asks.level_qty == {100: 4, 101: 1}
+
+    book.fill(entry, 2)
+    book.remove(ids[2])
+    assert book.asks.level_qty == {100: 2}
+    assert plan_of(book.match_plan("BUY", None, 5)) == [(100, 2, 2)]
+
+    book.remove(ids[1])
+    assert book.asks.level_qty == {}
+    assert book.match_plan("BUY", None, 5) == []
+
+
+def test_add_ignores_duplicates_and_empty_orders():
+    book, ids = make_book(("BUY", 100, 2))
+    book.add(ids[0], uuid4(), "BUY", 100, 2)
+    book.add(uuid4(), uuid4(), "BUY", 100, 0)
+    assert book.bids.level_qty == {100: 2}
+
+
+def test_take_changes_reports_changed_levels_once():
+    book, ids = make_book(("BUY", 100, 2), ("SELL", 105, 1))
+    assert sorted(book.take_changes()) == [("BUY", 100, 2), ("SELL", 105, 1)]
+    assert book.take_changes() == []
+
+    book.remove(ids[1])
+    assert book.take_changes() == [("SELL", 105, 0)]
+
+
+def test_l2_view_apply_and_delta():
+    view = L2View(1, {100: 2}, {105: 1})
+    view.apply(2, [("BUY", 101, 3)])
+    view.apply(3, [("SELL", 105, 0), ("BUY", 101, 1)])
+
+    assert view.levels(10) == ([(101, 1), (100, 2)], [])
+    assert view.delta(3) == []
+    assert sorted(view.delta(1)) == [("BUY", 101, 1), ("SELL", 105, 0)]
+    assert view.delta(2) == [("SELL", 105, 0), ("BUY", 101, 1)]
+    # Not a version the view passed through: the client needs a snapshot
+    assert view.delta(0) is None
+
+
+def test_l2_view_reset_keeps_history_contiguous():
+    view = L2View(1, {100: 2}, {105: 1})
+    view.reset(4, {100: 2, 99: 5}, {})
+    assert view.version == 4
+    assert view.levels(10) == ([(100, 2), (99, 5)], [])
+    assert sorted(view.delta(1)) == [("BUY", 99, 5), ("SELL", 105, 0)]
+
+
+def test_l2_view_levels_limit():
+    view = L2View(1, {100: 1, 101: 1, 102: 1}, {103: 1, 104: 1})
+    assert view.levels(2) == ([(102, 1), (101, 1)], [(103, 1), (104, 1)])
+
+
+@pytest.mark.anyio
+async def test_published_levels_move_the_view_without_a_reload():
+    redis = VersionRedis()
+    registry = OrderBookRegistry(redis)
+    registry._install("MEMCOIN", 4, {100: 2}, {105: 1})
+
+    step = await registry.publish_levels("MEMCOIN", 5, [("BUY", 100, 0), ("SELL", 104, 3)])
+
+    assert step == (4, 5, [("BUY", 100, 0), ("SELL", 104, 3)])
+    assert redis.values["orderbook:version:MEMCOIN"] == 5
+    # Current with the shared version, so l2() answers without touching the database
+    view = await registry.l2("MEMCOIN")
+    assert view.version == 5
+    assert view.levels(10) == ([], [(104, 3), (105, 1)])
+    assert sorted(view.delta(4)) == [("BUY", 100, 0), ("SELL", 104, 3)]
+
+
+@pytest.mark.anyio
+async def test_published_levels_skip_a_view_that_missed_a_step():
+    registry = OrderBookRegistry(VersionRedis())
+    registry._install("MEMCOIN", 3, {100: 2}, {})
+
+    await registry.publish_levels("MEMCOIN", 5, [("BUY", 100, 0)])
+
+    view = registry._views["MEMCOIN"]
+    assert (view.version, view.bids) == (3, {100: 2})
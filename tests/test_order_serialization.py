@@ -0,0 +1,45 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from uuid import uuid4
+
+import pytest
+
+pytest.importorskip("fastapi")
+# Rows loaded through asyncpg carry its UUID type, not uuid.UUID
+AsyncpgUUID = pytest.importorskip("asyncpg.pgproto.pgproto").UUID
+
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+from api.routers.orders import _build_order_response, _order_dict
+from core.responses import FastJSONResponse
+from core.schemas.order import OrderResponse
+from core.types import OrderStatus
+
+
+def make_row(price):
+    return SimpleNamespace(
+        id=AsyncpgUUID(str(uuid4())),
+        user_id=AsyncpgUUID(str(uuid4())),
+        status=OrderStatus.PARTIALLY_EXECUTED,
+        direction="BUY",
+        ticker="MEMCOIN",
+        qty=10,
+        filled=3,
+        price=price,
+        created_at=datetime(2025, 3, 1, 12, 30, 45, 123456, tzinfo=timezone.utc),
+    )
+
+
+@pytest.mark.parametrize("price", [100, None], ids=["limit", "market"])
+def test_order_dict_renders_like_the_response_model(price):
+    rows = [make_row(price), make_row(price)]
+
+    fast = FastJSONResponse([_order_dict(row) for row in rows]).body
+
+    # What FastAPI sends for response_model=list[OrderResponse]
+    adapter = TypeAdapter(list[OrderResponse])
+    models = [_build_order_response(row) for row in rows]
+    expected = JSONResponse(adapter.dump_python(models, mode="json", by_alias=True)).body
+
+    assert fast == expected
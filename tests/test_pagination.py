@@ -0,0 +1,26 @@
+from datetime import datetime, timezone
+from uuid import uuid4
+
+import pytest
+from fastapi import HTTPException
+
+from core.pagination import decode_cursor, encode_cursor
+
+
+def test_cursor_round_trips_to_the_microsecond():
+    created_at = datetime(2025, 3, 1, 12, 30, 45, 123456, tzinfo=timezone.utc)
+    order_id = uuid4()
+
+    assert decode_cursor(encode_cursor(created_at, order_id), type(order_id)) == (created_at, order_id)
+    assert decode_cursor(encode_cursor(created_at, 42), int) == (created_at, 42)
+
+
+def test_missing_cursor_is_the_first_page():
+    assert decode_cursor(None) is None
+
+
+@pytest.mark.parametrize("cursor", ["", "garbage", "abc_1", "1740832245123456_not-a-uuid"])
+def test_malformed_cursor_is_a_bad_request(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor, type(uuid4()))
+    assert error.value.status_code == 400
@@ -0,0 +1,41 @@
+from contextlib import asynccontextmanager
+
+import pytest
+
+from core.database import ReplicaMonitor
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+class FakeEngine:
+    def __init__(self, lag):
+        self.lag = lag
+
+    @asynccontextmanager
+    async def connect(self):
+        yield self
+
+    async def execute(self, statement):
+        return self
+
+    def scalar(self):
+        return self.lag
+
+
+async def test_probe_records_the_lag():
+    monitor = ReplicaMonitor(FakeEngine(1.5))
+    await monitor._probe()
+    assert monitor.lag == 1.5
+
+
+async def test_replica_without_a_wal_receiver_is_unavailable():
+    # The lag query yields NULL when the standby is not streaming from the primary
+    monitor = ReplicaMonitor(FakeEngine(None))
+    monitor.lag = 0.0
+    await monitor._probe()
+    assert monitor.lag is None
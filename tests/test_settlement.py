@@ -0,0 +1,127 @@
+from types import SimpleNamespace
+from uuid import uuid4
+
+import pytest
+
+from repositories.balance import BalanceRepository
+from services.settlement import Settlement
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def order(user_id, price=100):
+    return SimpleNamespace(id=uuid4(), user_id=user_id, price=price)
+
+
+class FakeBalances:
+    def __init__(self):
+        self.applied = []
+
+    async def apply_deltas(self, db, deltas, unreserved):
+        self.applied.append((deltas, unreserved))
+
+
+class FakeTransactions:
+    async def insert_trades(self, db, trades):
+        return [{**trade, "seq": seq} for seq, trade in enumerate(trades, 1)]
+
+
+def test_fills_are_netted_per_account():
+    buyer, seller = uuid4(), uuid4()
+    settlement = Settlement()
+    buy = order(buyer)
+    settlement.trade("MEMCOIN", buy, order(seller, 90), 2, 90)
+    settlement.trade("MEMCOIN", buy, order(seller, 95), 3, 95)
+
+    assert sorted(settlement.deltas()) == sorted([
+        (buyer, "RUB", 0, -(2 * 90 + 3 * 95)),
+        (buyer, "MEMCOIN", 5, 0),
+        (seller, "MEMCOIN", 0, -5),
+        (seller, "RUB", 2 * 90 + 3 * 95, 0),
+    ])
+    assert [trade["amount"] for trade in settlement.trades] == [2, 3]
+
+
+def test_self_trade_nets_to_moving_frozen_into_amount():
+    user = uuid4()
+    settlement = Settlement()
+    settlement.trade("MEMCOIN", order(user), order(user), 4, 100)
+
+    # Both legs hit the same two accounts: what was frozen comes back as spendable
+    assert sorted(settlement.deltas()) == sorted([
+        (user, "MEMCOIN", 4, -4),
+        (user, "RUB", 400, -400),
+    ])
+
+
+def test_leftover_unfreeze_joins_the_fill_deltas():
+    buyer, seller = uuid4(), uuid4()
+    settlement = Settlement()
+    settlement.trade("MEMCOIN", order(buyer, 100), order(seller, 100), 2, 100)
+    # The buy order was for 5 @ 100: the 3 it didn't fill are released
+    settlement.unfreeze(buyer, "RUB", 300)
+
+    assert (buyer, "RUB", 300, -500) in settlement.deltas()
+
+
+def test_changes_that_cancel_out_are_dropped():
+    user = uuid4()
+    settlement = Settlement()
+    settlement.deposit(user, "RUB", 10)
+    settlement.spend_frozen(user, "RUB", 0)
+    settlement.unfreeze(user, "MEMCOIN", 0)
+
+    assert settlement.deltas() == [(user, "RUB", 10, 0)]
+
+
+async def test_only_the_market_side_is_unreserved():
+    market_buyer, seller = uuid4(), uuid4()
+    settlement = Settlement()
+    settlement.trade("MEMCOIN", order(market_buyer, None), order(seller), 1, 100)
+
+    balances = FakeBalances()
+    await settlement.apply(None, balances, FakeTransactions())
+
+    (deltas, unreserved), = balances.applied
+    assert unreserved == {(market_buyer, "RUB")}
+    assert len(deltas) == 4
+    assert settlement.trades[0]["seq"] == 1
+    # Applied once: a second apply has nothing left to write
+    await settlement.apply(None, balances, FakeTransactions())
+    assert len(balances.applied) == 1
+
+
+async def test_ledger_appends_reserved_deltas_and_settles_unreserved_rows():
+    market_buyer, seller = uuid4(), uuid4()
+    settlement = Settlement()
+    settlement.trade("MEMCOIN", order(market_buyer, None), order(seller), 1, 100)
+    deltas = settlement.deltas()
+
+    repo = BalanceRepository("ledger")
+    folded, settled, statements = [], [], []
+
+    async def fold(db, user_id=None, ticker=None, limit=None):
+        folded.append((user_id, ticker))
+
+    async def settle_rows(db, rows):
+        settled.extend(rows)
+
+    class DB:
+        async def execute(self, statement):
+            statements.append(statement)
+
+    repo.fold = fold
+    repo._settle_rows = settle_rows
+    await repo.apply_deltas(DB(), deltas, {(market_buyer, "RUB")})
+
+    # The market buyer's RUB was never frozen for it: folded and checked against the row
+    assert folded == [(market_buyer, "RUB")]
+    assert settled == [delta for delta in deltas if delta[:2] == (market_buyer, "RUB")]
+    # Everything else goes to the ledger in one insert
+    assert len(statements) == 1
+    assert statements[0].table.name == "balance_ledger"
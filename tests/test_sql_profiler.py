@@ -0,0 +1,24 @@
+from datetime import datetime
+from uuid import uuid4
+
+from core.sql_profiler import param_shape
+
+
+def test_values_are_replaced_by_their_types():
+    assert param_shape({"api_key": "secret", "amount": 100}) == {"api_key": "str", "amount": "int"}
+    assert param_shape((uuid4(), datetime(2025, 1, 1))) == ["UUID", "datetime"]
+
+
+def test_sequences_show_only_their_length():
+    assert param_shape({"ids": [uuid4(), uuid4(), uuid4()]}) == {"ids": "list[3]"}
+
+
+def test_executemany_batches_are_summarized_by_their_first_row():
+    rows = [{"user_id": uuid4(), "amount": amount} for amount in range(5)]
+    assert param_shape(rows) == "5 x {'user_id': 'UUID', 'amount': 'int'}"
+    assert param_shape([(1, "RUB"), (2, "RUB")]) == "2 x ['int', 'str']"
+
+
+def test_empty_and_missing_parameters():
+    assert param_shape(()) == []
+    assert param_shape(None) == "NoneType"
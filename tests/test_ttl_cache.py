@@ -0,0 +1,47 @@
+from core import cache
+from core.cache import TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    users = TTLCache(maxsize=10, ttl=5)
+    users.set("key", "user")
+
+    clock.now += 4.9
+    assert users.get("key") == "user"
+    clock.now += 0.2
+    assert users.get("key") is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    users = TTLCache(maxsize=2, ttl=60)
+    users.set("a", 1)
+    users.set("b", 2)
+    users.get("a")
+    users.set("c", 3)
+
+    assert (users.get("a"), users.get("b"), users.get("c")) == (1, None, 3)
+
+
+def test_stale_generation_does_not_put_back_an_invalidated_entry():
+    users = TTLCache(maxsize=10, ttl=60)
+    users.set("key", "old")
+    # A loader reads the generation, then the entry is invalidated before it stores its result
+    generation = users.generation
+    users.pop("key")
+    users.set("key", "stale", generation)
+    assert users.get("key") is None
+
+    users.set("key", "fresh", users.generation)
+    assert users.get("key") == "fresh"
+    users.clear()
+    assert users.get("key") is None